@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Compares the makespan of the local scheduler with and without the critical path dispatch order on synthetic DAGs of jobs.
+
+Generates a random DAG of chains of jobs with random lengths and runtimes (and some random dependencies between the chains), submits the chains in random order to a fresh database, and runs them with ``jman run-scheduler --die-when-finished``, once in the order of their ids (FIFO) and once with ``--critical-path``.
+The jobs sleep for their runtime, so the makespan is dominated by the dispatch order and not by the CPU load of the machine::
+
+  $ python benchmarks/critical_path.py --chains 16 --parallel 6
+
+By default, each job counts 1 for the critical path; to use the actual runtimes of the jobs as estimates::
+
+  $ python benchmarks/critical_path.py --chains 16 --parallel 6 --estimates
+"""
+
+from __future__ import print_function
+
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+
+from gridtk.local import JobManagerLocal
+
+
+def _dag(chains, max_length, cross, scale, seed):
+  """Returns the runtimes of the jobs and the indexes of the jobs that each job depends on, in the order of submission."""
+  generator = random.Random(seed)
+  runtimes, dependencies, members = [], [], []
+  for _ in range(chains):
+    # most chains are short, some are long
+    length = min(int(generator.expovariate(3. / max_length)) + 1, max_length)
+    members.append(list(range(len(runtimes), len(runtimes) + length)))
+    for position in range(length):
+      runtimes.append(round(generator.uniform(0.1, 1.) * scale, 3))
+      dependencies.append([len(runtimes) - 2] if position else [])
+  # some jobs also wait for a random earlier job of another chain
+  for index in range(1, len(runtimes)):
+    if generator.random() < cross:
+      dependencies[index].append(generator.randrange(index))
+  # the chains are submitted one after the other, in random order; the dependencies need to refer to earlier jobs of the batch
+  generator.shuffle(members)
+  order = _topological([index for chain in members for index in chain], dependencies)
+  position = dict((index, i) for i, index in enumerate(order))
+  return [runtimes[index] for index in order], [sorted(set(position[d] for d in dependencies[index])) for index in order]
+
+
+def _topological(order, dependencies):
+  """Returns the given order of jobs, where jobs are moved behind the jobs that they depend on."""
+  result, done = [], set()
+  def visit(index):
+    if index not in done:
+      done.add(index)
+      for dependency in dependencies[index]:
+        visit(dependency)
+      result.append(index)
+  for index in order:
+    visit(index)
+  return result
+
+
+def _makespan(directory, runtimes, dependencies, parallel, critical_path, estimates):
+  """Runs the jobs of the DAG with the given dispatch order, and returns the time until all jobs have finished."""
+  database = os.path.join(directory, '%s.sql3' % ('critical_path' if critical_path else 'fifo'))
+  job_manager = JobManagerLocal(database=database)
+  job_manager.submit_many([{'command_line' : ['/bin/sleep', str(runtime)], 'batch_dependencies' : deps} for runtime, deps in zip(runtimes, dependencies)])
+  estimate = (lambda job: float(job.get_command_line()[1])) if estimates else None
+  begin = time.time()
+  job_manager.run_scheduler(parallel_jobs=parallel, die_when_finished=True, event_driven=True, direct=True, critical_path=critical_path, runtime_estimate=estimate)
+  return time.time() - begin
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+  parser.add_argument('-c', '--chains', type=int, default=16, help="The number of chains of dependent jobs")
+  parser.add_argument('-l', '--max-length', type=int, default=24, help="The maximum number of jobs of a chain")
+  parser.add_argument('-x', '--cross', type=float, default=0.05, help="The probability that a job also depends on a random earlier job")
+  parser.add_argument('-p', '--parallel', type=int, default=6, help="The number of jobs that are run in parallel")
+  parser.add_argument('-s', '--scale', type=float, default=0.5, help="The maximum runtime of a job in seconds")
+  parser.add_argument('-e', '--estimates', action='store_true', help="Use the runtimes of the jobs as estimates for the critical path, instead of 1 per job")
+  parser.add_argument('-S', '--seed', type=int, default=42, help="The seed of the random DAG")
+  args = parser.parse_args()
+
+  runtimes, dependencies = _dag(args.chains, args.max_length, args.cross, args.scale, args.seed)
+  # the lower bounds of the makespan are the longest chain and the total runtime divided by the number of parallel jobs
+  finish = []
+  for runtime, deps in zip(runtimes, dependencies):
+    finish.append(runtime + max([finish[d] for d in deps] or [0]))
+  bound = max(max(finish), sum(runtimes) / args.parallel)
+
+  directory = tempfile.mkdtemp(prefix='gridtk_critical_path')
+  try:
+    fifo = _makespan(directory, runtimes, dependencies, args.parallel, False, False)
+    critical = _makespan(directory, runtimes, dependencies, args.parallel, True, args.estimates)
+  finally:
+    shutil.rmtree(directory)
+
+  print("DAG:                 %d jobs in %d chains, %.1f s runtime, longest chain %.1f s (seed %d)" % (len(runtimes), args.chains, sum(runtimes), max(finish), args.seed))
+  print("Lower bound:         %.2f s (%d parallel jobs)" % (bound, args.parallel))
+  print("Makespan FIFO:       %.2f s" % fifo)
+  print("Makespan critical:   %.2f s (%s)" % (critical, "estimated runtimes" if args.estimates else "1 per job"))
+  print("Reduction:           %.1f %%" % (100. * (fifo - critical) / fifo))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Stress test for many concurrent ``jman run-job`` processes writing to the same job database.
+
+Submits N jobs (that do nothing) to a fresh database, and starts N processes at once, each of which calls :py:meth:`gridtk.manager.JobManager.run_job` for one job, just like the grid does when many jobs start at the same time.
+Meanwhile, a reader repeatedly lists all jobs, like ``jman list`` does.
+Reports the throughput of the jobs and the time that each process spent in the database, which is dominated by waiting for the database lock.
+
+Compare the WAL mode with the classic rollback journal::
+
+  $ python benchmarks/run_job_stress.py --jobs 200
+  $ python benchmarks/run_job_stress.py --jobs 200 --no-wal
+"""
+
+from __future__ import print_function
+
+import argparse
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+from gridtk.local import JobManagerLocal
+
+
+def _run_job(database, wal, job_id, start, results):
+  """Executes one job after all processes have been started, and reports the time spent outside the command."""
+  job_manager = JobManagerLocal(database=database, wal=wal)
+  start.wait()
+  begin = time.time()
+  job_manager.run_job(job_id)
+  results.put(time.time() - begin)
+
+
+def _read_jobs(database, wal, stop, results):
+  """Lists all jobs until stopped, and reports the time of each listing."""
+  job_manager = JobManagerLocal(database=database, wal=wal)
+  while not stop.is_set():
+    begin = time.time()
+    job_manager.lock(write=False)
+    [job.status for job in job_manager.get_jobs()]
+    job_manager.unlock()
+    results.put(time.time() - begin)
+    time.sleep(0.01)
+
+
+def _percentiles(values):
+  values = sorted(values)
+  return "median %.3f s, 95%% %.3f s, max %.3f s" % (values[len(values)//2], values[int(len(values)*0.95)], values[-1])
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+  parser.add_argument('-n', '--jobs', type=int, default=100, help="The number of jobs, which are all run in parallel")
+  parser.add_argument('--no-wal', dest='wal', action='store_false', help="Use the classic rollback journal instead of the WAL mode")
+  parser.add_argument('-d', '--directory', help="The directory where the database is written (by default, a temporary directory); use a directory on the file system that your cluster uses")
+  args = parser.parse_args()
+
+  directory = tempfile.mkdtemp(prefix='gridtk_stress', dir=args.directory)
+  try:
+    database = os.path.join(directory, 'submitted.sql3')
+    job_manager = JobManagerLocal(database=database, wal=args.wal)
+    job_ids = job_manager.submit_many([{'command_line' : ['true']} for _ in range(args.jobs)])
+
+    start, stop = multiprocessing.Event(), multiprocessing.Event()
+    results, read_results = multiprocessing.Queue(), multiprocessing.Queue()
+    reader = multiprocessing.Process(target=_read_jobs, args=(database, args.wal, stop, read_results))
+    processes = [multiprocessing.Process(target=_run_job, args=(database, args.wal, job_id, start, results)) for job_id in job_ids]
+    reader.start()
+    for process in processes:
+      process.start()
+
+    begin = time.time()
+    start.set()
+    times = [results.get() for _ in processes]
+    elapsed = time.time() - begin
+    stop.set()
+    for process in processes + [reader]:
+      process.join()
+    read_times = []
+    while not read_results.empty():
+      read_times.append(read_results.get())
+
+    job_manager.lock(write=False)
+    failed = [job.unique for job in job_manager.get_jobs() if job.status != 'success']
+    job_manager.unlock()
+
+    print("Journal mode:          %s" % ("WAL" if args.wal else "rollback"))
+    print("Jobs:                  %d (%d did not finish successfully)" % (len(job_ids), len(failed)))
+    print("Throughput:            %.1f jobs/s" % (len(job_ids) / elapsed))
+    print("Time per run-job:      %s" % _percentiles(times))
+    if read_times:
+      print("Time per list:         %s (%d lists)" % (_percentiles(read_times), len(read_times)))
+  finally:
+    shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+  main()
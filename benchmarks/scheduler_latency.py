@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Measures the dispatch latency and the CPU usage of the local scheduler.
+
+Submits N jobs (that do nothing) to a fresh database, which already contains many finished jobs, and runs them with ``jman run-scheduler --die-when-finished``, one job at a time, so that the time per job is dominated by the time the scheduler needs to notice that a job has finished and to start the next one.
+Afterwards, the scheduler is kept running without any jobs for some seconds, and the CPU time that it spends while idle is reported.
+
+Compare the polling scheduler with the event driven one::
+
+  $ python benchmarks/scheduler_latency.py --jobs 50
+  $ python benchmarks/scheduler_latency.py --jobs 50 --event-driven
+
+and without the ``jman run-job`` wrapper::
+
+  $ python benchmarks/scheduler_latency.py --jobs 50 --event-driven --direct
+
+or with one array job, whose array jobs are run in batches by the wrapper::
+
+  $ python benchmarks/scheduler_latency.py --jobs 50 --event-driven --tasks-per-worker 10
+"""
+
+from __future__ import print_function
+
+import argparse
+import multiprocessing
+import os
+import resource
+import shutil
+import signal
+import tempfile
+import time
+
+from gridtk.local import JobManagerLocal
+from gridtk.models import Job
+
+
+def _cpu_time(who):
+  usage = resource.getrusage(who)
+  return usage.ru_utime + usage.ru_stime
+
+
+def _idle_scheduler(database, sleep_time, event_driven, results):
+  """Runs the scheduler without any jobs until it is interrupted, and reports the CPU time that it used."""
+  job_manager = JobManagerLocal(database=database)
+  cpu = _cpu_time(resource.RUSAGE_SELF)
+  job_manager.run_scheduler(sleep_time=sleep_time, event_driven=event_driven)
+  results.put(_cpu_time(resource.RUSAGE_SELF) - cpu)
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+  parser.add_argument('-n', '--jobs', type=int, default=50, help="The number of jobs, which are run one after the other")
+  parser.add_argument('-f', '--finished-jobs', type=int, default=2000, help="The number of jobs that have already finished before the scheduler starts")
+  parser.add_argument('-e', '--event-driven', action='store_true', help="Use the event driven scheduler instead of the polling one")
+  parser.add_argument('-D', '--direct', action='store_true', help="Run the jobs without the wrapper script")
+  parser.add_argument('-t', '--tasks-per-worker', type=int, default=1, help="Submit one array job instead, whose array jobs are run in batches of the given size")
+  parser.add_argument('-s', '--sleep-time', type=float, default=0.1, help="The sleep time of the scheduler")
+  parser.add_argument('-i', '--idle-time', type=float, default=10., help="The number of seconds that the idle scheduler is measured")
+  args = parser.parse_args()
+
+  directory = tempfile.mkdtemp(prefix='gridtk_latency')
+  try:
+    database = os.path.join(directory, 'submitted.sql3')
+    job_manager = JobManagerLocal(database=database)
+    finished = job_manager.submit_many([{'command_line' : ['/bin/true']} for _ in range(args.finished_jobs)])
+    job_manager.lock()
+    job_manager.session.query(Job).filter(Job.unique.in_(finished)).update({'status' : 'success', 'result' : 0}, synchronize_session = False)
+    job_manager.session.commit()
+    job_manager.unlock()
+    if args.tasks_per_worker > 1:
+      job_manager.submit(['/bin/true'], array=(1, args.jobs, 1), tasks_per_worker=args.tasks_per_worker, log_dir=directory)
+    else:
+      job_manager.submit_many([{'command_line' : ['/bin/true'], 'log_dir' : directory} for _ in range(args.jobs)])
+
+    begin, cpu = time.time(), _cpu_time(resource.RUSAGE_SELF)
+    job_manager.run_scheduler(parallel_jobs=1, die_when_finished=True, sleep_time=args.sleep_time, event_driven=args.event_driven, direct=args.direct)
+    elapsed, cpu = time.time() - begin, _cpu_time(resource.RUSAGE_SELF) - cpu
+
+    # the CPU time of the idle scheduler is measured in a separate process, which we can interrupt
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_idle_scheduler, args=(database, args.sleep_time, args.event_driven, results))
+    process.start()
+    time.sleep(args.idle_time)
+    os.kill(process.pid, signal.SIGINT)
+    idle_cpu = results.get()
+    process.join()
+
+    print("Scheduler:             %s%s%s (sleep time %s s)" % ("event driven" if args.event_driven else "polling", ", direct" if args.direct else "", ", %d tasks per worker" % args.tasks_per_worker if args.tasks_per_worker > 1 else "", args.sleep_time))
+    print("Time per job:          %.3f s (%d jobs in %.1f s)" % (elapsed / args.jobs, args.jobs, elapsed))
+    print("Scheduler CPU per job: %.3f s" % (cpu / args.jobs))
+    print("Idle CPU usage:        %.1f %%" % (100. * idle_cpu / args.idle_time))
+  finally:
+    shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+  main()
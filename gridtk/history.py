@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Records the runtimes of successful (array) jobs and predicts the runtimes of new jobs from them.
+
+The history is kept in an SQLite file of its own (e.g. ``~/.gridtk/history.sql3``), which is shared by all job databases that are configured to use it, so that the runtimes of a job are known when the same job is submitted to a new database.
+Runs are keyed by the name of the job and by the signature of its command line, where all numbers are replaced, so that runs with different seeds, indexes or parameters share their history.
+The runtime of a job is predicted from its latest runs, by default by their median (see :py:func:`median` and :py:func:`ewma`).
+"""
+
+import hashlib
+import os
+import re
+import sqlite3
+import time
+
+from .tools import logger, makedirs_safe
+
+
+# The number of runs that are kept for each name and signature
+KEEP = 100
+
+# The walltime limits in seconds of the SGE queues that are chosen by runtime, shortest first
+QUEUE_LIMITS = (('q1d', 24 * 3600), ('q1w', 7 * 24 * 3600), ('q1m', 31 * 24 * 3600))
+# the queues that support multi-threading (pe_mth)
+PARALLEL_QUEUE_LIMITS = (('q1dm', 24 * 3600), ('q1wm', 7 * 24 * 3600), ('q1m', 31 * 24 * 3600))
+
+_NUMBER = re.compile(r'\d+(\.\d+)?([eE][-+]?\d+)?')
+
+
+def signature(command_line):
+  """Returns the signature of the given command line (a list of strings), i.e., the hash of the command line in which all numbers are replaced by ``#``."""
+  normalized = "\0".join(_NUMBER.sub('#', str(argument)) for argument in command_line)
+  return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+
+def median(runtimes):
+  """Predicts the median of the given runtimes."""
+  ordered = sorted(runtimes)
+  middle = len(ordered) // 2
+  return ordered[middle] if len(ordered) % 2 else (ordered[middle - 1] + ordered[middle]) / 2.
+
+
+def ewma(runtimes, alpha = 0.3):
+  """Predicts the exponentially weighted moving average of the given runtimes (oldest first), where the latest runtime has the weight ``alpha``."""
+  prediction = runtimes[0]
+  for runtime in runtimes[1:]:
+    prediction = alpha * runtime + (1. - alpha) * prediction
+  return prediction
+
+
+def choose_queue(runtime, parallel=False):
+  """Returns the SGE queue with the shortest walltime limit that fits the given runtime (in seconds), see :py:data:`QUEUE_LIMITS`.
+  For ``parallel`` jobs, the queue is chosen from the :py:data:`PARALLEL_QUEUE_LIMITS`."""
+  limits = PARALLEL_QUEUE_LIMITS if parallel else QUEUE_LIMITS
+  for queue, limit in limits:
+    if runtime <= limit:
+      return queue
+  return limits[-1][0]
+
+
+def format_duration(seconds):
+  """Returns the given duration in seconds in a readable form, e.g., ``35 min``."""
+  if seconds < 90:
+    return "%d s" % seconds
+  if seconds < 90 * 60:
+    return "%d min" % round(seconds / 60.)
+  if seconds < 48 * 3600:
+    return "%.1f h" % (seconds / 3600.)
+  return "%.1f d" % (seconds / 86400.)
+
+
+class RuntimeHistory(object):
+  """The runtimes of the successful (array) jobs, which are stored in the SQLite file with the given name.
+
+  The runtime of a job is predicted by the ``predictor`` from the latest ``window`` runs with the same name and signature of its command line, or, if there are none, from the latest runs with the same name.
+  The file is only opened while runs are recorded or read, so that many processes (on different machines) can share it.
+  """
+
+  def __init__(self, filename, window = 20, predictor = median):
+    self.filename = os.path.abspath(os.path.expanduser(filename))
+    self.window = window
+    self.predictor = predictor
+    # the predictions of this object, by name and signature
+    self._predictions = {}
+
+  def _connect(self):
+    makedirs_safe(os.path.dirname(self.filename))
+    connection = sqlite3.connect(self.filename, timeout = 600)
+    connection.execute("CREATE TABLE IF NOT EXISTS runs (name TEXT, signature TEXT NOT NULL, runtime REAL NOT NULL, finished REAL NOT NULL)")
+    connection.execute("CREATE INDEX IF NOT EXISTS runs_signature ON runs (signature, name)")
+    connection.execute("CREATE INDEX IF NOT EXISTS runs_name ON runs (name)")
+    return connection
+
+  def record(self, runs):
+    """Records the given runs, each given as ``(name, command_line, runtime)`` with the runtime in seconds, in one transaction.
+    Only the latest :py:data:`KEEP` runs of each name and signature are kept."""
+    if not runs:
+      return
+    rows = [(name, signature(command_line), float(runtime), time.time()) for name, command_line, runtime in runs]
+    connection = self._connect()
+    try:
+      with connection:
+        connection.executemany("INSERT INTO runs (name, signature, runtime, finished) VALUES (?, ?, ?, ?)", rows)
+        for name, key in set((row[0], row[1]) for row in rows):
+          connection.execute("DELETE FROM runs WHERE signature = ? AND name IS ? AND rowid NOT IN (SELECT rowid FROM runs WHERE signature = ? AND name IS ? ORDER BY rowid DESC LIMIT ?)", (key, name, key, name, KEEP))
+    finally:
+      connection.close()
+    self._predictions = {}
+
+  def runtimes(self, name, command_line):
+    """Returns the runtimes of the latest runs of the job with the given name and command line, oldest first."""
+    if not os.path.exists(self.filename):
+      return []
+    connection = self._connect()
+    try:
+      rows = connection.execute("SELECT runtime FROM runs WHERE signature = ? AND name IS ? ORDER BY rowid DESC LIMIT ?", (signature(command_line), name, self.window)).fetchall()
+      if not rows and name is not None:
+        rows = connection.execute("SELECT runtime FROM runs WHERE name = ? ORDER BY rowid DESC LIMIT ?", (name, self.window)).fetchall()
+    finally:
+      connection.close()
+    return [row[0] for row in reversed(rows)]
+
+  def predict(self, name, command_line):
+    """Returns the predicted runtime in seconds of the job with the given name and command line, or None if the job has no history."""
+    key = (name, signature(command_line))
+    if key not in self._predictions:
+      try:
+        runtimes = self.runtimes(name, command_line)
+      except sqlite3.Error as e:
+        logger.warning("Could not read the runtime history '%s': %s", self.filename, e)
+        runtimes = []
+      self._predictions[key] = self.predictor(runtimes) if runtimes else None
+    return self._predictions[key]
@@ -10,22 +10,254 @@ from __future__ import print_function
 
 import subprocess
 import time
-import copy, os, sys
+import copy, errno, os, sys
+import fcntl
+import heapq
+import multiprocessing
+import select
+import signal
+import socket
+import threading
+import traceback
+from datetime import datetime
 
 if sys.version_info[0] >= 3:
   from pickle import dumps, loads
 else:
   from cPickle import dumps, loads
 
-from .tools import makedirs_safe, logger, str_
+from .tools import makedirs_safe, logger, memory_in_bytes, wait_process, signal_process_group, process_start_time, process_alive, WALLTIME_EXCEEDED, TERMINATE_TIMEOUT
+from .logstore import spool
 
 
 from .manager import JobManager
-from .models import add_job, Job
+from .models import add_job, add_jobs, Job, IdSet, change_counter, critical_path_lengths
+
+
+# The number of jobs that the scheduler looks at to find jobs that fit into the free resources, while the first job does not fit
+BACKFILL_LOOKAHEAD = 100
+
+# The shell command that runs the command line of a job in the direct mode, and writes its exit status into the file given as $0
+_RECORD_EXIT = '"$@"; status=$?; echo $status > "$0"; exit $status'
+
+
+class _ChildEvents(object):
+  """Wakes up the scheduler as soon as a child process exits.
+  The SIGCHLD handler writes to a pipe (the self-pipe trick), so that no exit can get lost between checking the processes and waiting for the pipe."""
+  def __init__(self):
+    self._read, self._write = os.pipe()
+    for fd in (self._read, self._write):
+      fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+    self._previous = signal.signal(signal.SIGCHLD, self._notify)
+
+  def notify(self):
+    """Wakes up the scheduler, e.g., when a call in the worker pool has finished."""
+    self._notify(None, None)
+
+  def _notify(self, signum, frame):
+    try:
+      os.write(self._write, b'x')
+    except OSError:
+      # the pipe is full, so the scheduler will wake up anyways
+      pass
+
+  def wait(self, timeout):
+    """Waits until a child process exits, but at most the given timeout; returns True if a child process has exited."""
+    try:
+      ready = select.select([self._read], [], [], timeout)[0]
+    except select.error:
+      # interrupted by a signal in python 2
+      ready = []
+    if ready:
+      try:
+        while os.read(self._read, 4096):
+          pass
+      except OSError:
+        pass
+    return bool(ready)
+
+  def close(self):
+    signal.signal(signal.SIGCHLD, self._previous if self._previous is not None else signal.SIG_DFL)
+    os.close(self._read)
+    os.close(self._write)
+
+
+def _call(call):
+  """Runs the given pickled Python call in a worker of the pool, and returns the pickled return value and the traceback of the exception that it raised."""
+  try:
+    function, args = loads(call)
+    return dumps(function(*args)), None
+  except Exception:
+    return None, traceback.format_exc()
+
+
+def _worker_pool(processes, preload = None):
+  """Creates the pool of worker processes for Python calls.
+  If possible, the workers are forked from a server process that has imported the given modules already."""
+  try:
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload(list(preload or []))
+  except (AttributeError, ValueError):
+    # python 2, or a platform without forkserver
+    context = multiprocessing
+  return context.Pool(processes)
+
+
+class _CallableTask(object):
+  """A Python call that runs in the worker pool of the local scheduler, which looks like a process to the scheduler."""
+  def __init__(self, pool, call, notify = None):
+    self.returncode = None
+    self.return_value = self.error = None
+    self._result = pool.apply_async(_call, (call,), callback = (lambda result: notify()) if notify is not None else None)
+
+  def poll(self):
+    if self.returncode is None and self._result.ready():
+      self.return_value, self.error = self._result.get()
+      self.returncode = 0 if self.error is None else 1
+    return self.returncode
+
+  def kill(self):
+    # single calls cannot be killed; instead, the pool is terminated when the scheduler stops
+    pass
+
+
+class _AdoptedProcess(object):
+  """A process that was started by a previous local scheduler and is still running.
+  It is not a child of this scheduler, so its result cannot be obtained from the kernel; the scheduler can only check whether it is still alive, and read the exit status that the process has recorded in the direct mode."""
+  def __init__(self, pid, pid_start = None):
+    self.pid = pid
+    self.pid_start = pid_start
+    self.returncode = None
+
+  def alive(self):
+    return process_alive(self.pid, self.pid_start)
+
+
+def _check_executable(program, cwd = None, path = None):
+  """Raises the :py:class:`OSError` that executing the given program in the directory ``cwd`` would raise, when the program cannot be found in that directory or in the directories of the given ``path``, or when it is not executable."""
+  directories = [''] if os.path.dirname(program) else (path if path is not None else os.defpath).split(os.pathsep)
+  for directory in directories:
+    candidate = os.path.join(cwd or '.', directory, program)
+    if os.path.isfile(candidate):
+      if not os.access(candidate, os.X_OK):
+        raise OSError(errno.EACCES, os.strerror(errno.EACCES), program)
+      return
+  raise OSError(errno.ENOENT, os.strerror(errno.ENOENT), program)
+
+
+def _local_arguments(kwargs):
+  """Returns the arguments of a submission that are used by the local scheduler, i.e., the resources that the job requires, its priority and its walltime."""
+  return dict((key, kwargs[key]) for key in ('pe_opt', 'memfree', 'hvmem', 'priority', 'walltime') if kwargs.get(key) is not None)
+
+
+class _ReadyQueue(object):
+  """The jobs that are ready to run, in the order in which the local scheduler starts them.
+  Jobs with a higher priority are started first.
+  With fair share weights, the jobs are grouped by their name, and the group that has started the fewest (array) jobs relative to its weight (1 by default) goes next.
+  With critical path lengths (see :py:func:`gridtk.models.critical_path_lengths`), the job with the longest chain of jobs that wait for it goes next.
+  Otherwise, the job with the lowest id goes first."""
+  def __init__(self, fair_share = None, critical_paths = None):
+    self._fair_share = fair_share
+    self._critical_paths = critical_paths
+    # a heap of (-priority, -critical path length, unique) per group, the current entry of each job, and the number of started (array) jobs per group
+    self._heaps = {}
+    self._entries = {}
+    self._started = {}
+
+  def __len__(self):
+    return len(self._entries)
+
+  def _group(self, job):
+    return job.name if self._fair_share is not None else None
+
+  def _share(self, group):
+    return self._started.get(group, 0) / float(self._fair_share.get(group, 1.)) if self._fair_share is not None else 0
+
+  def _next_group(self):
+    for group in list(self._heaps):
+      heap = self._heaps[group]
+      # entries of jobs that have been pushed again (e.g. with a new priority) are dropped lazily
+      while heap and self._entries.get(heap[0][-1]) != (group, heap[0]):
+        heapq.heappop(heap)
+      if not heap:
+        del self._heaps[group]
+    return min(self._heaps, key = lambda group: (self._heaps[group][0][0], self._share(group), self._heaps[group][0][1:]))
+
+  def _critical_path(self, unique):
+    return -self._critical_paths.get(unique, 0) if self._critical_paths is not None else 0
+
+  def push(self, job):
+    """Adds the given job, or updates its position."""
+    item = (self._group(job), (-(job.priority or 0), self._critical_path(job.unique), job.unique))
+    if self._entries.get(job.unique) != item:
+      self.restore(item)
+
+  def restore(self, item):
+    """Adds the item again that was returned by :py:meth:`pop`."""
+    self._entries[item[1][-1]] = item
+    heapq.heappush(self._heaps.setdefault(item[0], []), item[1])
+
+  def set_critical_paths(self, critical_paths):
+    """Sets new critical path lengths, and updates the positions of all jobs."""
+    self._critical_paths = critical_paths
+    for group, (priority, _, unique) in list(self._entries.values()):
+      item = (group, (priority, self._critical_path(unique), unique))
+      if self._entries[unique] != item:
+        self.restore(item)
+
+  def first(self):
+    """Returns the id of the next job."""
+    return self._heaps[self._next_group()][0][-1]
+
+  def pop(self, unique):
+    """Removes the job with the given id, which has been returned by :py:meth:`first`, and returns it as an item that can be restored."""
+    item = self._entries.pop(unique)
+    heapq.heappop(self._heaps[item[0]])
+    return item
+
+  def started(self, job):
+    """Counts an (array) job of the given job that has been started."""
+    group = self._group(job)
+    self._started[group] = self._started.get(group, 0) + 1
+
+
+class _SchedulerState(object):
+  """The state of a run of :py:meth:`JobManagerLocal.run_scheduler`, which its steps share."""
+  def __init__(self, parallel_jobs, capacity, ready, events = None, direct = False, preload = None, run_options = None):
+    self.parallel_jobs = parallel_jobs
+    # the cores and the memory of this machine
+    self.capacity = capacity
+    # the jobs that have queued (array) jobs, which are kept up to date using the change counter of the database
+    self.ready = ready
+    self.events = events
+    self.direct = direct
+    self.preload = preload
+    # the options of _run_parallel_job
+    self.run_options = run_options or {}
+    # the running tasks, each a tuple of the process, the job id and the array ids that the process runs, if any; and the ids of the jobs of the finished tasks
+    self.running_tasks = []
+    self.finished_tasks = set()
+    # the cores and the memory that the running tasks use
+    self.task_resources = {}
+    # the time when the processes of jobs with walltime need to be stopped, and the signal that they will receive; and the processes that have been stopped
+    self.deadlines, self.timed_out = {}, set()
+    # the buffered logs of the processes of jobs with packed logs in the direct mode
+    self.spooled = {}
+    # the jobs whose queued (array) jobs wait for their retry (see gridtk.models.Job.get_retry_times), with the time when the first of them may be started
+    self.retrying = {}
+    # the worker pool for Python calls, which is started when the first call is run
+    self.pool = None
+    # in the direct mode and for Python calls, the scheduler records the machine that runs the jobs, which is done by the wrapper otherwise
+    self.machine_name = socket.gethostname()
+    # the (array) jobs are claimed in the name of this scheduler, so that several schedulers can run the jobs of the same database
+    self.claimed_by = "%s:%d" % (socket.gethostname(), os.getpid())
+    # whether the jobs in the database need to be checked, and the last value of the change counter that we have seen
+    self.changed, self.counter = True, None
+
 
 class JobManagerLocal(JobManager):
   """Manages jobs run in parallel on the local machine."""
-  def __init__(self, **kwargs):
+  def __init__(self, wal = True, **kwargs):
     """Initializes this object with a state file and a method for qsub'bing.
 
     Keyword parameters:
@@ -34,19 +266,27 @@ class JobManagerLocal(JobManager):
       The file containing a valid status database for the manager. If the file
       does not exist it is initialized. If it exists, it is loaded.
 
+    wal
+      Since all local jobs run on the machine that stores the database, the
+      database is written in WAL mode by default; use ``wal = False`` when
+      several machines access the database, e.g., over a network file system.
+
     """
-    JobManager.__init__(self, **kwargs)
+    JobManager.__init__(self, wal = wal, **kwargs)
 
 
-  def submit(self, command_line, name = None, array = None, dependencies = [], exec_dir = None, log_dir = None, dry_run = False, stop_on_failure = False, **kwargs):
+  def submit(self, command_line, name = None, array = None, dependencies = [], exec_dir = None, log_dir = None, dry_run = False, stop_on_failure = False, compact_array = False, tasks_per_worker = None, call = None, packed_logs = False, max_attempts = None, retry_delay = None, retry_results = None, array_dependency = False, **kwargs):
     """Submits a job that will be executed on the local machine during a call to "run".
-    All kwargs will simply be ignored."""
+    With ``array_dependency``, each array job is started as soon as the array jobs with the same id of the ``dependencies`` have finished.
+    With ``packed_logs``, the logs of all (array) jobs are stored in one file in the ``log_dir``, see :py:mod:`gridtk.logstore`.
+    Failing (array) jobs are run up to ``max_attempts`` times, see :py:class:`gridtk.models.Job` for the retry policy.
+    Of the kwargs, only the resources that the job requires (``pe_opt``, ``memfree`` and ``hvmem``), the ``priority`` and the ``walltime`` (in seconds) are stored, all other kwargs will simply be ignored."""
     # remove duplicate dependencies
     dependencies = sorted(list(set(dependencies)))
 
     # add job to database
     self.lock()
-    job = add_job(self.session, command_line=command_line, name=name, dependencies=dependencies, array=array, exec_dir=exec_dir, log_dir=log_dir, stop_on_failure=stop_on_failure)
+    job = add_job(self.session, command_line=command_line, name=name, dependencies=dependencies, array=array, exec_dir=exec_dir, log_dir=log_dir, stop_on_failure=stop_on_failure, compact_array=compact_array, tasks_per_worker=tasks_per_worker, call=call, packed_logs=packed_logs, max_attempts=max_attempts, retry_delay=retry_delay, retry_results=retry_results, array_dependency=array_dependency, **_local_arguments(kwargs))
     logger.info("Added job '%s' to the database", job)
 
     if dry_run:
@@ -62,6 +302,62 @@ class JobManagerLocal(JobManager):
     return job_id
 
 
+  def submit_many(self, specs, dry_run = False, **kwargs):
+    """Submits many jobs at once, which are added to the database in a single transaction.
+    Each spec is a dictionary with the keyword arguments of :py:meth:`submit`, including the ``command_line``.
+    The ``batch_dependencies`` of a spec might contain the indexes of other specs in the list that this job depends on.
+    All other kwargs will simply be ignored.
+    Returns the list of new job ids."""
+    keys = ('command_line', 'name', 'array', 'dependencies', 'batch_dependencies', 'exec_dir', 'log_dir', 'stop_on_failure', 'compact_array', 'tasks_per_worker', 'packed_logs', 'max_attempts', 'retry_delay', 'retry_results', 'array_dependency')
+    self.lock()
+    jobs = add_jobs(self.session, [dict([(key, spec[key]) for key in keys if key in spec] + list(_local_arguments(spec).items())) for spec in specs])
+    logger.info("Added %d jobs to the database", len(jobs))
+
+    if dry_run:
+      for job in jobs:
+        print("Would have added the Job", job, "to the database to be executed locally.")
+      self.session.rollback()
+      job_ids = [None] * len(jobs)
+    else:
+      job_ids = [job.unique for job in jobs]
+      self.session.commit()
+
+    self.unlock()
+    return job_ids
+
+
+  def submit_callable(self, function, *args, **kwargs):
+    """Submits a call of the given Python ``function`` with the given ``args``, which the local scheduler runs in a pool of worker processes that have imported the required modules already.
+    The function and its arguments are pickled, so the function needs to be importable from its module (e.g., it cannot be a lambda); use :py:func:`functools.partial` to pass keyword arguments.
+    The kwargs are the ones of :py:meth:`submit`, e.g., the ``name`` and the ``dependencies`` of the job.
+    When the job has finished, the return value can be obtained with :py:meth:`get_result`."""
+    if kwargs.get('array') is not None:
+      raise ValueError("Python calls cannot be submitted as array jobs")
+    name = "%s.%s" % (getattr(function, '__module__', None), getattr(function, '__qualname__', getattr(function, '__name__', type(function).__name__)))
+    arguments = ", ".join(repr(arg) for arg in args)
+    # the command line is only used to list the job
+    command_line = ["%s(%s)" % (name, arguments if len(arguments) < 100 else "...")]
+    return self.submit(command_line, call = dumps((function, args)), **kwargs)
+
+
+  def get_result(self, job_id):
+    """Returns the return value of the Python call of the given job, see :py:meth:`submit_callable`.
+    Raises a :py:class:`RuntimeError` with the traceback of the exception that the call raised, or when the job has not finished successfully."""
+    self.lock(write=False)
+    try:
+      jobs = self.get_jobs((job_id,))
+      if not jobs:
+        raise RuntimeError("The job with id '%d' could not be found in the database" % job_id)
+      status, return_value, error = jobs[0].status, jobs[0].return_value, jobs[0].error
+    finally:
+      self.unlock()
+    if error is not None:
+      raise RuntimeError("The call of job '%d' raised an exception:\n%s" % (job_id, error))
+    if status != 'success' or return_value is None:
+      raise RuntimeError("The job '%d' has no result, since it has status '%s'" % (job_id, status))
+    return loads(return_value)
+
+
   def resubmit(self, job_ids = None, also_success = False, running_jobs = False, new_command=None, keep_logs=False, **kwargs):
     """Re-submit jobs automatically"""
     self.lock()
@@ -71,7 +367,7 @@ class JobManagerLocal(JobManager):
       if len(jobs) == 1:
         jobs[0].set_command_line(new_command)
       else:
-        logger.warn("Ignoring new command since no single job id was specified")
+        logger.warning("Ignoring new command since no single job id was specified")
     accepted_old_status = ('submitted', 'success', 'failure') if also_success else ('submitted', 'failure',)
     for job in jobs:
       # check if this job needs re-submission
@@ -81,6 +377,8 @@ class JobManagerLocal(JobManager):
         else:
           # re-submit job to the grid
           logger.info("Re-submitted job '%s' to the database", job)
+          if kwargs.get('priority') is not None:
+            job.priority = kwargs['priority']
           if not keep_logs:
             self.delete_logs(job)
           job.submit('local')
@@ -89,13 +387,28 @@ class JobManagerLocal(JobManager):
     self.unlock()
 
 
-  def stop_jobs(self, job_ids=None):
-    """Resets the status of the job to 'submitted' when they are labeled as 'executing'."""
+  def stop_jobs(self, job_ids=None, claimed_by=None):
+    """Resets the status of the job to 'submitted' when they are labeled as 'executing'.
+    With ``claimed_by``, only the jobs that the given scheduler has claimed (see :py:meth:`gridtk.models.Job.claim`) and the queued or waiting jobs are reset; array jobs that are executed by other schedulers are not changed, and the array jobs of the given scheduler are queued again instead."""
     self.lock()
 
     jobs = self.get_jobs(job_ids)
     for job in jobs:
       if job.status in ('executing', 'queued', 'waiting') and job.queue_name == 'local':
+        if claimed_by is not None:
+          if not job.get_array() and job.status == 'executing' and job.claimed_by != claimed_by:
+            # the job is run by another scheduler
+            continue
+          runs = job.get_array_jobs(('executing',)) if job.get_array() else []
+          if any(run.claimed_by != claimed_by for run in runs):
+            # other schedulers still run array jobs of this job
+            for run in runs:
+              if run.claimed_by == claimed_by:
+                logger.info("Re-queuing job '%s' (%s) in the database", job.name, self._format_log(job.id, run.id))
+                run.claimed_by = None
+                run.pid = run.pid_start = None
+                job.requeue(run.id)
+            continue
         logger.info("Reset job '%s' (%s) in the database", job.name, self._format_log(job.id))
         job.submit()
 
@@ -114,12 +427,10 @@ class JobManagerLocal(JobManager):
 
       if array_job is not None and array_job.status in ('executing', 'queued', 'waiting'):
         logger.debug("Reset array job '%s' in the database", array_job)
-        array_job.status = 'submitted'
+        job.set_array_job_status(array_job.id, 'submitted')
       if array_job is None:
-        for array_job in job.array:
-          if array_job.status in ('executing', 'queued', 'waiting'):
-            logger.debug("Reset array job '%s' in the database", array_job)
-            array_job.status = 'submitted'
+        logger.debug("Reset array jobs of job '%s' in the database", job)
+        job.change_array_status(('executing', 'queued', 'waiting'), 'submitted')
 
     self.session.commit()
     self.unlock()
@@ -128,8 +439,12 @@ class JobManagerLocal(JobManager):
 #####################################################################
 ###### Methods to run the jobs in parallel on the local machine #####
 
-  def _run_parallel_job(self, job_id, array_id = None, no_log = False, nice = None, verbosity = 0):
-    """Executes the code for this job on the local machine."""
+  def _run_parallel_job(self, job_id, array_id = None, no_log = False, nice = None, verbosity = 0, direct = False, next_array_ids = (), spooled = None):
+    """Executes the code for this job on the local machine.
+    In the ``direct`` mode, the command line of the job is executed without the wrapper script, and the status of the job needs to be set by the caller; a shell writes the exit status of the command into the :py:meth:`_exit_file` of the (array) job, so that a restarted scheduler can finish the job when its process has exited in the meantime.
+    Otherwise, the wrapper script runs the ``next_array_ids`` after the given array job, and writes the output of all of them into the log files of the first one.
+    For jobs with packed logs, the wrapper script writes the logs itself; in the ``direct`` mode, the logs are buffered in temporary files, which are stored in the ``spooled`` dictionary for the returned process, and need to be appended to the packed log by the caller.
+    The process is started in its own session, so that it can be stopped together with all its children, see :py:func:`gridtk.tools.signal_process_group`."""
     environ = copy.deepcopy(os.environ)
     environ['JOB_ID'] = str(job_id)
     if array_id:
@@ -138,19 +453,32 @@ class JobManagerLocal(JobManager):
       environ['SGE_TASK_ID'] = 'undefined'
 
     # generate call to the wrapper script
-    command = [self.wrapper_script, '-l%sd'%("v"*verbosity), self._database, 'run-job']
-
-    if nice is not None:
-      command = ['nice', '-n%d'%nice] + command
+    command = [self.wrapper_script, '-l%sd'%("v"*verbosity), self._database] + self._wrapper_options() + ['run-job']
+    if next_array_ids:
+      command += [str(i) for i in (array_id,) + tuple(next_array_ids)]
 
     job, array_job = self._job_and_array(job_id, array_id)
     if job is None:
       # rare case: job was deleted before starting
       return None
 
-    logger.info("Starting execution of Job '%s' (%s)", job.name, self._format_log(job_id, array_id, len(job.array)))
+    cwd = None
+    if direct:
+      command, cwd = job.get_command_line(), job.get_exec_dir()
+      exit_file = self._exit_file(job_id, array_id)
+      makedirs_safe(os.path.dirname(exit_file))
+      self._remove_exit_file(job_id, array_id)
+      command = ['/bin/sh', '-c', _RECORD_EXIT, exit_file] + command
+
+    if nice is not None:
+      command = ['nice', '-n%d'%nice] + command
+
+    logger.info("Starting execution of Job '%s' (%s)", job.name, self._format_log(job_id, array_id, job.array_size()))
     # create log files
-    if no_log or job.log_dir is None:
+    packed_log = job.get_packed_log()
+    if packed_log is not None and direct and not no_log:
+      out, err = spool(), spool()
+    elif no_log or job.log_dir is None or packed_log is not None:
       out, err = sys.stdout, sys.stderr
     else:
       makedirs_safe(job.log_dir)
@@ -162,125 +490,466 @@ class JobManagerLocal(JobManager):
 
     # return the subprocess pipe to the process
     try:
-      return subprocess.Popen(command, env=environ, stdout=out, stderr=err, bufsize=1)
+      if direct:
+        # commands that cannot be executed fail as if they were executed without the shell
+        _check_executable(job.get_command_line()[0], cwd, environ.get('PATH'))
+      process = subprocess.Popen(command, env=environ, stdout=out, stderr=err, bufsize=1, cwd=cwd, start_new_session=True)
+      if packed_log is not None and direct and not no_log:
+        spooled[process] = (packed_log, [(array_id, 'out', out), (array_id, 'err', err)])
+      return process
     except OSError as e:
-      logger.error("Could not execute job '%s' (%s) locally\n- reason:\t%s\n- command line:\t%s\n- directory:\t%s\n- command:\t%s", job.name, self._format_log(job_id, array_id, len(job.array)), e, " ".join(job.get_command_line()), "." if job.exec_dir is None else job.exec_dir, " ".join(command))
-      job.finish(117, array_id) # ASCII 'O'
+      logger.error("Could not execute job '%s' (%s) locally\n- reason:\t%s\n- command line:\t%s\n- directory:\t%s\n- command:\t%s", job.name, self._format_log(job_id, array_id, job.array_size()), e, " ".join(job.get_command_line()), "." if job.exec_dir is None else job.exec_dir, " ".join(command))
+      # without the wrapper, the job itself could not be executed, as in run_job
+      for i in (array_id,) + tuple(next_array_ids):
+        job.finish(69 if direct else 117, i) # ASCII 'E' or 'O'
       return None
 
 
   def _format_log(self, job_id, array_id = None, array_count = 0):
     return ("%d (%d/%d)" % (job_id, array_id, array_count)) if array_id is not None and array_count else ("%d (%d)" % (job_id, array_id)) if array_id is not None else ("%d" % job_id)
 
-  def run_scheduler(self, parallel_jobs = 1, job_ids = None, sleep_time = 0.1, die_when_finished = False, no_log = False, nice = None, verbosity = 0):
-    """Starts the scheduler, which is constantly checking for jobs that should be ran."""
-    running_tasks = []
-    finished_tasks = set()
+  def _is_ready(self, job):
+    """Returns True if the given job (or one of its array jobs) can be started by the local scheduler."""
+    if job.queue_name != 'local':
+      return False
+    if job.get_array():
+      return job.status in ('queued', 'executing') and bool(job.array_queued)
+    return job.status == 'queued'
+
+  def _changed_jobs(self, job_ids, since):
+    """Returns the unfinished jobs that have been added or changed their status after the change counter had the given value, or all unfinished jobs if ``since`` is None."""
+    query = self.session.query(Job).filter(Job.queue_name == 'local').filter(Job.status.in_(('submitted', 'queued', 'executing')))
+    if job_ids is not None:
+      query = query.filter(IdSet.from_ids(job_ids).filter(Job.unique))
+    if since is not None:
+      query = query.filter(Job.changed > since)
+    return query.order_by(Job.unique).all()
+
+  def _exit_file(self, job_id, array_id = None):
+    """Returns the name of the file into which the exit status of the given (array) job is written when it is run in the ``direct`` mode."""
+    return os.path.join(self._database + '.exit', str(job_id) if array_id is None else '%d.%d' % (job_id, array_id))
+
+  def _remove_exit_file(self, job_id, array_id = None):
     try:
+      os.remove(self._exit_file(job_id, array_id))
+    except OSError:
+      pass
+
+  def _finish_gone(self, job, array_id = None):
+    """Finishes the given executing (array) job, whose process has gone, with the exit status that the process has written in the ``direct`` mode (see :py:meth:`_exit_file`), or queues it again if there is none; the database needs to be locked.
+    Returns the ids of the jobs that need to be stopped since the job failed."""
+    exit_file = self._exit_file(job.unique, array_id)
+    try:
+      with open(exit_file) as f:
+        result = int(f.read())
+      # the file was written when the process finished
+      finish_time = os.path.getmtime(exit_file)
+    except (IOError, OSError, ValueError):
+      logger.warning("Re-queuing job '%s' (%s) since its process has gone without recording its result", job.name, self._format_log(job.unique, array_id))
+      job.requeue(array_id)
+      return []
+    self._remove_exit_file(job.unique, array_id)
+    logger.info("Job '%s' (%s) has finished with result %d while it was not watched by a scheduler", job.name, self._format_log(job.unique, array_id), result)
+    run = job.get_array_job(array_id) if array_id is not None else job
+    start_time = time.mktime(run.start_time.timetuple()) if run.start_time is not None else None
+    return self.apply_job_event('finish', job.unique, array_id, result = result, start_time = start_time, duration = max(finish_time - start_time, 0) if start_time is not None else None)
+
+  def _stop_dependents(self, stop):
+    """Stops the jobs with the given ids, which depend on jobs that failed."""
+    if stop:
+      # This might not be working properly, so use with care!
+      self.stop_jobs(sorted(stop))
+      logger.warning("Stopped dependent jobs '%s' since jobs failed.", str(sorted(stop)))
+
+  def _adopt_processes(self, job_ids, claimed_by):
+    """Adopts the processes of the (array) jobs that a previous scheduler on this machine has started, and that are still running.
+    Executing (array) jobs whose scheduler and process have gone are finished with the exit status that their processes have recorded, or queued again (see :py:meth:`_finish_gone`).
+    Returns a list of ``(task, job)`` for the adopted processes, where the task is a tuple of the process, the job id and its array ids, as in :py:meth:`run_scheduler`, and the ids of the jobs that need to be stopped since jobs failed."""
+    host = claimed_by.rpartition(':')[0]
+    tasks, stop = {}, set()
+    query = self.session.query(Job).filter(Job.queue_name == 'local').filter(Job.status == 'executing')
+    if job_ids is not None:
+      query = query.filter(IdSet.from_ids(job_ids).filter(Job.unique))
+    for job in query.order_by(Job.unique).all():
+      for run in (job.get_array_jobs(('executing',)) if job.get_array() else [job]):
+        array_id = run.id if job.get_array() else None
+        owner, _, scheduler = (run.claimed_by or '').rpartition(':')
+        if owner != host or run.claimed_by != claimed_by and process_alive(int(scheduler)):
+          # the job is run by another scheduler, or it was not started by a local scheduler on this machine
+          continue
+        run.claimed_by = claimed_by
+        if run.pid is not None and process_alive(run.pid, run.pid_start):
+          # the array jobs that one wrapper runs share the process
+          tasks.setdefault(run.pid, (_AdoptedProcess(run.pid, run.pid_start), job, []))[2].append(array_id)
+        else:
+          stop.update(self._finish_gone(job, array_id))
+    adopted = []
+    for pid in sorted(tasks):
+      process, job, array_ids = tasks[pid]
+      logger.info("Adopting process %d of job '%s' (%s)", pid, job.name, self._format_log(job.unique, array_ids[0]))
+      adopted.append(((process, job.unique) + (tuple(array_ids) if job.get_array() else ()), job))
+    return adopted, stop
+
+  def _adopt(self, state, job_ids):
+    """Adopts the processes that a previous scheduler on this machine has left running (see :py:meth:`_adopt_processes`), together with their resources and walltimes."""
+    self.lock()
+    adopted, stop = self._adopt_processes(job_ids, state.claimed_by)
+    for task, job in adopted:
+      state.running_tasks.append(task)
+      state.task_resources[task[0]] = [min(n, c) for n, c in zip(job.get_resources(), state.capacity)]
+      if job.walltime:
+        # the walltime is counted from the start of the first (array) job of the process
+        runs = [job.get_array_job(array_id) for array_id in task[2:]] or [job]
+        start = min([time.mktime(run.start_time.timetuple()) for run in runs if run.start_time is not None] or [time.time()])
+        state.deadlines[task[0]] = (start + job.walltime * len(runs), signal.SIGTERM)
+    self.session.commit()
+    self.unlock()
+    self._record_runs()
+    self._stop_dependents(stop)
+
+  def _check_walltimes(self, state):
+    """Terminates the process groups of the tasks that exceeded their walltime, and kills the ones that are still running :py:data:`gridtk.tools.TERMINATE_TIMEOUT` seconds later."""
+    now = time.time()
+    for process, (deadline, signum) in list(state.deadlines.items()):
+      if now >= deadline:
+        signal_process_group(process, signum)
+        if signum == signal.SIGTERM:
+          logger.warning("Stopping process %d since it exceeded the walltime of its job", process.pid)
+          state.timed_out.add(process)
+          state.deadlines[process] = (now + TERMINATE_TIMEOUT, signal.SIGKILL)
+        else:
+          del state.deadlines[process]
+
+  def _poll_tasks(self, state):
+    """Returns the running tasks that have finished, and the resource usage of the finished processes that the scheduler has waited for."""
+    finished, usages = [], {}
+    for task in state.running_tasks:
+      if isinstance(task[0], _CallableTask):
+        if task[0].poll() is not None:
+          finished.append(task)
+      elif isinstance(task[0], _AdoptedProcess):
+        if not task[0].alive():
+          finished.append(task)
+      else:
+        # the resource usage of the processes is obtained when they are waited for; the wrapper records the usage of its jobs itself
+        status = wait_process(task[0], block = False)
+        if status is not None:
+          finished.append(task)
+          usages[task[0]] = status[1]
+    return finished, usages
+
+  def _finish_adopted(self, tasks):
+    """Finishes the (array) jobs of the given finished adopted processes, whose wrappers have not written their results, with the exit status that the processes have recorded in the ``direct`` mode, or queues them again (see :py:meth:`_finish_gone`)."""
+    stop = set()
+    self.lock()
+    for task in tasks:
+      for array_id in task[2:] or (None,):
+        job, array_job = self._job_and_array(task[1], array_id)
+        if job is not None and (array_job if array_job is not None else job).status == 'executing':
+          stop.update(self._finish_gone(job, array_id))
+    self.session.commit()
+    self.unlock()
+    self._record_runs()
+    self._stop_dependents(stop)
+
+  def _stop_tasks(self, state, job_ids, adopt):
+    """Stops the running tasks when the scheduler is interrupted, and the jobs that it runs or that are queued; with ``adopt``, the processes are left running instead."""
+    running_tasks = state.running_tasks
+    if adopt:
+      # the processes are left running, so that the next scheduler can adopt them; only the Python calls are stopped with the worker pool
+      for task in running_tasks:
+        if isinstance(task[0], _CallableTask):
+          self.stop_job(task[1])
+        else:
+          logger.warning("Leaving job '%s' running in process %d.", self._format_log(task[1], task[2] if len(task) > 2 else None), task[0].pid)
+      running_tasks = []
+    processes = [task[0] for task in running_tasks if not isinstance(task[0], _CallableTask)]
+    for task in running_tasks:
+      logger.warning("Killing job '%s' that was still running.", self._format_log(task[1], task[2] if len(task) > 2 else None))
+      # the process groups are terminated, so that the children of the processes are stopped, too
+      if not isinstance(task[0], _CallableTask):
+        signal_process_group(task[0], signal.SIGTERM)
+    deadline = time.time() + TERMINATE_TIMEOUT
+    while any(wait_process(process, block = False) is None for process in processes) and time.time() < deadline:
+      time.sleep(0.1)
+    for process in processes:
+      signal_process_group(process, signal.SIGKILL)
+    if not adopt:
+      # stop the jobs that this scheduler runs, and the ones that are queued; the jobs that other schedulers on the same database run are not changed
+      self.stop_jobs(job_ids, state.claimed_by)
+
+  def _write_results(self, state, tasks, usages):
+    """Writes the packed logs and the results of the given finished tasks, which the scheduler has run itself, and stops the jobs that depend on failed jobs.
+    The results of all tasks are written in one transaction."""
+    for task in tasks:
+      if task[0] in state.spooled:
+        # the logs are written before the jobs are marked as finished
+        packed_log, logs = state.spooled.pop(task[0])
+        try:
+          packed_log.append(logs)
+        except (IOError, OSError) as e:
+          logger.error("Could not write the logs of job '%s': %s", self._format_log(task[1], task[2] if len(task) > 2 else None), e)
+        for log in logs:
+          log[2].close()
+      if state.direct and not isinstance(task[0], _CallableTask):
+        # the scheduler has obtained the exit status itself
+        for array_id in task[2:] or (None,):
+          self._remove_exit_file(task[1], array_id)
+    stop = set()
+    self.lock()
+    for task in tasks:
+      state.deadlines.pop(task[0], None)
+      if task[0] in state.timed_out:
+        # the wrapper might not have been able to write the results of the array jobs that it ran
+        state.timed_out.remove(task[0])
+        for array_id in task[2:] or (None,):
+          job, array_job = self._job_and_array(task[1], array_id)
+          if job is not None and (array_job if array_job is not None else job).status == 'executing':
+            stop.update(self.apply_job_event('finish', task[1], array_id, result = WALLTIME_EXCEEDED, usage = usages.get(task[0]) if state.direct else None))
+        continue
+      stop.update(self.apply_job_event('finish', task[1], task[2] if len(task) > 2 else None, result = task[0].returncode, usage = usages.pop(task[0], None)))
+      if isinstance(task[0], _CallableTask):
+        job = self.get_jobs((task[1],))
+        if job:
+          job[0].return_value, job[0].error = task[0].return_value, task[0].error
+    self.session.commit()
+    self.unlock()
+    self._record_runs()
+    self._stop_dependents(stop)
+
+  def _remove_finished(self, state, finished):
+    """Logs the results of the (array) jobs of the given finished tasks, and removes the tasks from the running tasks."""
+    for task_index in range(len(state.running_tasks)-1, -1, -1):
+      task = state.running_tasks[task_index]
+      process = task[0]
+
+      if task in finished:
+        # process ended; a wrapper might have run several array jobs
+        job_id = task[1]
+        self.lock(write=False)
+        for array_id in task[2:] or (None,):
+          job, array_job = self._job_and_array(job_id, array_id)
+          if job is not None:
+            jj = array_job if array_job is not None else job
+            result = "%s (%d)" % (jj.status, jj.result) if jj.result is not None else "%s (?)" % jj.status
+            if jj.status in ('queued', 'executing') and (job.max_attempts or isinstance(process, _AdoptedProcess)):
+              # the job failed and has been queued again according to its retry policy, or the adopted process did not write its result
+              logger.info("Job '%s' (%s) will be run again", job.name, self._format_log(job_id, array_id))
+              continue
+            if jj.status not in ('success', 'failure'):
+              logger.error("Job '%s' (%s) finished with status '%s' instead of 'success' or 'failure'. Usually this means an internal error. Check your wrapper_script parameter!", job.name, self._format_log(job_id, array_id), jj.status)
+              raise StopIteration("Job did not finish correctly.")
+            logger.info("Job '%s' (%s) finished execution with result '%s'", job.name, self._format_log(job_id, array_id), result)
+        self.unlock()
+        state.finished_tasks.add(job_id)
+        # in any case, remove the job from the list
+        del state.running_tasks[task_index]
+        state.task_resources.pop(process, None)
+        state.deadlines.pop(process, None)
+        state.timed_out.discard(process)
+        state.changed = True
+
+  def _update_ready(self, state, due, job_ids, critical_path, runtime_estimate):
+    """Puts the jobs whose retries are ``due`` and the jobs that have been added or changed their status since the last update into the ready queue; the database needs to be locked.
+    Returns True if the scheduler needs to check the jobs again without waiting."""
+    repeat_execution = False
+    # jobs whose retries are due are ready again
+    for unique in due:
+      del state.retrying[unique]
+    for job in self.get_jobs(due):
+      if self._is_ready(job):
+        state.ready.push(job)
+    # update the ready queue with the jobs that have been added or changed their status since the last time
+    since, state.counter = state.counter, change_counter(self.session)
+    changed_jobs = self._changed_jobs(job_ids, since)
+    if critical_path and (since is None or any(job.status == 'submitted' for job in changed_jobs)):
+      # only new jobs change the critical paths of the jobs that they wait for
+      state.ready.set_critical_paths(critical_path_lengths(self.session, runtime_estimate))
+    for job in changed_jobs:
+      if job.status == 'submitted':
+        # put new jobs into the queue
+        job.queue()
+      if job.get_array() and job.status in ('queued', 'executing') and not job.array_queued and job.array_finished():
+        # sometimes, the 'finish' command did not work for array jobs
+        job.finish(0, -1)
+        repeat_execution = True
+      if self._is_ready(job):
+        state.ready.push(job)
+    return repeat_execution
+
+  def _dispatch(self, state):
+    """Starts the next ready jobs that fit into the free resources of this machine; the database needs to be locked.
+    If a job does not fit, its resources are reserved, and only the jobs that fit into the remaining resources are started in the meantime (backfilling)."""
+    free = [state.capacity[0] - sum(r[0] for r in state.task_resources.values()), state.capacity[1] - sum(r[1] for r in state.task_resources.values())]
+    skipped = []
+    while state.ready and len(state.running_tasks) < state.parallel_jobs and len(skipped) < BACKFILL_LOOKAHEAD:
+      unique = state.ready.first()
+      jobs = self.get_jobs((unique,))
+      job = jobs[0] if jobs else None
+      if job is None or not self._is_ready(job):
+        # the job has been started completely, or it has been deleted, stopped or started by somebody else
+        state.ready.pop(unique)
+        continue
+      # jobs that require more than the whole machine are run when they are alone
+      need = [min(n, c) for n, c in zip(job.get_resources(), state.capacity)]
+      # the number of (array) jobs that fit into the free resources
+      fitting = min(int(f // n) if n and f != float('inf') else state.parallel_jobs for f, n in zip(free, need))
+      # without the direct mode, one wrapper can run several array jobs one after the other
+      size = (job.tasks_per_worker or 1) if not state.direct else 1
+      batches = max(min(fitting, state.parallel_jobs - len(state.running_tasks)), 0)
+      # (array) jobs that wait for their retry are started later; only as many queued array ids are read as can be started now
+      retry_times = job.get_retry_times()
+      array_ids = job.get_array_ids(('queued',), limit = batches * size + len(retry_times)) if job.get_array() else [None]
+      array_ids = [array_id for array_id in array_ids if array_id not in retry_times][:batches * size]
+      for batch in [array_ids[i:i+size] for i in range(0, len(array_ids), size)]:
+        if self._start_batch(state, job, batch, need):
+          free = [f - n for f, n in zip(free, need)]
+      if not self._is_ready(job):
+        state.ready.pop(unique)
+      elif retry_times and len(retry_times) == (job.array_queued if job.get_array() else 1):
+        # all queued (array) jobs wait for their retry
+        state.retrying[unique] = min(retry_times.values())
+        state.ready.pop(unique)
+      elif len(state.running_tasks) < state.parallel_jobs:
+        # the job did not fit (completely); reserve the free resources that it needs, and try the next job
+        if not skipped:
+          free = [f - min(n, max(f, 0)) for f, n in zip(free, need)]
+        skipped.append(state.ready.pop(unique))
+    for item in skipped:
+      state.ready.restore(item)
+
+  def _start_batch(self, state, job, batch, need):
+    """Claims the given (array) jobs of the given job, and starts a process that runs the claimed ones with the resources that they ``need``.
+    Returns True if a process has been started."""
+    # array jobs that another scheduler was faster to claim are skipped
+    batch = [array_id for array_id in batch if job.claim(array_id, state.claimed_by)]
+    if not batch:
+      return False
+    array_id = batch[0]
+    if job.call is not None:
+      if state.pool is None:
+        state.pool = _worker_pool(state.parallel_jobs, state.preload)
+      logger.info("Starting execution of Job '%s' (%s) in the worker pool", job.name, self._format_log(job.unique))
+      process = _CallableTask(state.pool, job.call, state.events.notify if state.events is not None else None)
+    else:
+      process = self._run_parallel_job(job.unique, array_id, next_array_ids=batch[1:], spooled=state.spooled, **state.run_options)
+    if process is None:
+      # the job has been deleted, or it has been finished since it could not be executed, which might release other (array) jobs
+      state.changed = True
+      return False
+    if not isinstance(process, _CallableTask):
+      # a restarted scheduler can adopt the process
+      pid_start = process_start_time(process.pid)
+      for i in batch:
+        job.set_process(i, process.pid, pid_start)
+    state.running_tasks.append((process, job.unique) if array_id is None else (process, job.unique) + tuple(batch))
+    state.task_resources[process] = need
+    if job.walltime and not isinstance(process, _CallableTask):
+      state.deadlines[process] = (time.time() + job.walltime * len(batch), signal.SIGTERM)
+    state.ready.started(job)
+    if state.direct or job.call is not None:
+      job.execute(array_id, state.machine_name)
+    return True
+
+  def run_scheduler(self, parallel_jobs = 1, job_ids = None, sleep_time = 0.1, die_when_finished = False, no_log = False, nice = None, verbosity = 0, event_driven = False, direct = False, cores = None, memory = None, fair_share = None, preload = None, adopt = False, critical_path = False, runtime_estimate = None):
+    """Starts the scheduler, which is constantly checking for jobs that should be ran.
+
+    By default, the scheduler checks the processes and the database every ``sleep_time`` seconds.
+    In the ``event_driven`` mode, the scheduler wakes up immediately when one of its processes exits, and only reads the jobs when the change counter of the database (see :py:class:`gridtk.models.ChangeCounter`) shows that something has changed; ``sleep_time`` is then the interval in which the change counter is read.
+
+    In the ``direct`` mode, the command lines of the jobs are executed directly instead of through the ``jman run-job`` wrapper, and the scheduler itself records when the jobs start and finish.
+
+    When the number of ``cores`` or the ``memory`` (e.g. ``'64G'``) of this machine are given, at most ``parallel_jobs`` jobs are run at the same time, whose requirements (see :py:meth:`gridtk.models.Job.get_resources`) fit into the machine.
+
+    Jobs with higher priority are started first.
+    When a dictionary of ``fair_share`` weights for job names is given (which might be empty), the jobs with different names share the machine according to their weights (1 for names that are not given).
+    With ``critical_path``, the jobs that start the longest chains of dependent jobs are started first (among the jobs of the same priority), see :py:func:`gridtk.models.critical_path_lengths`; the ``runtime_estimate`` function might return the estimated runtime of a :py:class:`gridtk.models.Job`; by default, the runtimes are predicted from the runtime history of this job manager (see :py:meth:`predict_runtime`) if it has one, otherwise each job counts 1.
+
+    Several schedulers, on the same or on different hosts, can run the jobs of the same database; each (array) job is claimed by exactly one of them (see :py:meth:`gridtk.models.Job.claim`).
+
+    The Python calls submitted with :py:meth:`submit_callable` are run in a pool of ``parallel_jobs`` worker processes, which are forked from a server process that has imported the modules given in ``preload``.
+
+    Each process runs in its own session.  When a job exceeds its walltime (multiplied by the number of array jobs that the process runs), the whole process group is terminated with SIGTERM, and killed with SIGKILL after :py:data:`gridtk.tools.TERMINATE_TIMEOUT` seconds; its (array) jobs fail with the result :py:data:`gridtk.tools.WALLTIME_EXCEEDED`.
+    The process groups are stopped in the same way when the scheduler is interrupted.
+
+    The id and the start time of each process are stored with its (array) jobs.
+    With ``adopt``, the scheduler adopts the processes that a previous scheduler on this machine has left running (e.g. when it crashed), and waits for them to finish; the executing (array) jobs whose processes have gone without writing or recording their result are queued again.
+    The wrapper writes the results of its jobs itself; in the ``direct`` mode, the exit status of each job is recorded in a file (see :py:meth:`_run_parallel_job`), with which the job is finished.
+    When a scheduler with ``adopt`` is interrupted, it leaves its processes running, so that the next scheduler with ``adopt`` can adopt them.
+    """
+    capacity = (float('inf') if cores is None else cores, float('inf') if memory is None else memory_in_bytes(memory))
+    if event_driven and not isinstance(threading.current_thread(), threading._MainThread):
+      logger.warning("The event driven scheduler can only run in the main thread; checking for events every %s seconds instead." % sleep_time)
+      event_driven = False
+    if runtime_estimate is None and self._history is not None:
+      runtime_estimate = self.predict_runtime
+    state = _SchedulerState(parallel_jobs, capacity, _ReadyQueue(fair_share, {} if critical_path else None), _ChildEvents() if event_driven else None, direct, preload, dict(no_log=no_log, nice=nice, verbosity=verbosity, direct=direct))
+    try:
+      if adopt:
+        self._adopt(state, job_ids)
 
       # keep the scheduler alive until every job is finished or the KeyboardInterrupt is caught
       while True:
         # Flag that might be set in some rare cases, and that prevents the scheduler to die
         repeat_execution = False
-        # FIRST, try if there are finished processes
-        for task_index in range(len(running_tasks)-1, -1, -1):
-          task = running_tasks[task_index]
-          process = task[0]
-
-          if process.poll() is not None:
-            # process ended
-            job_id = task[1]
-            array_id = task[2] if len(task) > 2 else None
-            self.lock()
-            job, array_job = self._job_and_array(job_id, array_id)
-            if job is not None:
-              jj = array_job if array_job is not None else job
-              result = "%s (%d)" % (jj.status, jj.result) if jj.result is not None else "%s (?)" % jj.status
-              if jj.status not in ('success', 'failure'):
-                logger.error("Job '%s' (%s) finished with status '%s' instead of 'success' or 'failure'. Usually this means an internal error. Check your wrapper_script parameter!", job.name, self._format_log(job_id, array_id), jj.status)
-                raise StopIteration("Job did not finish correctly.")
-              logger.info("Job '%s' (%s) finished execution with result '%s'", job.name, self._format_log(job_id, array_id), result)
-            self.unlock()
-            finished_tasks.add(job_id)
-            # in any case, remove the job from the list
-            del running_tasks[task_index]
+        # FIRST, stop the processes that exceeded their walltime, and try if there are finished processes
+        self._check_walltimes(state)
+        finished, usages = self._poll_tasks(state)
+        # the results of adopted processes are written by their wrappers or recorded in the direct mode; (array) jobs without result are run again
+        gone = [task for task in finished if isinstance(task[0], _AdoptedProcess) and task[0] not in state.timed_out]
+        if gone:
+          self._finish_adopted(gone)
+        # the scheduler writes the results of the jobs that it has run itself, and of the processes that it has stopped
+        recorded = [task for task in finished if task[0] in state.timed_out or not isinstance(task[0], _AdoptedProcess) and (direct or isinstance(task[0], _CallableTask))]
+        if recorded:
+          self._write_results(state, recorded, usages)
+        self._remove_finished(state, finished)
 
         # SECOND, check if new jobs can be submitted; THIS NEEDS TO LOCK THE DATABASE
-        if len(running_tasks) < parallel_jobs:
-          # get all unfinished jobs:
+        due = [unique for unique, retry_time in state.retrying.items() if retry_time <= datetime.now()]
+        if len(state.running_tasks) < parallel_jobs and (state.changed or due or not event_driven):
           self.lock()
-          jobs = self.get_jobs(job_ids)
-          # put all new jobs into the queue
-          for job in jobs:
-            if job.status == 'submitted' and job.queue_name == 'local':
-              job.queue()
-
-          # get all unfinished jobs that are submitted to the local queue
-          unfinished_jobs = [job for job in jobs if job.status in ('queued', 'executing') and job.queue_name == 'local']
-          for job in unfinished_jobs:
-            if job.array:
-              # find array jobs that can run
-              queued_array_jobs = [array_job for array_job in job.array if array_job.status == 'queued']
-              if not len(queued_array_jobs):
-                job.finish(0, -1)
-                repeat_execution = True
-              else:
-                # there are new array jobs to run
-                for i in range(min(parallel_jobs - len(running_tasks), len(queued_array_jobs))):
-                  array_job = queued_array_jobs[i]
-                  # start a new job from the array
-                  process = self._run_parallel_job(job.unique, array_job.id, no_log=no_log, nice=nice, verbosity=verbosity)
-                  if process is None:
-                    continue
-                  running_tasks.append((process, job.unique, array_job.id))
-                  # we here set the status to executing manually to avoid jobs to be run twice
-                  # e.g., if the loop is executed while the asynchronous job did not start yet
-                  array_job.status = 'executing'
-                  job.status = 'executing'
-                  if len(running_tasks) == parallel_jobs:
-                    break
-            else:
-              if job.status == 'queued':
-                # start a new job
-                process = self._run_parallel_job(job.unique, no_log=no_log, nice=nice, verbosity=verbosity)
-                if process is None:
-                  continue
-                running_tasks.append((process, job.unique))
-                # we here set the status to executing manually to avoid jobs to be run twice
-                # e.g., if the loop is executed while the asynchronous job did not start yet
-                job.status = 'executing'
-            if len(running_tasks) == parallel_jobs:
-              break
-
+          repeat_execution = self._update_ready(state, due, job_ids, critical_path, runtime_estimate)
+          state.changed = False
+          self._dispatch(state)
+          # the jobs need to be checked again when jobs have been finished without being started
+          repeat_execution = repeat_execution or state.changed
+          state.changed = repeat_execution
           self.session.commit()
           self.unlock()
 
         # if after the submission of jobs there are no jobs running, we should have finished all the queue.
-        if die_when_finished and not repeat_execution and len(running_tasks) == 0:
+        if die_when_finished and not repeat_execution and len(state.running_tasks) == 0 and not state.retrying:
           logger.info("Stopping task scheduler since there are no more jobs running.")
           break
 
         # THIRD: sleep the desired amount of time before re-checking
-        time.sleep(sleep_time)
+        if not event_driven:
+          time.sleep(sleep_time)
+        elif not repeat_execution:
+          # wait until a process exits, or until the change counter shows that other processes have changed the database, or until the next process exceeds its walltime, or until the next retry is due
+          state.events.wait(max(min([sleep_time] + [deadline - time.time() for deadline, _ in state.deadlines.values()] + [(retry_time - datetime.now()).total_seconds() for retry_time in state.retrying.values()]), 0))
+          if not state.changed:
+            self.lock(write=False)
+            state.changed = change_counter(self.session) != state.counter
+            self.unlock()
 
     # This is the only way to stop: you have to interrupt the scheduler
     except (KeyboardInterrupt, StopIteration):
       if hasattr(self, 'session'):
         self.unlock()
       logger.info("Stopping task scheduler due to user interrupt.")
-      for task in running_tasks:
-        logger.warn("Killing job '%s' that was still running.", self._format_log(task[1], task[2] if len(task) > 2 else None))
-        try:
-          task[0].kill()
-        except OSError as e:
-          logger.error("Killing job '%s' was not successful: '%s'", self._format_log(task[1], task[2] if len(task) > 2 else None), e)
-        self.stop_job(task[1])
-      # stop all jobs that are currently running or queued
-      self.stop_jobs(job_ids)
+      self._stop_tasks(state, job_ids, adopt)
+
+    finally:
+      if state.events is not None:
+        state.events.close()
+      if state.pool is not None:
+        state.pool.terminate()
 
     # check the result of the jobs that we have run, and return the list of failed jobs
-    self.lock()
-    jobs = self.get_jobs(finished_tasks)
+    self.lock(write=False)
+    jobs = self.get_jobs(state.finished_tasks)
     failures = [job.unique for job in jobs if job.status != 'success']
     self.unlock()
     return sorted(failures)
@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Stores the output and error logs of all (array) jobs of a job in a single file.
+
+Array jobs with many thousands of tasks create two log files per task, which puts a high load on (network) file systems, both when the files are written and when they are deleted.
+Instead, the logs of jobs with packed logs are appended to one segment file per job, and an index file records the array id, the stream, the offset and the length of each log.
+While a task runs, its logs are buffered in temporary files, which are appended to the segment when the task has finished.
+"""
+
+import fcntl
+import os
+import shutil
+import tempfile
+
+from .tools import makedirs_safe
+
+
+# The streams of the logs
+STREAMS = ('out', 'err')
+
+
+def spool():
+  """Returns a temporary file (on the local disk), which buffers the logs of a running task."""
+  return tempfile.TemporaryFile()
+
+
+class PackedLog(object):
+  """The packed logs of one job, which are stored in the segment file with the given name, and its index file with the ``.index`` suffix.
+
+  Both files are only appended to, while a lock is held on the index file, so that concurrent tasks can add their logs.
+  Each line of the index contains the array id (``-`` for jobs that are not array jobs), the stream, the offset and the length of one log.
+  Later lines hide the earlier lines of the same array id and stream, e.g., of the previous run of a re-submitted job; deleted logs are marked by an offset of -1.
+  """
+
+  def __init__(self, filename):
+    self.filename = filename
+    self.index_filename = filename + ".index"
+    self._index = None
+
+  def append(self, logs):
+    """Appends the given logs, each given as ``(array_id, stream, file)``, where the file is opened for binary reading (e.g. a file created by :py:func:`spool`), or None to delete the log.
+    All logs are written while the files are locked once."""
+    makedirs_safe(os.path.dirname(self.filename))
+    with open(self.index_filename, 'a') as index:
+      fcntl.lockf(index, fcntl.LOCK_EX)
+      try:
+        lines = []
+        with open(self.filename, 'ab') as segment:
+          for array_id, stream, log in logs:
+            offset, length = -1, 0
+            if log is not None:
+              offset = os.fstat(segment.fileno()).st_size
+              log.seek(0)
+              shutil.copyfileobj(log, segment)
+              segment.flush()
+              length = os.fstat(segment.fileno()).st_size - offset
+            lines.append("%s %s %d %d\n" % ('-' if array_id is None else array_id, stream, offset, length))
+        index.write("".join(lines))
+        index.flush()
+      finally:
+        fcntl.lockf(index, fcntl.LOCK_UN)
+    self._index = None
+
+  def read(self, array_id, stream):
+    """Returns the latest contents of the given stream of the given array id (None for jobs that are not array jobs), or None if there is no such log."""
+    if self._index is None:
+      self._index = {}
+      if os.path.exists(self.index_filename):
+        with open(self.index_filename) as index:
+          for line in index:
+            fields = line.split()
+            if len(fields) == 4:
+              self._index[(None if fields[0] == '-' else int(fields[0]), fields[1])] = (int(fields[2]), int(fields[3]))
+    offset, length = self._index.get((array_id, stream), (-1, 0))
+    if offset < 0:
+      return None
+    with open(self.filename, 'rb') as segment:
+      segment.seek(offset)
+      return segment.read(length)
+
+  def delete(self, array_ids = None):
+    """Deletes the logs of the given array ids, or the whole packed log when no array ids are given."""
+    if array_ids is None:
+      for filename in (self.filename, self.index_filename):
+        if os.path.exists(filename):
+          os.remove(filename)
+      self._index = None
+    elif array_ids and os.path.exists(self.index_filename):
+      self.append([(array_id, stream, None) for array_id in array_ids for stream in STREAMS])
@@ -3,9 +3,16 @@ from __future__ import print_function
 
 import os, sys
 import subprocess
+import threading
+import time
 import socket # to get the host name
-from .models import Base, Job, ArrayJob, Status, times
-from .tools import logger
+import sqlite3
+from datetime import datetime, timedelta
+from .models import Base, Job, ArrayJob, CompactArrayJob, Attempt, Status, IdSet, times, resources, usage_statistics, USAGE_STATISTICS, job_rows, create_schema, upgrade_schema
+from .tools import logger, format_memory, wait_process, terminate_process_group, WALLTIME_EXCEEDED
+from .logstore import PackedLog, spool
+from .history import RuntimeHistory, format_duration
+from .server import StateClient, read_token, token_file
 
 
 import sqlalchemy
@@ -30,13 +37,54 @@ else: #define our own
     return None
 
 
+# The time in seconds that a process waits to obtain the lock of the database
+BUSY_TIMEOUT = 600
+
+def _set_wal_pragmas(connection, connection_record):
+  """Switches a new connection to the database into WAL mode."""
+  cursor = connection.cursor()
+  cursor.execute("PRAGMA journal_mode=WAL")
+  # in WAL mode, the database cannot get corrupted when syncing less often
+  cursor.execute("PRAGMA synchronous=NORMAL")
+  cursor.execute("PRAGMA busy_timeout=%d" % (BUSY_TIMEOUT * 1000))
+  cursor.close()
+
+def _set_rollback_journal(connection, connection_record):
+  """Switches a database that has been written in WAL mode back to the classic rollback journal; this only succeeds when no other process has opened the database."""
+  cursor = connection.cursor()
+  try:
+    if cursor.execute("PRAGMA journal_mode").fetchone()[0] == 'wal':
+      cursor.execute("PRAGMA journal_mode=DELETE")
+  except sqlite3.OperationalError as e:
+    logger.debug("Could not switch the database back to the rollback journal: %s", e)
+  finally:
+    cursor.close()
+
+def _begin_immediate(session, transaction, connection):
+  """Starts the transaction of a writing session with obtaining the write lock."""
+  connection.execute(sqlalchemy.text("BEGIN IMMEDIATE"))
+
+
 class JobManager:
   """This job manager defines the basic interface for handling jobs in the SQL database."""
 
-  def __init__(self, database = 'submitted.sql3', wrapper_script = None, debug = False):
+  def __init__(self, database = 'submitted.sql3', wrapper_script = None, debug = False, wal = False, server = None, history = None):
+    """Initializes the connection to the database.
+    With ``wal = True``, the database is written in WAL mode, where readers (such as ``jman list``) do not block the writers (such as the jobs that start and finish) and vice versa.
+    WAL mode requires that all processes that access the database run on machines that share memory with the machine the database is stored on, so it does not work when the jobs access the database from other hosts, e.g., over a network file system.
+    Hence, the classic rollback journal is used by default (and databases that have been written in WAL mode are switched back to it, if no other process has opened them).
+    If the address of a state server (see :py:class:`gridtk.server.StateServer`) is given, running jobs send their status changes to this server, and jobs are listed by the server.
+    If the file name of a runtime ``history`` (see :py:mod:`gridtk.history`) is given, the runtimes of the successful (array) jobs are recorded in it, and the runtimes of jobs are predicted from it."""
     self._database = os.path.realpath(database)
-    self._engine = sqlalchemy.create_engine("sqlite:///"+self._database, connect_args={'timeout': 600}, echo=debug)
-    self._session_maker = sqlalchemy.orm.sessionmaker(bind=self._engine)
+    self._debug = debug
+    self._wal = wal
+    self._server = server
+    self._history = RuntimeHistory(history) if history is not None else None
+    # the runs of the (array) jobs that have finished successfully, which are recorded in the history after they have been committed
+    self._finished_runs = []
+    self._create_engine()
+    # the schema of an existing database is checked (and upgraded) once, when it is locked for the first time
+    self._schema_checked = False
 
     # store the command that this job manager was called with
     if wrapper_script is None: wrapper_script = 'jman'
@@ -57,30 +105,47 @@ class JobManager:
     if os.path.isfile(self._database):
       # in errornous cases, the session might still be active, so don't create a deadlock here!
       if not hasattr(self, 'session'):
-        self.lock()
+        self.lock(write=False)
       job_count = len(self.get_jobs())
       self.unlock()
       if not job_count:
+        self._engine.dispose()
         logger.debug("Removed database file '%s' since database is empty" % self._database)
         os.remove(self._database)
+        # the files of the WAL mode are removed by SQLite when the last connection is closed; if they still exist, other processes (maybe on other hosts) have opened the database
+
+
+  def _create_engine(self):
+    """Creates the database engine and the session makers for writing and for reading sessions."""
+    # connections are closed with their session, so that this process does not keep the database (and the files of the WAL mode) open after unlocking it
+    self._engine = sqlalchemy.create_engine("sqlite:///"+self._database, connect_args={'timeout': BUSY_TIMEOUT}, echo=self._debug, poolclass=sqlalchemy.pool.NullPool)
+    self._session_maker = sqlalchemy.orm.sessionmaker(bind=self._engine)
+    # reading sessions never write to the database, not even the modifications that are made to the jobs, e.g., in Job.refresh()
+    self._read_session_maker = sqlalchemy.orm.sessionmaker(bind=self._engine, autoflush=False)
+    sqlalchemy.event.listen(self._engine, 'connect', _set_wal_pragmas if self._wal else _set_rollback_journal)
+    # several writers (e.g. local schedulers on different hosts) would otherwise dead-lock when they read before they write
+    sqlalchemy.event.listen(self._session_maker, 'after_begin', _begin_immediate)
 
 
-  def lock(self):
-    """Generates (and returns) a blocking session object to the database."""
+  def lock(self, write = True):
+    """Generates (and returns) a blocking session object to the database.
+    Writing sessions obtain the write lock immediately, so that they cannot fail to obtain it later on;
+    in WAL mode, sessions that only read (``write = False``) never block and are never blocked by other sessions."""
     if hasattr(self, 'session'):
       raise RuntimeError('Dead lock detected. Please do not try to lock the session when it is already locked!')
 
     if LooseVersion(sqlalchemy.__version__) < LooseVersion('0.7.8'):
       # for old sqlalchemy versions, in some cases it is required to re-generate the engine for each session
-      self._engine = sqlalchemy.create_engine("sqlite:///"+self._database)
-      self._session_maker = sqlalchemy.orm.sessionmaker(bind=self._engine)
+      self._create_engine()
 
     # create the database if it does not exist yet
     if not os.path.exists(self._database):
       self._create()
+    elif not self._schema_checked:
+      self._upgrade()
 
     # now, create a session
-    self.session = self._session_maker()
+    self.session = self._session_maker() if write else self._read_session_maker()
     logger.debug("Created new database session to '%s'" % self._database)
     return self.session
 
@@ -94,6 +159,28 @@ class JobManager:
     del self.session
 
 
+  def _wrapper_options(self):
+    """Returns the options of this job manager that need to be passed on to the wrapper script that runs the jobs."""
+    return ['--wal' if self._wal else '--no-wal'] + ([] if self._server is None else ['--server', self._server]) + ([] if self._history is None else ['--history', self._history.filename])
+
+
+  def predict_runtime(self, job):
+    """Returns the runtime in seconds of the given :py:class:`gridtk.models.Job` (or of each of its array jobs) that is predicted from the runtime history, or None if there is no history of the job."""
+    if self._history is None:
+      return None
+    return self._history.predict(job.name, job.get_command_line())
+
+
+  def _record_runs(self):
+    """Records the runs of the (array) jobs that have finished successfully in the runtime history."""
+    runs, self._finished_runs = self._finished_runs, []
+    if runs and self._history is not None:
+      try:
+        self._history.record(runs)
+      except sqlite3.Error as e:
+        logger.warning("Could not record the runtimes of %d jobs in the history '%s': %s", len(runs), self._history.filename, e)
+
+
   def _create(self):
     """Creates a new and empty database."""
     from .tools import makedirs_safe
@@ -102,10 +189,18 @@ class JobManager:
     makedirs_safe(os.path.dirname(self._database))
 
     # create all the tables
-    Base.metadata.create_all(self._engine)
+    create_schema(self._engine)
+    self._schema_checked = True
     logger.debug("Created new empty database '%s'" % self._database)
 
 
+  def _upgrade(self):
+    """Upgrades the schema of an existing database, e.g., to add indexes that did not exist in older versions of gridtk."""
+    old_version = upgrade_schema(self._engine)
+    self._schema_checked = True
+    logger.debug("Checked schema of database '%s' (version %d)" % (self._database, old_version))
+
+
 
   def get_jobs(self, job_ids = None):
     """Returns a list of jobs that are stored in the database."""
@@ -113,7 +208,7 @@ class JobManager:
       return []
     q = self.session.query(Job)
     if job_ids is not None:
-      q = q.filter(Job.unique.in_(job_ids))
+      q = q.filter(IdSet.from_ids(job_ids).filter(Job.unique))
     return sorted(list(q), key=lambda job: job.unique)
 
 
@@ -130,100 +225,222 @@ class JobManager:
     unique_id = job.unique
 
     if array_id is not None:
-      array_job = list(self.session.query(ArrayJob).filter(ArrayJob.job_id == unique_id).filter(ArrayJob.id == array_id))
-      assert (len(array_job) == 1)
-      return (job, array_job[0])
+      array_job = job.get_array_job(array_id)
+      assert array_job is not None
+      return (job, array_job)
     else:
       return (job, None)
 
 
-  def run_job(self, job_id, array_id = None):
-    """This function is called to run a job (e.g. in the grid) with the given id and the given array index if applicable."""
-    # set the job's status in the database
+  def run_job(self, job_id, array_id = None, array_ids = None, walltime = None, retry_delay = None):
+    """This function is called to run a job (e.g. in the grid) with the given id and the given array index if applicable.
+    When several ``array_ids`` are given instead, these array jobs are run one after the other, and their results are written together when all of them have finished.
+    If a state server is configured, the status changes of the job are sent to the server instead of being written to the database.
+    For jobs with packed logs, the output of each array job is buffered in temporary files, which are appended to the packed log when all array jobs have finished.
+    The resource usage of each (array) job is recorded together with its result.
+    When a ``walltime`` (in seconds) is given, each (array) job runs in its own process group, which is terminated when the job runs longer, and the job fails with the result 84.
+    When a ``retry_delay`` (in seconds) is given, the (array) jobs that failed and that were queued again by the retry policy of the job are run again after this delay, which doubles with every further attempt."""
+    array_ids = [array_id] if array_ids is None else list(array_ids)
+    # set the 'executing' status to the job and get its command line
     try:
-      # get the job from the database
-      self.lock()
-      jobs = self.get_jobs((job_id,))
-      if not len(jobs):
-        # it seems that the job has been deleted in the meanwhile
-        return
-      job = jobs[0]
-
       # get the machine name we are executing on; this might only work at idiap
       machine_name = socket.gethostname()
-
-      # set the 'executing' status to the job
-      job.execute(array_id, machine_name)
-
-      self.session.commit()
+      values = self._job_events([('execute', job_id, array_id, {'machine_name' : machine_name}) for array_id in array_ids])
+      # (array) jobs of jobs with a retry policy might have finished already
+      array_ids = [array_id for array_id, value in zip(array_ids, values) if value is not None]
+      if not array_ids:
+        # it seems that the job has been deleted in the meanwhile
+        return
+      job = next(value for value in values if value is not None)
     except Exception as e:
       logger.error("Caught exception '%s'", e)
-      pass
-    finally:
+      # get the command line of the job from the database; does not need write access
+      self.lock(write=False)
+      job = self.get_jobs((self._unique_job_id(job_id),))[0]
+      packed_log = job.get_packed_log()
+      job = (job.get_command_line(), job.get_exec_dir()) + ((packed_log.filename,) if packed_log is not None else ())
       self.unlock()
-
-    # get the command line of the job from the database; does not need write access
+    command_line, exec_dir = job[:2]
+    packed_log = PackedLog(job[2]) if len(job) > 2 else None
+
+    attempt = 1
+    while array_ids:
+      results, usages, begins, durations, logs = [], [], [], [], []
+      for array_id in array_ids:
+        logger.info("Starting job %d: %s", job_id, " ".join(command_line))
+        # each array job gets its own task id
+        environ = dict(os.environ, SGE_TASK_ID = str(array_id)) if array_id is not None else None
+        out, err = (spool(), spool()) if packed_log is not None else (None, None)
+
+        # execute the command line of the job, and wait until it has finished
+        begin = time.time()
+        try:
+          if packed_log is not None:
+            logs.extend(((array_id, 'out', out), (array_id, 'err', err)))
+          process = subprocess.Popen(command_line, cwd=exec_dir, env=environ, stdout=out, stderr=err, start_new_session=walltime is not None)
+          timer = None
+          if walltime is not None:
+            timer = threading.Timer(walltime, terminate_process_group, (process,))
+            timer.daemon = True
+            timer.start()
+          result, usage = wait_process(process)
+          if timer is not None:
+            timer.cancel()
+            if time.time() - begin >= walltime:
+              logger.error("Job %d was stopped since it exceeded its walltime of %d seconds", job_id, walltime)
+              result = WALLTIME_EXCEEDED
+          logger.info("Job %d finished with result %s", job_id, str(result))
+        except Exception as e:
+          logger.error("The job with id '%d' could not be executed: %s", job_id, e)
+          result, usage = 69, None # ASCII: 'E'
+        results.append(result)
+        usages.append(usage)
+        begins.append(begin)
+        durations.append(time.time() - begin)
+
+      if packed_log is not None:
+        # the logs are written before the jobs are marked as finished
+        try:
+          packed_log.append(logs)
+        except (IOError, OSError) as e:
+          logger.error("Could not write the logs of job %d: %s", job_id, e)
+        for log in logs:
+          log[2].close()
+
+      # set a new status and the results of the job
+      try:
+        deps = sorted(set(dep for value in self._job_events([('finish', job_id, array_id, {'result' : result, 'usage' : usage, 'start_time' : begin, 'duration' : duration}) for array_id, result, usage, begin, duration in zip(array_ids, results, usages, begins, durations)]) for dep in value))
+        if deps:
+          # This might not be working properly, so use with care!
+          self.stop_jobs(deps)
+          logger.warning("Stopped dependent jobs '%s' since this job failed.", str(deps))
+      except Exception as e:
+        logger.error("Caught exception '%s'", e)
+
+      # (array) jobs that failed are run again after the delay, when the retry policy of the job queued them again
+      failed = [array_id for array_id, result in zip(array_ids, results) if result != 0]
+      if retry_delay is None or not failed:
+        break
+      time.sleep(retry_delay * 2 ** (attempt - 1))
+      attempt += 1
+      try:
+        array_ids = [array_id for array_id, value in zip(failed, self._job_events([('execute', job_id, array_id, {'machine_name' : machine_name}) for array_id in failed])) if value is not None]
+      except Exception as e:
+        logger.error("Caught exception '%s'", e)
+        break
+
+
+  @property
+  def database(self):
+    """The absolute file name of the database."""
+    return self._database
+
+
+  def _state_client(self):
+    """Returns a client of the state server, which authenticates with the token of the server of this database."""
+    return StateClient(self._server, token = read_token(token_file(self._database)))
+
+
+  def _job_events(self, events):
+    """Sends the given events of running jobs, each given as ``(event, job_id, array_id, kwargs)``, to the state server, or applies all of them to the database in one transaction if no server is configured or reachable.
+    Returns the values of the events."""
+    if self._server is not None:
+      try:
+        client = self._state_client()
+        return [client.request(event, job_id = job_id, array_id = array_id, **kwargs) for event, job_id, array_id, kwargs in events]
+      except socket.error as e:
+        logger.warning("Could not connect to the state server '%s' (%s); accessing the database directly", self._server, e)
+    values, _ = self.apply_job_events(events)
+    for value in values:
+      if isinstance(value, Exception):
+        raise value
+    return values
+
+
+  def apply_job_events(self, events):
+    """Applies the given events of running jobs, each given as ``(event, job_id, array_id, kwargs)``, to the database with a single commit (see :py:meth:`apply_job_event`), and records the runtimes of the (array) jobs that finished successfully in the runtime history.
+    Returns the value of each event (or the exception that the event raised) and the unique ids of the jobs whose status might have changed, i.e., the jobs of the events and the jobs that wait for them.
+    Exceptions that prevent the commit are raised."""
+    values, touched = [], set()
     self.lock()
-    job = self.get_jobs((job_id,))[0]
-    command_line = job.get_command_line()
-    exec_dir = job.get_exec_dir()
-    self.unlock()
-
-    logger.info("Starting job %d: %s", job_id, " ".join(command_line))
-
-    # execute the command line of the job, and wait until it has finished
-    try:
-      result = subprocess.call(command_line, cwd=exec_dir)
-      logger.info("Job %d finished with result %s", job_id, str(result))
-    except Exception as e:
-      logger.error("The job with id '%d' could not be executed: %s", job_id, e)
-      result = 69 # ASCII: 'E'
-
-    # set a new status and the results of the job
     try:
-      self.lock()
-      jobs = self.get_jobs((job_id,))
-      if not len(jobs):
-        # it seems that the job has been deleted in the meanwhile
-        logger.error("The job with id '%d' could not be found in the database!", job_id)
-        self.unlock()
-        return
+      for event, job_id, array_id, kwargs in events:
+        touched.add(self._unique_job_id(job_id))
+        try:
+          values.append(self.apply_job_event(event, job_id, array_id, **kwargs))
+        except Exception as e:
+          values.append(e)
+      # jobs that have been finished might have released the jobs that depend on them
+      touched.update(dep.unique for job in self.get_jobs(touched) for dep in job.get_jobs_waiting_for_us())
+      self.session.commit()
+    except Exception:
+      # the runs of the events that were not written are not recorded either
+      self._finished_runs = []
+      raise
+    finally:
+      self.unlock()
+    self._record_runs()
+    return values, touched
 
-      job = jobs[0]
-      job.finish(result, array_id)
 
-      self.session.commit()
+  def _unique_job_id(self, job_id):
+    """Returns the unique id of the job with the given id, as it is used by the wrapper script that runs the job."""
+    return job_id
 
-      # This might not be working properly, so use with care!
-      if job.stop_on_failure and job.status == 'failure':
-        # the job has failed
-        # stop this and all dependent jobs from execution
-        dependent_jobs = job.get_jobs_waiting_for_us()
-        dependent_job_ids = set([dep.unique for dep in dependent_jobs] + [job.unique])
-        while len(dependent_jobs):
-          dep = dependent_jobs.pop(0)
-          new = dep.get_jobs_waiting_for_us()
-          dependent_jobs += new
-          dependent_job_ids.update([dep.unique for dep in new])
-
-        self.unlock()
-        deps = sorted(list(dependent_job_ids))
-        self.stop_jobs(deps)
-        logger.warn ("Stopped dependent jobs '%s' since this job failed.", str(deps))
 
-    except Exception as e:
-      logger.error("Caught exception '%s'", e)
-      pass
-    finally:
-      if hasattr(self, 'session'):
-        self.unlock()
+  def apply_job_event(self, event, job_id, array_id = None, machine_name = None, result = None, usage = None, start_time = None, duration = None):
+    """Applies the given event of a running job to the (locked) database, without committing.
 
+    For the 'execute' event, the status of the job is set to 'executing', and the command line and the execution directory of the job (and the file name of its packed log, if any) are returned, or None if the job does not exist or, for jobs with a retry policy, has finished already.
+    For the 'finish' event, the result and the resource usage of the job are set, and the ids of the jobs that need to be stopped due to the failure of this job are returned.
+    The ``start_time`` (in seconds since the epoch) and the ``duration`` (in seconds) that the process measured for the (array) job are stored as its start and finish time.
+    With a runtime history, the runtime of a successful (array) job, i.e., the measured ``duration`` in seconds or else the time since the job was started, is kept until :py:meth:`_record_runs` is called after the commit."""
+    jobs = self.get_jobs((self._unique_job_id(job_id),))
+    if not len(jobs):
+      logger.error("The job with id '%d' could not be found in the database!", job_id)
+      return None if event == 'execute' else []
+    job = jobs[0]
 
-  def list(self, job_ids, print_array_jobs = False, print_dependencies = False, long = False, print_times = False, status=Status, names=None, ids_only=False):
-    """Lists the jobs currently added to the database."""
+    if event == 'execute':
+      if job.max_attempts and (job.get_array_job(array_id) if array_id is not None else job).status in ('success', 'failure'):
+        # the (array) job has finished its last attempt already, e.g., when a grid job is re-submitted to retry some of its array jobs
+        return None
+      job.execute(array_id, machine_name)
+      packed_log = job.get_packed_log()
+      return (job.get_command_line(), job.get_exec_dir()) + ((packed_log.filename,) if packed_log is not None else ())
+
+    if event != 'finish':
+      raise ValueError("Unknown job event '%s'" % event)
+    if duration is None:
+      # the tasks of a batch (see run_job) all share the start time of the batch
+      run = job.get_array_job(array_id) if array_id is not None else job
+      duration = (datetime.now() - run.start_time).total_seconds() if run is not None and run.start_time is not None else None
+    start_time = datetime.fromtimestamp(start_time) if start_time is not None else None
+    job.finish(result, array_id, usage, start_time, start_time + timedelta(seconds = duration) if start_time is not None and duration is not None else None)
+    if self._history is not None and result == 0 and duration is not None:
+      self._finished_runs.append((job.name, job.get_command_line(), duration))
+    if not job.stop_on_failure or job.status != 'failure':
+      return []
+    # the job has failed
+    # stop this and all dependent jobs from execution
+    dependent_jobs = job.get_jobs_waiting_for_us()
+    dependent_job_ids = set([dep.unique for dep in dependent_jobs] + [job.unique])
+    while len(dependent_jobs):
+      dep = dependent_jobs.pop(0)
+      new = dep.get_jobs_waiting_for_us()
+      dependent_jobs += new
+      dependent_job_ids.update([dep.unique for dep in new])
+    return sorted(dependent_job_ids)
+
+
+  def list(self, job_ids, print_array_jobs = False, print_dependencies = False, long = False, print_times = False, status=Status, names=None, ids_only=False, print_resources = False, print_attempts = False, print_eta = False):
+    """Lists the jobs currently added to the database.
+    With ``print_resources``, the resource usage of each job is printed, followed by a summary of the usage of the (array) jobs for each job name.
+    With ``print_attempts``, the attempts of the (array) jobs of jobs with a retry policy are printed.
+    With ``print_eta``, the remaining runtime of the executing jobs is printed, which is predicted from the runtime history (see :py:meth:`_remaining_time`)."""
     # configuration for jobs
-    fields = ("job-id", "grid-id", "queue", "status", "job-name")
-    lengths = (6, 17, 11, 12, 16)
+    fields = ("job-id", "grid-id", "queue", "status", "done", "job-name")
+    lengths = (6, 17, 11, 12, 11, 16)
     dependency_length = 0
 
     if print_dependencies:
@@ -255,33 +472,109 @@ class JobManager:
       print('  '.join(header))
       print(delimiter)
 
-    self.lock()
-    for job in self.get_jobs(job_ids):
-      job.refresh()
-      if job.status in status and (names is None or job.name in names):
-        if ids_only:
-          print(job.unique, end=" ")
-        else:
-          print(job.format(format, dependency_length))
-        if print_times:
-          print(times(job))
-
-        if (not ids_only) and print_array_jobs and job.array:
-          print(array_delimiter)
-          for array_job in job.array:
-            if array_job.status in status:
-              print(array_job.format(array_format))
-              if print_times:
-                print(times(array_job))
-          print(array_delimiter)
+    if self._server is not None and not (print_array_jobs or print_dependencies or long or print_times or print_resources or print_attempts or print_eta):
+      # the state server knows about the status of all jobs
+      try:
+        for job in self._state_client().request('list', job_ids = None if job_ids is None else IdSet.from_ids(job_ids).intervals, status = status, names = names):
+          if ids_only:
+            print(job['unique'], end=" ")
+          else:
+            print(format.format(*job['fields']))
+        return
+      except socket.error as e:
+        logger.warning("Could not connect to the state server '%s' (%s); accessing the database directly", self._server, e)
+
+    self.lock(write=False)
+    # the jobs are streamed from the database, so that large databases are not read into memory
+    print_array_jobs = print_array_jobs and not ids_only
+    print_resources = print_resources and not ids_only
+    print_attempts = print_attempts and not ids_only
+    print_eta = print_eta and not ids_only and self._history is not None
+    # the resource usages of the (array) jobs for each job name, and the number of (array) jobs of each name
+    usages, counts = {}, {}
+    for job in job_rows(self.session, job_ids, status, names, array_jobs = print_array_jobs or print_resources or print_eta, dependencies = print_dependencies and not ids_only):
+      if ids_only:
+        print(job.unique, end=" ")
+      else:
+        print(job.format(format, dependency_length))
+      if print_times:
+        print(times(job))
+      if print_eta and job.status == 'executing':
+        print(self._remaining_time(job))
+      if print_resources:
+        print(resources(job))
+        tasks = [array_job.get_usage() for array_job in job.get_array_jobs()] if job.get_array() else [job.get_usage()]
+        usages.setdefault(job.name, []).extend(usage for usage in tasks if usage is not None)
+        # successful array jobs of compact array jobs and unfinished (array) jobs have no usage
+        counts[job.name] = counts.get(job.name, 0) + (job.array_size() or 1)
+      if print_attempts and job.max_attempts:
+        for attempt in self.session.query(Attempt).filter(Attempt.job_id == job.unique).order_by(Attempt.array_id, Attempt.number):
+          print(attempt)
+
+      if print_array_jobs and job.get_array():
+        print(array_delimiter)
+        for array_job in job.get_array_jobs(status):
+          print(array_job.format(array_format))
+          if print_times:
+            print(times(array_job))
+          if print_resources:
+            print(resources(array_job))
+        print(array_delimiter)
 
     self.unlock()
 
+    if usages:
+      self._print_usage_summary(usages, counts)
+
+
+  def _remaining_time(self, job):
+    """Returns a line with the remaining runtime of the given executing job, which is predicted from the runtime history.
+    For array jobs, the array jobs that are still queued are expected to be run with as many in parallel as are executing now."""
+    predicted = self.predict_runtime(job)
+    if predicted is None:
+      return "No runtime history for job %d" % job.unique
+    now = datetime.now()
+    if job.get_array():
+      executing = [array_job for array_job in job.get_array_jobs() if array_job.status == 'executing']
+      queued = len([array_job for array_job in job.get_array_jobs() if array_job.status in ('queued', 'submitted', 'waiting')])
+      starts = [array_job.start_time for array_job in executing if array_job.start_time is not None]
+    else:
+      queued, starts = 0, [job.start_time] if job.start_time is not None else []
+    remaining = max([predicted - (now - start).total_seconds() for start in starts] or [predicted])
+    remaining += -(-queued // max(len(starts), 1)) * predicted
+    if remaining <= 0:
+      return "Job %d runs longer than its predicted runtime of %s" % (job.unique, format_duration(predicted))
+    return "~%s remaining for job %d" % (format_duration(remaining), job.unique)
+
+
+  def _print_usage_summary(self, usages, counts):
+    """Prints the minimum, the median and the 95th percentile of the resource usage of the (array) jobs for each job name.
+    The ``tasks`` column shows how many of the (array) jobs of the name, given by ``counts``, have a resource usage that the statistics are based on."""
+    names = sorted((name for name in usages if usages[name]), key = str)
+    if not names:
+      return
+    lengths = (16, 13, 17, 12, 12, 12)
+    format = "{:<%d}  {:>%d}  {:<%d}  {:>%d}  {:>%d}  {:>%d}" % lengths
+    print()
+    print(format.format("job-name", "tasks", "resource", "min", "median", "p95"))
+    print(format.format(*['='*k for k in lengths]))
+    labels = {'cpu_time' : "CPU time [s]", 'max_rss' : "max RSS", 'block_io' : "block I/O", 'context_switches' : "context switches"}
+    for name in names:
+      statistics = usage_statistics(usages[name])
+      for index, key in enumerate(USAGE_STATISTICS):
+        values = [format_memory(value) if key == 'max_rss' else "%.2f" % value if key == 'cpu_time' else "%d" % value for value in statistics[key]]
+        print(format.format(str(name)[:lengths[0]] if index == 0 else "", "%d/%d" % (len(usages[name]), counts[name]) if index == 0 else "", labels[key], *values))
+    if any(len(usages[name]) < counts[name] for name in names):
+      print("Only the (array) jobs with a recorded usage are counted; unfinished jobs and successful array jobs of compact array jobs have none.")
+
 
   def report(self, job_ids=None, array_ids=None, output=True, error=True, status=Status, name=None):
     """Iterates through the output and error files and write the results to command line."""
-    def _write_contents(job):
+    def _write_contents(job, array_id = None):
       # Writes the contents of the output and error files to command line
+      packed_log = job.get_packed_log()
+      if packed_log is not None:
+        return _write_packed_contents(packed_log, array_id)
       out_file, err_file = job.std_out_file(), job.std_err_file()
       logger.info("Contents of output file: '%s'" % out_file)
       if output and out_file is not None and os.path.exists(out_file) and os.stat(out_file).st_size > 0:
@@ -292,19 +585,32 @@ class JobManager:
         print(open(err_file).read().rstrip())
         print("-"*40)
 
+    def _write_packed_contents(packed_log, array_id):
+      # Writes the logs of the given array job from the packed log to command line
+      out, err = packed_log.read(array_id, 'out'), packed_log.read(array_id, 'err')
+      logger.info("Contents of output log in packed log file: '%s'" % packed_log.filename)
+      if output and out:
+        print(out.decode('utf-8', 'replace').rstrip())
+        print("-"*20)
+      if error and err:
+        logger.info("Contents of error log in packed log file: '%s'" % packed_log.filename)
+        print(err.decode('utf-8', 'replace').rstrip())
+        print("-"*40)
+
     def _write_array_jobs(array_jobs):
       for array_job in array_jobs:
         print("Array Job", str(array_job.id), ("(%s) :"%array_job.machine_name if array_job.machine_name is not None else ":"))
-        _write_contents(array_job)
+        _write_contents(array_job, array_job.id)
 
-    self.lock()
+    self.lock(write=False)
 
     # check if an array job should be reported
     if array_ids:
       if len(job_ids) != 1: logger.error("If array ids are specified exactly one job id must be given.")
-      array_jobs = list(self.session.query(ArrayJob).join(Job).filter(Job.unique.in_(job_ids)).filter(Job.unique == ArrayJob.job_id).filter(ArrayJob.id.in_(array_ids)))
-      if array_jobs: print(array_jobs[0].job)
-      _write_array_jobs(array_jobs)
+      for job in self.get_jobs(job_ids):
+        array_jobs = job.get_array_jobs(array_ids=array_ids)
+        if array_jobs: print(job)
+        _write_array_jobs(array_jobs)
 
     else:
       # iterate over all jobs
@@ -314,9 +620,9 @@ class JobManager:
           continue
         if job.status not in status:
           continue
-        if job.array:
+        if job.get_array():
           print(job)
-          _write_array_jobs(job.array)
+          _write_array_jobs(job.get_array_jobs())
         else:
           print(job)
           _write_contents(job)
@@ -326,6 +632,15 @@ class JobManager:
     self.unlock()
 
   def delete_logs(self, job):
+    packed_log = job.get_packed_log()
+    if packed_log is not None:
+      # the packed log is removed with its job; the logs of array jobs are only marked as deleted
+      if isinstance(job, Job):
+        packed_log.delete()
+        logger.debug("Removed packed log file '%s'" % packed_log.filename)
+      else:
+        packed_log.delete([job.id])
+      return
     out_file, err_file = job.std_out_file(), job.std_err_file()
     if out_file and os.path.exists(out_file):
       os.remove(out_file)
@@ -341,13 +656,21 @@ class JobManager:
         os.rmdir(log_dir)
         logger.info("Removed empty log directory '%s'" % log_dir)
 
+    # the array jobs whose packed logs are deleted, which are marked together for each packed log
+    deleted_packed_logs = {}
+
     def _delete(job, try_to_delete_dir=False):
       # delete the job from the database
-      if delete_logs:
+      if delete_logs and not isinstance(job, Job) and job.get_packed_log() is not None:
+        deleted_packed_logs.setdefault(job.get_packed_log(), []).append(job.id)
+      elif delete_logs:
         self.delete_logs(job)
         if try_to_delete_dir:
           _delete_dir_if_empty(job.log_dir)
-      if delete_jobs:
+      # the elements of compact array jobs that are not stored in the database only have log files
+      if delete_jobs and isinstance(job, ArrayJob):
+        job.job.remove_array_job(job)
+      elif delete_jobs and not isinstance(job, CompactArrayJob):
         self.session.delete(job)
 
 
@@ -356,15 +679,17 @@ class JobManager:
     # check if array ids are specified
     if array_ids:
       if len(job_ids) != 1: logger.error("If array ids are specified exactly one job id must be given.")
-      array_jobs = list(self.session.query(ArrayJob).join(Job).filter(Job.unique.in_(job_ids)).filter(Job.unique == ArrayJob.job_id).filter(ArrayJob.id.in_(array_ids)))
-      if array_jobs:
-        job = array_jobs[0].job
+      for job in self.get_jobs(job_ids):
+        array_jobs = job.get_array_jobs(status, array_ids)
+        if not array_jobs:
+          continue
+        if job.is_compact() and delete_jobs:
+          logger.warning("Only the log files of the array jobs of compact array job '%d' are deleted; the job itself stays in the database." % job.unique)
         for array_job in array_jobs:
-          if array_job.status in status:
-            if delete_jobs:
-              logger.debug("Deleting array job '%d' of job '%d' from the database." % (array_job.id, job.unique))
-            _delete(array_job)
-        if not job.array:
+          if delete_jobs:
+            logger.debug("Deleting array job '%d' of job '%d' from the database." % (array_job.id, job.unique))
+          _delete(array_job)
+        if not job.is_compact() and not job.progress()[1]:
           if job.status in status:
             if delete_jobs:
               logger.info("Deleting job '%d' from the database." % job.unique)
@@ -375,17 +700,20 @@ class JobManager:
       jobs = self.get_jobs(job_ids)
       for job in jobs:
         # delete all array jobs
-        if job.array:
-          for array_job in job.array:
-            if array_job.status in status:
-              if delete_jobs:
-                logger.debug("Deleting array job '%d' of job '%d' from the database." % (array_job.id, job.unique))
-              _delete(array_job)
+        if job.get_array():
+          for array_job in job.get_array_jobs(status):
+            if delete_jobs:
+              logger.debug("Deleting array job '%d' of job '%d' from the database." % (array_job.id, job.unique))
+            _delete(array_job)
         # delete this job
         if job.status in status:
           if delete_jobs:
             logger.info("Deleting job '%d' from the database." % job.unique)
           _delete(job, delete_jobs)
 
+    # packed logs that have been removed completely are not marked any more
+    for packed_log, array_ids in deleted_packed_logs.items():
+      packed_log.delete(array_ids)
+
     self.session.commit()
     self.unlock()
@@ -1,17 +1,25 @@
 import sqlalchemy
-from sqlalchemy import Table, Column, Integer, DateTime, String, Boolean, ForeignKey
+from sqlalchemy import Table, Column, Integer, Float, DateTime, String, Text, Boolean, ForeignKey, Index, LargeBinary
+import sqlalchemy.orm
 from sqlalchemy.orm import backref
 from sqlalchemy.ext.declarative import declarative_base
-from .tools import Enum, relationship
+from .tools import Enum, relationship, memory_in_bytes, format_memory, USAGE_FIELDS
+from .logstore import PackedLog
 
 import os
+import re
+import bisect
+import math
+import itertools
 import sys
-from datetime import datetime
+import json
+from datetime import datetime, timedelta
 
+# pickle is only required to convert databases written by older versions of gridtk
 if sys.version_info[0] >= 3:
-  from pickle import dumps, loads
+  from pickle import loads
 else:
-  from cPickle import dumps, loads
+  from cPickle import loads
 
 from .tools import logger
 
@@ -29,6 +37,18 @@ class ArrayJob(Base):
   status = Column(Enum(*Status))
   result = Column(Integer)
   machine_name = Column(String(10))
+  claimed_by = Column(String(255))
+  # The process that runs the array job, see Job.set_process
+  pid = Column(Integer)
+  pid_start = Column(Integer)
+
+  # The resource usage of the array job, see gridtk.tools.wait_process
+  user_time = Column(Float)
+  system_time = Column(Float)
+  max_rss = Column(Integer)
+  block_input = Column(Integer)
+  block_output = Column(Integer)
+  context_switches = Column(Integer)
 
   submit_time = Column(DateTime)
   start_time = Column(DateTime)
@@ -36,12 +56,17 @@ class ArrayJob(Base):
 
   job = relationship("Job", backref='array', order_by=id)
 
+  # array jobs are always looked up by the job they belong to and their array id
+  __table_args__ = (Index('ix_ArrayJob_job_id_id', 'job_id', 'id'),)
+
   def __init__(self, id, job_id):
     self.id = id
     self.job_id = job_id
     self.status = Status[0]
     self.result = None
     self.machine_name = None # will be set later, by the Job class
+    self.claimed_by = None
+    self.pid = self.pid_start = None
 
     self.submit_time = datetime.now()
     self.start_time = None
@@ -54,6 +79,18 @@ class ArrayJob(Base):
   def std_err_file(self):
     return self.job.std_err_file() + "." + str(self.id) if self.job.log_dir else None
 
+  def get_packed_log(self):
+    return self.job.get_packed_log()
+
+  def set_usage(self, usage):
+    """Sets the resource usage, which is a dictionary with the fields of :py:data:`gridtk.tools.USAGE_FIELDS`, or None."""
+    for field in USAGE_FIELDS:
+      setattr(self, field, usage[field] if usage is not None else None)
+
+  def get_usage(self):
+    """Returns the resource usage as a dictionary, or None if it is not known."""
+    return dict((field, getattr(self, field)) for field in USAGE_FIELDS) if self.user_time is not None else None
+
   def __str__(self):
     n = "<ArrayJob %d> of <Job %d>" % (self.id, self.job.id)
     if self.result is not None: r = "%s (%d)" % (self.status, self.result)
@@ -70,41 +107,277 @@ class ArrayJob(Base):
     return format.format("", job_id, queue, status)
 
 
+class IdSet(object):
+  """A set of (job or array) ids, which is stored as a sorted list of disjoint closed intervals ``(first, last)``.
+  Large ranges of ids, e.g., ``jman list -j 1-100000``, are never expanded into lists."""
+  def __init__(self, intervals = ()):
+    merged = []
+    for first, last in sorted((int(first), int(last)) for first, last in intervals if first <= last):
+      if merged and first <= merged[-1][1] + 1:
+        merged[-1][1] = max(merged[-1][1], last)
+      else:
+        merged.append([first, last])
+    self.intervals = [tuple(interval) for interval in merged]
+    self._firsts = [first for first, _ in self.intervals]
+
+  @classmethod
+  def from_ids(cls, ids):
+    """Returns the IdSet of the given ids, which might already be an IdSet."""
+    return ids if isinstance(ids, IdSet) else cls((id, id) for id in ids)
+
+  def __contains__(self, id):
+    index = bisect.bisect_right(self._firsts, id) - 1
+    return index >= 0 and id <= self.intervals[index][1]
+
+  def __iter__(self):
+    for first, last in self.intervals:
+      for id in range(first, last + 1):
+        yield id
+
+  def __len__(self):
+    return sum(last - first + 1 for first, last in self.intervals)
+
+  def __bool__(self):
+    return bool(self.intervals)
+  __nonzero__ = __bool__
+
+  def __repr__(self):
+    return "IdSet(%r)" % self.intervals
+
+  def filter(self, column):
+    """Returns the SQL expression that selects the rows whose value in the given column is one of the ids."""
+    clauses = [column.between(first, last) for first, last in self.intervals if first != last]
+    single = [first for first, last in self.intervals if first == last]
+    if single:
+      clauses.append(column.in_(single))
+    return sqlalchemy.or_(*clauses) if clauses else sqlalchemy.false()
+
+
+class ArrayStates(object):
+  """The run-length encoded statuses of the elements of a compact array job.
+
+  The statuses are stored as a string of runs, where each run is the one-letter code of the status followed by the number of consecutive elements with that status, e.g., ``'S120x4q9876'``.
+  """
+  codes = dict(zip(Status, 'sqwxSF'))
+  statuses = dict((code, status) for status, code in codes.items())
+
+  # array jobs with these statuses differ from the others, and are stored as ArrayJob in the database
+  diverged = ('executing', 'failure')
+
+  def __init__(self, encoded = ""):
+    self.runs = [(self.statuses[run[0]], int(run[1:])) for run in re.findall('[a-zA-Z][0-9]+', encoded)]
+
+  @classmethod
+  def create(cls, size, status):
+    """Creates the states for the given number of elements, which all have the same status."""
+    states = cls()
+    if size:
+      states.runs = [(status, size)]
+    return states
+
+  def encode(self):
+    return "".join("%s%d" % (self.codes[status], count) for status, count in self.runs)
+
+  def __len__(self):
+    return sum(count for _, count in self.runs)
+
+  def __iter__(self):
+    for status, count in self.runs:
+      for _ in range(count):
+        yield status
+
+  def count(self, status):
+    """Returns the number of elements with the given status."""
+    return sum(count for s, count in self.runs if s == status)
+
+  def get(self, index):
+    """Returns the status of the element with the given index."""
+    for status, count in self.runs:
+      if index < count:
+        return status
+      index -= count
+    raise IndexError("Index %d out of range" % index)
+
+  def indexes(self, status, limit = None):
+    """Returns the indexes of all elements (or of the first ``limit`` elements) with the given status."""
+    indexes, start = [], 0
+    for s, count in self.runs:
+      if s == status:
+        indexes.extend(range(start, start + (count if limit is None else min(count, limit - len(indexes)))))
+        if limit is not None and len(indexes) >= limit:
+          break
+      start += count
+    return indexes
+
+  def set(self, index, status):
+    """Sets the status of the element with the given index."""
+    start = 0
+    for i, (s, count) in enumerate(self.runs):
+      if index < start + count:
+        if s != status:
+          before, after = index - start, start + count - index - 1
+          self.runs[i:i+1] = [run for run in ((s, before), (status, 1), (s, after)) if run[1]]
+          self._merge()
+        return
+      start += count
+    raise IndexError("Index %d out of range" % index)
+
+  def replace(self, old_status, new_status):
+    """Sets the status of all elements that have one of the given old statuses to the new status."""
+    self.runs = [(new_status if s in old_status else s, count) for s, count in self.runs]
+    self._merge()
+
+  def _merge(self):
+    """Merges consecutive runs with the same status."""
+    runs = []
+    for status, count in self.runs:
+      if runs and runs[-1][0] == status:
+        runs[-1] = (status, runs[-1][1] + count)
+      else:
+        runs.append((status, count))
+    self.runs = runs
+
+
+class CompactArrayJob(object):
+  """A view on an element of a compact array job that is not stored as :py:class:`ArrayJob` in the database.
+  It provides the same read-only interface as the :py:class:`ArrayJob`."""
+  def __init__(self, job, id, status):
+    self.job = job
+    self.id = id
+    self.job_id = job.unique
+    self.status = status
+    # successful array jobs are not stored, failed array jobs without a result have never been executed
+    self.result = 0 if status == 'success' else None
+    self.machine_name = None
+    self.submit_time = job.submit_time
+    self.start_time = None
+    self.finish_time = None
+
+  def get_usage(self):
+    # the resource usage is only stored for array jobs in the database
+    return None
+
+  std_out_file = ArrayJob.std_out_file
+  std_err_file = ArrayJob.std_err_file
+  get_packed_log = ArrayJob.get_packed_log
+  __str__ = ArrayJob.__str__
+  format = ArrayJob.format
+
+
+class ArrayJobRow(object):
+  """A read-only view on a row of the :py:class:`ArrayJob` table of the given :py:class:`JobRow`, see :py:func:`job_rows`."""
+  def __init__(self, job, **columns):
+    self.__dict__.update(columns)
+    self.job = job
+
+  std_out_file = ArrayJob.std_out_file
+  std_err_file = ArrayJob.std_err_file
+  get_packed_log = ArrayJob.get_packed_log
+  get_usage = ArrayJob.get_usage
+  __str__ = ArrayJob.__str__
+  format = ArrayJob.format
+
+
 class Job(Base):
   """This class defines one Job that was submitted to the Job Manager."""
   __tablename__ = 'Job'
 
   unique = Column(Integer, primary_key = True) # The unique ID of the job (not corresponding to the grid ID)
-  command_line = Column(String(255))           # The command line to execute, converted to one string
+  command_line = Column(Text)                  # The command line to execute, JSON-encoded list of strings
   name = Column(String(20))                    # A hand-chosen name for the task
   queue_name = Column(String(20))              # The name of the queue
   machine_name = Column(String(10))            # The name of the machine in which the job is run
-  grid_arguments = Column(String(255))         # The kwargs arguments for the job submission (e.g. in the grid)
-  id = Column(Integer)                         # The ID of the job as given from the grid
+  claimed_by = Column(String(255))             # The local scheduler (host:pid) that has claimed the job for execution
+  pid = Column(Integer)                        # The id of the local process that runs the job (or its first array jobs)
+  pid_start = Column(Integer)                  # The start time of this process, see gridtk.tools.process_start_time
+  id = Column(Integer, index = True)           # The ID of the job as given from the grid
   exec_dir = Column(String(255))               # The directory in which the command should be executed
   log_dir = Column(String(255))                # The directory where the log files will be put to
-  array_string = Column(String(255))           # The array string (only needed for re-submission)
+  packed_logs = Column(Boolean)                # An indicator whether the logs of all (array) jobs are packed into one file, see gridtk.logstore
   stop_on_failure = Column(Boolean)            # An indicator whether to stop depending jobs when this job finishes with an error
+  array_dependency = Column(Boolean)           # An indicator whether each array job only waits for the array jobs with the same id of the jobs that we wait for
+
+  # The arguments for the job submission (e.g. in the grid)
+  memfree = Column(String(20))                 # The free memory required on the machine (mem_free)
+  hvmem = Column(String(20))                   # The maximum virtual memory of the job (h_vmem)
+  gpumem = Column(String(20))                  # The GPU memory required by the job (gpumem)
+  pe_opt = Column(String(30))                  # The parallel environment (e.g. "pe_mth 4")
+  io_big = Column(Boolean)                     # An indicator whether the job requires the io_big flag
+  environment = Column(Text)                   # JSON-encoded list of KEY=VALUE environment variables for the job
+  sge_extra_args = Column(String(255))         # Extra arguments passed to qsub
+  priority = Column(Integer)                   # The priority of the job; jobs with higher priority are started first
+  walltime = Column(Integer)                   # The number of seconds that the job (or each of its array jobs) may run, None for no limit
+
+  # The array parameters (only needed for re-submission)
+  array_start = Column(Integer)
+  array_stop = Column(Integer)
+  array_step = Column(Integer)
+  array_status = Column(Text)                  # The encoded ArrayStates of compact array jobs, None otherwise
+  tasks_per_worker = Column(Integer)           # The number of array jobs that one worker process runs one after the other, None for one
+
+  # The retry policy of failed (array) jobs
+  max_attempts = Column(Integer)               # The number of times that a failing (array) job is run at most, None for once
+  retry_delay = Column(Float)                  # The number of seconds to wait before the first retry, which doubles with every further retry
+  retry_results = Column(Text)                 # JSON-encoded list of the results that are retried, None for all non-zero results
+
+  # Python calls (only for jobs submitted with JobManagerLocal.submit_callable)
+  call = Column(LargeBinary)                   # The pickled function and its arguments
+  return_value = Column(LargeBinary)           # The pickled return value of the function
+  error = Column(Text)                         # The traceback of the exception that the function raised
+
+  # The number of array jobs in each status, which are updated with every status change of an array job (None for non-array jobs)
+  array_submitted = Column(Integer)
+  array_queued = Column(Integer)
+  array_waiting = Column(Integer)
+  array_executing = Column(Integer)
+  array_success = Column(Integer)
+  array_failure = Column(Integer)
+  array_result = Column(Integer)               # The first non-zero result of an array job
+
+  # The resource usage of the job as reported by the kernel (summed over all array jobs, except for the maximum of max_rss), see gridtk.tools.wait_process
+  user_time = Column(Float)                    # The CPU time in user mode, in seconds
+  system_time = Column(Float)                  # The CPU time in system mode, in seconds
+  max_rss = Column(Integer)                    # The maximum resident set size, in bytes
+  block_input = Column(Integer)                # The number of block input operations
+  block_output = Column(Integer)               # The number of block output operations
+  context_switches = Column(Integer)           # The number of voluntary and involuntary context switches
 
   submit_time = Column(DateTime)
   start_time = Column(DateTime)
   finish_time = Column(DateTime)
 
 
-  status = Column(Enum(*Status))
+  status = Column(Enum(*Status), index = True)
   result = Column(Integer)
-
-  def __init__(self, command_line, name = None, exec_dir = None, log_dir = None, array_string = None, queue_name = 'local', machine_name = None, stop_on_failure = False, **kwargs):
-    """Constructs a Job object without an ID (needs to be set later)."""
-    self.command_line = dumps(command_line)
+  changed = Column(Integer, index = True)      # The value of the ChangeCounter when the job was added or changed its status (set by database triggers)
+
+  def __init__(self, command_line, name = None, exec_dir = None, log_dir = None, array = None, queue_name = 'local', machine_name = None, stop_on_failure = False, compact_array = False, tasks_per_worker = None, call = None, packed_logs = False, max_attempts = None, retry_delay = None, retry_results = None, array_dependency = False, **kwargs):
+    """Constructs a Job object without an ID (needs to be set later).
+    The kwargs are the arguments for the grid, see :py:meth:`set_arguments`.
+    For compact array jobs, the status of the array jobs is stored in :py:class:`ArrayStates` instead of one :py:class:`ArrayJob` per element.
+    For array jobs, ``tasks_per_worker`` consecutive array jobs are run one after the other by the same wrapper process.
+    Jobs with a pickled Python ``call`` are run by the worker pool of the local scheduler instead of their command line.
+    With ``packed_logs``, the logs of all (array) jobs are stored in one :py:class:`gridtk.logstore.PackedLog` instead of two files per (array) job.
+    (Array) jobs that fail are run up to ``max_attempts`` times, ``retry_delay`` seconds after the first failure, twice as long after the second, and so on; only the given ``retry_results`` are retried, if given.
+    Each attempt is recorded as :py:class:`Attempt`.
+    With ``array_dependency``, each array job waits only for the array jobs with the same id of the jobs that this job depends on (or for the whole job, if it is not an array job), see :py:meth:`release_array_jobs`."""
+    self.set_command_line(command_line)
     self.name = name
     self.queue_name = queue_name   # will be set during the queue command later
     self.machine_name = machine_name   # will be set during the execute command later
-    self.grid_arguments = dumps(kwargs)
+    self.set_arguments(**kwargs)
     self.exec_dir = exec_dir
     self.log_dir = log_dir
+    self.packed_logs = packed_logs
     self.stop_on_failure = stop_on_failure
-    self.array_string = dumps(array_string)
+    self.array_dependency = bool(array_dependency and array)
+    (self.array_start, self.array_stop, self.array_step) = array if array else (None, None, None)
+    self.array_status = "" if compact_array and array else None   # will be filled during the submit command
+    self.tasks_per_worker = tasks_per_worker if array and tasks_per_worker and tasks_per_worker > 1 else None
+    self.call = call
+    self.max_attempts = max_attempts if max_attempts and max_attempts > 1 else None
+    self.retry_delay = retry_delay
+    self.retry_results = json.dumps(sorted(retry_results)) if retry_results is not None else None
     self.submit()
 
 
@@ -113,12 +386,33 @@ class Job(Base):
     self.status = 'submitted'
     self.result = None
     self.machine_name = None
+    self.claimed_by = None
+    self.pid = self.pid_start = None
+    self.return_value = None
+    self.error = None
+    self.set_usage(None)
+    session = sqlalchemy.orm.object_session(self)
+    if session is not None and sqlalchemy.inspect(self).persistent:
+      # the attempts are counted anew
+      session.query(Attempt).filter(Attempt.job_id == self.unique).delete(synchronize_session = False)
     if new_queue is not None:
       self.queue_name = new_queue
+    if self.is_compact():
+      # none of the array jobs is different from the others any more
+      for array_job in list(self.array):
+        self._remove_array_job(array_job)
+      self.array_status = ArrayStates.create(self.array_size(), 'submitted').encode()
+    if self.get_array() is not None:
+      for status in Status:
+        setattr(self, 'array_' + status, self.array_size() if status == 'submitted' else 0)
+      self.array_result = None
     for array_job in self.array:
       array_job.status = 'submitted'
       array_job.result = None
       array_job.machine_name = None
+      array_job.claimed_by = None
+      array_job.pid = array_job.pid_start = None
+      array_job.set_usage(None)
     self.submit_time = datetime.now()
     self.start_time = None
     self.finish_time = None
@@ -138,8 +432,9 @@ class Job(Base):
 
     new_status = 'queued'
     self.result = None
+    element_wise = self.array_dependency and self.get_array() is not None
     # check if we have to wait for another job to finish
-    for job in self.get_jobs_we_wait_for():
+    for job in self.get_jobs_we_wait_for() if not element_wise else []:
       if job.status not in ('success', 'failure'):
         new_status = 'waiting'
       elif self.stop_on_failure and job.status == 'failure':
@@ -150,22 +445,62 @@ class Job(Base):
       if job.status == 'queued':
         job.status = 'failure' if new_status == 'failure' else 'waiting'
 
-    self.status = new_status
-    for array_job in self.array:
-      if array_job.status not in ('success', 'failure'):
-        array_job.status = new_status
+    if element_wise:
+      # the array jobs are queued one by one, when the array jobs that they wait for have finished
+      self.change_array_status(('submitted', 'queued', 'waiting', 'executing'), 'waiting')
+      self.status = 'waiting'
+      self.release_array_jobs(dependencies = [(job, dict((array_job.id, array_job.status) for array_job in job.get_array_jobs()) if job.get_array() else None) for job in self.get_jobs_we_wait_for()])
+    else:
+      self.status = new_status
+      self.change_array_status(('submitted', 'queued', 'waiting', 'executing'), new_status)
+
+
+  def release_array_jobs(self, array_ids = None, dependencies = None):
+    """Queues the waiting array jobs (only the ones with the given ids, if given) of this job with element-wise array dependencies, when the array jobs with the same ids of all jobs that we wait for have finished.
+    If this job stops on failure, array jobs whose dependencies have failed fail, too.
+    The ``dependencies`` might contain the jobs that we wait for, each with a dictionary of the statuses of its array jobs, or None to look them up."""
+    waiting = self.get_array_ids(('waiting',), array_ids = array_ids)
+    if not waiting:
+      return
+    if dependencies is None:
+      dependencies = [(job, None) for job in self.get_jobs_we_wait_for()]
+    for array_id in waiting:
+      new_status = 'queued'
+      for job, statuses in dependencies:
+        if job.get_array():
+          # jobs without an array job with the same id are waited for completely
+          if statuses is not None:
+            status = statuses.get(array_id, job.status)
+          else:
+            array_job = job.get_array_job(array_id)
+            status = array_job.status if array_job is not None else job.status
+        else:
+          status = job.status
+        if status not in ('success', 'failure'):
+          new_status = 'waiting'
+          break
+        if self.stop_on_failure and status == 'failure':
+          new_status = 'failure'
+      if new_status != 'waiting':
+        self.set_array_job_status(array_id, new_status)
+    if self.status == 'waiting' and self.array_queued:
+      self.status = 'queued'
+    elif self.status in ('waiting', 'queued', 'executing') and self.array_finished():
+      # the last array jobs failed since their dependencies failed
+      self.status = 'failure'
+      self.result = self._array_result()
+      self.finish_time = datetime.now()
 
 
   def execute(self, array_id = None, machine_name = None):
     """Sets the status of this job to 'executing'."""
     self.status = 'executing'
     if array_id is not None:
-      for array_job in self.array:
-        if array_job.id == array_id:
-          array_job.status = 'executing'
-          if machine_name is not None:
-            array_job.machine_name = machine_name
-            array_job.start_time = datetime.now()
+      array_job = self.set_array_job_status(array_id, 'executing')
+      if array_job is not None:
+        if machine_name is not None:
+          array_job.machine_name = machine_name
+          array_job.start_time = datetime.now()
     elif machine_name is not None:
       self.machine_name = machine_name
     if self.start_time is None:
@@ -174,62 +509,357 @@ class Job(Base):
     # sometimes, the 'finish' command did not work for array jobs,
     # so check if any old job still has the 'executing' flag set
     for job in self.get_jobs_we_wait_for():
-      if job.array and job.status == 'executing':
+      if job.get_array() is not None and job.status == 'executing':
         job.finish(0, -1)
 
 
-  def finish(self, result, array_id = None):
-    """Sets the status of this job to 'success' or 'failure'."""
+  def claim(self, array_id = None, claimed_by = None):
+    """Sets the status of this (array) job to 'executing', but only if it is still 'queued', and records who claimed it (e.g. ``'host:pid'`` of a local scheduler).
+    The status is checked and set by a conditional UPDATE in the database, so that of several processes that try to claim the same (array) job, only one succeeds.
+    Returns True if the job has been claimed."""
+    session = sqlalchemy.orm.object_session(self)
+    session.flush()
+    if array_id is None:
+      table = Job.__table__
+      claimed = session.execute(table.update().where(table.c.unique == self.unique).where(table.c.status == 'queued').values(status = 'executing', claimed_by = claimed_by, start_time = datetime.now())).rowcount == 1
+      session.refresh(self)
+      return claimed
+
+    if self.is_compact():
+      # queued array jobs of compact array jobs are not stored in the database; their states are re-read after obtaining the write lock
+      index = self._array_index(array_id)
+      if index is None or self._array_states().get(index) != 'queued':
+        return False
+      array_job = self.set_array_job_status(array_id, 'executing')
+    else:
+      table = ArrayJob.__table__
+      if session.execute(table.update().where(table.c.job_id == self.unique).where(table.c.id == array_id).where(table.c.status == 'queued').values(status = 'executing')).rowcount != 1:
+        session.refresh(self)
+        return False
+      array_job = session.query(ArrayJob).populate_existing().filter(ArrayJob.job_id == self.unique).filter(ArrayJob.id == array_id).one()
+      self._count_array_jobs(('queued',), 'executing', 1)
+    array_job.claimed_by = claimed_by
+    self.status = 'executing'
+    if self.start_time is None:
+      self.start_time = datetime.now()
+    return True
+
+
+  def finish(self, result, array_id = None, usage = None, start_time = None, finish_time = None):
+    """Sets the status of this job to 'success' or 'failure'.
+    The resource ``usage`` of the (array) job is a dictionary with the fields of :py:data:`gridtk.tools.USAGE_FIELDS`, which is added to the usage of this job.
+    The ``start_time`` and ``finish_time`` of the (array) job, when measured by the process that ran it, replace the times of its 'execute' and 'finish' events, which are shared by all tasks of a worker."""
     # check if there is any array job still running
     new_status = 'success' if result == 0 else 'failure'
     new_result = result
     finished = True
+    if finish_time is None:
+      finish_time = datetime.now()
+    if usage is not None:
+      self.add_usage(usage)
+    if start_time is not None:
+      run = self.get_array_job(array_id) if array_id is not None else self
+      if run is not None:
+        run.start_time = start_time
+    if self.max_attempts and (array_id is None or self.get_array_job(array_id) is not None) and self._record_attempt(result, array_id, finish_time):
+      # the (array) job will be run again
+      return
     if array_id is not None:
-      for array_job in self.array:
-        if array_job.id == array_id:
-          array_job.status = new_status
-          array_job.result = result
-          array_job.finish_time = datetime.now()
-        if array_job.status not in ('success', 'failure'):
-          finished = False
-        elif new_result == 0:
-          new_result = array_job.result
+      array_job = self.set_array_job_status(array_id, new_status, result)
+      if array_job is not None:
+        array_job.result = result
+        array_job.finish_time = finish_time
+        if usage is not None:
+          array_job.set_usage(usage)
+      # the array jobs with the same id of jobs with element-wise array dependencies might be started now
+      for job in self.get_jobs_waiting_for_us():
+        if job.array_dependency and job.status in ('waiting', 'queued', 'executing'):
+          job.release_array_jobs((array_id,))
+      finished = self.array_finished()
+      if new_result == 0:
+        new_result = self._array_result()
 
     if finished:
       # There was no array job, or all array jobs finished
       self.status = 'success' if new_result == 0 else 'failure'
       self.result = new_result
-      self.finish_time = datetime.now()
+      self.finish_time = finish_time
 
       # update all waiting jobs
       for job in self.get_jobs_waiting_for_us():
         if job.status == 'waiting':
           job.queue()
-
+        elif job.array_dependency and job.status in ('queued', 'executing'):
+          # array jobs that also wait for this job as a whole
+          job.release_array_jobs()
+
+
+  def _record_attempt(self, result, array_id = None, finish_time = None):
+    """Records the attempt of the (array) job, which has finished with the given result (at the given time), and returns True if the (array) job is queued again according to the retry policy."""
+    session = sqlalchemy.orm.object_session(self)
+    number = session.query(Attempt).filter(Attempt.job_id == self.unique, Attempt.array_id == array_id).count() + 1
+    retry = result != 0 and number < self.max_attempts and (self.retry_results is None or result in json.loads(self.retry_results))
+    run = self.get_array_job(array_id) if array_id is not None else self
+    retry_after = datetime.now() + timedelta(seconds = (self.retry_delay or 0) * 2 ** (number - 1)) if retry else None
+    session.add(Attempt(self.unique, array_id, number, result, run.machine_name, run.start_time, retry_after, finish_time))
+    if retry:
+      logger.info("Attempt %d of job '%d'%s failed with result %d; retrying after %s", number, self.unique, " (%d)" % array_id if array_id is not None else "", result, retry_after.ctime())
+      self.requeue(array_id)
+    return retry
+
+  def requeue(self, array_id = None):
+    """Sets the status of the given executing (array) job back to 'queued', so that it is run again; the other array jobs are not changed."""
+    if array_id is not None:
+      self.set_array_job_status(array_id, 'queued')
+    else:
+      self.status = 'queued'
+      self.start_time = None
+
+  def set_process(self, array_id, pid, pid_start = None):
+    """Records the id and the start time (see :py:func:`gridtk.tools.process_start_time`) of the local process that runs the given (array) job, so that a restarted scheduler can adopt the process."""
+    # executing array jobs of compact array jobs are stored in the database, too
+    run = self._array_job_row(array_id, create = False) if array_id is not None else self
+    if run is not None:
+      run.pid, run.pid_start = pid, pid_start
+
+  def get_retry_times(self):
+    """Returns a dictionary of the queued (array) jobs that wait for their retry, with the time when they may be started; the key is None for jobs that are not array jobs."""
+    if not self.max_attempts:
+      return {}
+    now = datetime.now()
+    retry_times = {}
+    for array_id, retry_after in sqlalchemy.orm.object_session(self).query(Attempt.array_id, Attempt.retry_after).filter(Attempt.job_id == self.unique, Attempt.retry_after > now):
+      retry_times[array_id] = max(retry_after, retry_times.get(array_id, retry_after))
+    if not self.get_array():
+      return dict((array_id, retry_after) for array_id, retry_after in retry_times.items() if array_id is None and self.status == 'queued')
+    if not retry_times:
+      return {}
+    # only the array jobs that wait for their retry are read
+    queued = set(array_job.id for array_job in self.get_array_jobs(('queued',), array_ids = [array_id for array_id in retry_times if array_id is not None]))
+    return dict((array_id, retry_after) for array_id, retry_after in retry_times.items() if array_id in queued)
 
   def refresh(self):
     """Refreshes the status information."""
-    if self.status == 'executing' and self.array:
-      new_result = 0
-      for array_job in self.array:
-        if array_job.status == 'failure' and new_result is not None:
-          new_result = array_job.result
-        elif array_job.status not in ('success', 'failure'):
-          new_result = None
-      if new_result is not None:
-        self.status = 'success' if new_result == 0 else 'failure'
-        self.result = new_result
+    if self.status == 'executing' and self.get_array() is not None and self.array_finished():
+      new_result = self._array_result()
+      self.status = 'success' if new_result == 0 else 'failure'
+      self.result = new_result
+
+
+  def array_size(self):
+    """Returns the number of array jobs of this job, or 0 if this is not an array job."""
+    return len(range(self.array_start, self.array_stop+1, self.array_step)) if self.get_array() is not None else 0
+
+  def array_finished(self):
+    """Returns True if all array jobs of this job have finished, using the counters of array jobs."""
+    return not any(getattr(self, 'array_' + status) for status in ('submitted', 'queued', 'waiting', 'executing'))
+
+  def progress(self):
+    """Returns the number of finished array jobs and the number of all array jobs, or None if this is not an array job."""
+    if self.get_array() is None or self.array_success is None:
+      return None
+    return (self.array_success + self.array_failure, sum(getattr(self, 'array_' + status) for status in Status))
+
+  def is_compact(self):
+    """Returns True if this is a compact array job, for which only the array jobs that differ from the others are stored as :py:class:`ArrayJob`."""
+    return self.array_status is not None
+
+  def get_array_ids(self, status = None, limit = None, array_ids = None):
+    """Returns the ids of the array jobs of this job, optionally only the ones that have one of the given statuses or ids.
+    With a ``limit``, only the lowest ``limit`` ids are returned, which are read from the database without loading all array jobs."""
+    if self.is_compact():
+      states = self._array_states()
+      if array_ids is not None:
+        # only the states of the requested array jobs are looked up
+        indexes = sorted(set(index for index in (self._array_index(array_id) for array_id in array_ids) if index is not None and (status is None or states.get(index) in status)))
+      else:
+        indexes = range(len(states)) if status is None else sorted(i for s in status for i in states.indexes(s, limit))
+      return [self.array_start + i * self.array_step for i in indexes[:limit]]
+    session = sqlalchemy.orm.object_session(self) if 'array' not in self.__dict__ else None
+    if (limit is not None or array_ids is not None) and session is not None:
+      query = session.query(ArrayJob.id).filter(ArrayJob.job_id == self.unique)
+      if status is not None:
+        query = query.filter(ArrayJob.status.in_(status))
+      if array_ids is not None:
+        query = query.filter(IdSet.from_ids(array_ids).filter(ArrayJob.id))
+      return [array_id for array_id, in query.order_by(ArrayJob.id).limit(limit)]
+    if array_ids is not None:
+      array_ids = IdSet.from_ids(array_ids)
+    return [array_job.id for array_job in self.array if (status is None or array_job.status in status) and (array_ids is None or array_job.id in array_ids)][:limit]
+
+  def get_array_jobs(self, status = None, array_ids = None):
+    """Returns the array jobs of this job, optionally only the ones with the given statuses or ids.
+    For compact array jobs, a :py:class:`CompactArrayJob` is returned for each array job that is not stored in the database."""
+    if not self.is_compact():
+      session = sqlalchemy.orm.object_session(self) if 'array' not in self.__dict__ else None
+      if array_ids is not None and session is not None:
+        # only the requested array jobs are read from the database
+        query = session.query(ArrayJob).filter(ArrayJob.job_id == self.unique).filter(IdSet.from_ids(array_ids).filter(ArrayJob.id))
+        if status is not None:
+          query = query.filter(ArrayJob.status.in_(status))
+        return query.order_by(ArrayJob.id).all()
+      return [array_job for array_job in self.array if (status is None or array_job.status in status) and (array_ids is None or array_job.id in array_ids)]
+    stored = dict((array_job.id, array_job) for array_job in self.array)
+    array_jobs = []
+    for index, array_status in enumerate(self._array_states()):
+      array_id = self.array_start + index * self.array_step
+      if (status is None or array_status in status) and (array_ids is None or array_id in array_ids):
+        array_jobs.append(stored[array_id] if array_id in stored else CompactArrayJob(self, array_id, array_status))
+    return array_jobs
+
+  def get_array_job(self, array_id):
+    """Returns the array job with the given id, or None if there is no such array job."""
+    array_job = self._array_job_row(array_id, create = False)
+    if array_job is None and self._array_index(array_id) is not None:
+      array_job = CompactArrayJob(self, array_id, self._array_states().get(self._array_index(array_id)))
+    return array_job
+
+  def change_array_status(self, old_status, new_status, result = None):
+    """Sets the status (and the result, if given) of all array jobs that have one of the given old statuses."""
+    if self.is_compact():
+      self._array_states().replace(old_status, new_status)
+      self._array_states_changed()
+    for array_job in list(self.array):
+      if array_job.status in old_status:
+        if self.is_compact() and new_status not in ArrayStates.diverged:
+          self._remove_array_job(array_job)
+        else:
+          array_job.status = new_status
+          if result is not None:
+            array_job.result = result
+    if self.get_array() is not None:
+      self._count_array_jobs(old_status, new_status, result = result)
+
+
+  def set_array_job_status(self, array_id, status, result = None):
+    """Sets the status of the array job with the given id; the result is only used to update the first non-zero result of the array jobs.
+    Returns the array job if it is stored in the database, otherwise None."""
+    array_job = self._array_job_row(array_id, create = status in ArrayStates.diverged)
+    if array_job is not None:
+      old_status = array_job.status
+      array_job = self._set_array_job_status(array_job, status)
+    elif self._array_index(array_id) is not None:
+      states = self._array_states()
+      old_status = states.get(self._array_index(array_id))
+      states.set(self._array_index(array_id), status)
+      self._array_states_changed()
+    else:
+      return None
+    self._count_array_jobs((old_status,), status, 1, result)
+    return array_job
+
+  def remove_array_job(self, array_job):
+    """Deletes the given array job from the database, e.g., when it is deleted by the user."""
+    sqlalchemy.orm.object_session(array_job).delete(array_job)
+    self._count_array_jobs((array_job.status,), None, 1)
+
+
+  def _count_array_jobs(self, old_status, new_status, count = None, result = None):
+    """Updates the counters of array jobs when the given number of array jobs (or all array jobs, if count is None) change from one of the old statuses to the new status.
+    The counters are changed in memory and written with the next flush of the session; since writing sessions hold the write lock of the database for their whole transaction (see :py:meth:`gridtk.manager.JobManager.lock`), the updates of concurrent processes do not get lost."""
+    old_status = [status for status in old_status if status != new_status]
+    if count is not None and not old_status:
+      # the array jobs did not change their status
+      return
+    counter = lambda status: getattr(self, 'array_' + status)
+    values = {}
+    if count is None:
+      # all array jobs move to the new status
+      if new_status is not None:
+        values['array_' + new_status] = counter(new_status) + sum(counter(status) for status in old_status)
+      values.update(('array_' + status, 0) for status in old_status)
+    else:
+      if new_status is not None:
+        values['array_' + new_status] = counter(new_status) + count
+      values.update(('array_' + status, counter(status) - count) for status in old_status)
+    if result and new_status == 'failure' and self.array_result is None:
+      values['array_result'] = result
+    for key, value in values.items():
+      setattr(self, key, value)
+
+
+  def _array_states(self):
+    """Returns the states of this compact array job, which are decoded only once for each value of ``array_status`` that is read from the database.
+    Several processes (e.g. the array jobs running in the grid) modify the states concurrently; since writing sessions hold the write lock of the database for their whole transaction (see :py:meth:`gridtk.manager.JobManager.lock`), the states that are read in the transaction are up to date."""
+    cached = self.__dict__.get('_states')
+    # a value that is (re-)read from the database is a new object
+    if cached is None or cached[0] is not self.array_status:
+      cached = self.__dict__['_states'] = [self.array_status, ArrayStates(self.array_status), False]
+    return cached[1]
+
+  def _array_states_changed(self):
+    """Marks the states of this compact array job as changed; they are encoded into ``array_status`` only once, when the session is flushed (see :py:func:`_encode_array_states`)."""
+    cached = self.__dict__['_states']
+    if sqlalchemy.orm.object_session(self) is not None and sqlalchemy.inspect(self).persistent:
+      cached[2] = True
+      sqlalchemy.orm.attributes.flag_modified(self, 'array_status')
+    else:
+      self.array_status = cached[0] = cached[1].encode()
+
+  def _write_array_states(self):
+    """Writes the changed states of this compact array job into ``array_status``."""
+    cached = self.__dict__.get('_states')
+    if cached is not None and cached[2] and cached[0] is self.array_status:
+      self.array_status = cached[0] = cached[1].encode()
+      cached[2] = False
+
+  def _array_index(self, array_id):
+    """Returns the index of the given array id in the states of a compact array job, or None if the id is not part of the array."""
+    if not self.is_compact() or array_id < self.array_start or array_id > self.array_stop or (array_id - self.array_start) % self.array_step:
+      return None
+    return (array_id - self.array_start) // self.array_step
+
+  def _array_job_row(self, array_id, create = True):
+    """Returns the ArrayJob with the given id that is stored in the database.
+    For compact array jobs, a new ArrayJob is created if required."""
+    session = sqlalchemy.orm.object_session(self)
+    if session is not None:
+      array_job = session.query(ArrayJob).filter(ArrayJob.job_id == self.unique).filter(ArrayJob.id == array_id).first()
+    else:
+      array_job = ([a for a in self.array if a.id == array_id] or [None])[0]
+    if array_job is None and create and self._array_index(array_id) is not None:
+      # this array job diverges from the others, so we need to store it
+      array_job = ArrayJob(array_id, self.unique)
+      array_job.status = self._array_states().get(self._array_index(array_id))
+      array_job.submit_time = self.submit_time
+      self.array.append(array_job)
+    return array_job
+
+  def _set_array_job_status(self, array_job, status):
+    """Sets the status of the given array job; compact array jobs only keep the array jobs stored that diverge from the others.
+    Returns the array job, or None if it has been removed from the database."""
+    array_job.status = status
+    index = self._array_index(array_job.id)
+    if index is not None:
+      self._array_states().set(index, status)
+      self._array_states_changed()
+      if status not in ArrayStates.diverged:
+        self._remove_array_job(array_job)
+        return None
+    return array_job
+
+  def _remove_array_job(self, array_job):
+    """Removes the given array job of a compact array job from the database."""
+    self.array.remove(array_job)
+    session = sqlalchemy.orm.object_session(array_job)
+    if session is not None:
+      if sqlalchemy.inspect(array_job).persistent:
+        session.delete(array_job)
+      else:
+        session.expunge(array_job)
+
+  def _array_result(self):
+    """Returns the first non-zero result of the array jobs, or 0 if none failed."""
+    return self.array_result if self.array_failure else 0
 
 
   def get_command_line(self):
     """Returns the command line for the job."""
-    # In python 2, the command line is unicode, which needs to be converted to string before pickling;
-    # In python 3, the command line is bytes, which can be pickled directly
-    return loads(self.command_line) if isinstance(self.command_line, bytes) else loads(self.command_line.encode())
+    return json.loads(self.command_line)
 
   def set_command_line(self, command_line):
     """Sets / overwrites the command line for the job."""
-    self.command_line = dumps(command_line)
+    self.command_line = json.dumps(list(command_line))
 
   def get_exec_dir(self):
     """Returns the command line for the job."""
@@ -240,33 +870,31 @@ class Job(Base):
 
 
   def get_array(self):
-    """Returns the array arguments for the job; usually a string."""
-    # In python 2, the command line is unicode, which needs to be converted to string before pickling;
-    # In python 3, the command line is bytes, which can be pickled directly
-    return loads(self.array_string) if isinstance(self.array_string, bytes) else loads(self.array_string.encode())
+    """Returns the array arguments (start, stop, step) for the job, or None if this is not an array job."""
+    return (self.array_start, self.array_stop, self.array_step) if self.array_start is not None else None
 
 
   def get_arguments(self):
     """Returns the additional options for the grid (such as the queue, memory requirements, ...)."""
-    # In python 2, the command line is unicode, which needs to be converted to string before pickling;
-    # In python 3, the command line is bytes, which can be pickled directly
-    args = loads(self.grid_arguments)['kwargs'] if isinstance(self.grid_arguments, bytes) else loads(self.grid_arguments.encode())['kwargs']
-    # in any case, the commands have to be converted to str
     retval = {}
-    if 'pe_opt' in args:
-      retval['pe_opt'] = args['pe_opt']
-    if 'memfree' in args and args['memfree'] is not None:
-      retval['memfree'] = args['memfree']
-    if 'hvmem' in args and args['hvmem'] is not None:
-      retval['hvmem'] = args['hvmem']
-    if 'gpumem' in args and args['gpumem'] is not None:
-      retval['gpumem'] = args['gpumem']
-    if 'env' in args and len(args['env']) > 0:
-      retval['env'] = args['env']
-    if 'io_big' in args and args['io_big']:
+    if self.pe_opt is not None:
+      retval['pe_opt'] = self.pe_opt
+    if self.memfree is not None:
+      retval['memfree'] = self.memfree
+    if self.hvmem is not None:
+      retval['hvmem'] = self.hvmem
+    if self.gpumem is not None:
+      retval['gpumem'] = self.gpumem
+    if self.environment is not None:
+      retval['env'] = json.loads(self.environment)
+    if self.io_big:
       retval['io_big'] = True
-    if 'sge_extra_args' in args:
-      retval['sge_extra_args'] = args['sge_extra_args']
+    if self.sge_extra_args is not None:
+      retval['sge_extra_args'] = self.sge_extra_args
+    if self.priority:
+      retval['priority'] = self.priority
+    if self.walltime is not None:
+      retval['walltime'] = self.walltime
 
     # also add the queue
     if self.queue_name is not None:
@@ -274,8 +902,30 @@ class Job(Base):
 
     return retval
 
-  def set_arguments(self, **kwargs):
-    self.grid_arguments = dumps(kwargs)
+  def get_resources(self):
+    """Returns the number of cores and the memory in bytes that the job (or each of its array jobs) requires, which are read from the parallel environment (e.g. ``pe_mth 4``) and the free memory; the memory is 0 if it was not specified."""
+    cores = re.search(r'(\d+)\s*$', self.pe_opt) if self.pe_opt else None
+    cores = int(cores.group(1)) if cores else 1
+    if self.memfree:
+      memory = memory_in_bytes(self.memfree)
+    elif self.hvmem:
+      # the virtual memory is given per core
+      memory = memory_in_bytes(self.hvmem) * cores
+    else:
+      memory = 0
+    return cores, memory
+
+  def set_arguments(self, pe_opt = None, memfree = None, hvmem = None, gpumem = None, env = None, io_big = False, sge_extra_args = None, priority = 0, walltime = None, **kwargs):
+    """Sets / overwrites the additional options for the grid; all other kwargs (such as the queue) are ignored."""
+    self.pe_opt = pe_opt
+    self.memfree = memfree
+    self.hvmem = hvmem
+    self.gpumem = gpumem
+    self.environment = json.dumps(list(env)) if env else None
+    self.io_big = bool(io_big)
+    self.sge_extra_args = sge_extra_args
+    self.priority = priority or 0
+    self.walltime = walltime
 
   def get_jobs_we_wait_for(self):
     return [j.waited_for_job for j in self.jobs_we_have_to_wait_for if j.waited_for_job is not None]
@@ -290,6 +940,25 @@ class Job(Base):
   def std_err_file(self, array_id = None):
     return os.path.join(self.log_dir, (self.name if self.name else 'job') + ".e" + str(self.id)) if self.log_dir else None
 
+  set_usage = ArrayJob.set_usage
+  get_usage = ArrayJob.get_usage
+
+  def add_usage(self, usage):
+    """Adds the resource usage of one of the (array) jobs to the usage of this job; the maximum resident set size is the maximum of all."""
+    for field in USAGE_FIELDS:
+      old = getattr(self, field)
+      setattr(self, field, usage[field] if old is None else max(old, usage[field]) if field == 'max_rss' else old + usage[field])
+
+  def get_packed_log(self):
+    """Returns the :py:class:`gridtk.logstore.PackedLog` of this job, or None if its logs are not packed."""
+    if not self.packed_logs or not self.log_dir:
+      return None
+    filename = os.path.join(self.log_dir, (self.name if self.name else 'job') + ".l" + str(self.id))
+    # the index of the packed log is only read once
+    if getattr(self, '_packed_log', None) is None or self._packed_log.filename != filename:
+      self._packed_log = PackedLog(filename)
+    return self._packed_log
+
 
   def _cmdline(self):
     cmdline = self.get_command_line()
@@ -305,7 +974,7 @@ class Job(Base):
     id = "%d (%d)" % (self.unique, self.id)
     if self.machine_name: m = "%s - %s" % (self.queue_name, self.machine_name)
     else: m = self.queue_name
-    if self.array: a = "[%d-%d:%d]" % self.get_array()
+    if self.get_array(): a = "[%d-%d:%d]" % self.get_array()
     else: a = ""
     if self.name is not None: n = "<Job: %s %s - '%s'>" % (id, a, self.name)
     else: n = "<Job: %s>" % id
@@ -313,15 +982,20 @@ class Job(Base):
     else: r = "%s" % self.status
     return "%s | %s : %s -- %s" % (n, m, r, self._cmdline())
 
+  def summary(self):
+    """Returns the information about this job that is shown in the table of ``jman list``, as a JSON-serializable dictionary."""
+    job_id = "%d" % self.id + (" [%d-%d:%d]" % self.get_array() if self.get_array() else "")
+    status = "%s" % self.status + (" (%d)" % self.result if self.result is not None else "" )
+    progress = "%d/%d" % self.progress() if self.progress() is not None else ""
+    queue = self.queue_name if self.machine_name is None else self.machine_name
+    return {'unique' : self.unique, 'status' : self.status, 'name' : self.name, 'fields' : [self.unique, job_id, queue[:12], status, progress, str(self.name)]}
+
   def format(self, format, dependencies = 0, limit_command_line = None):
     """Formats the current job into a nicer string to fit into a table."""
     command_line = self._cmdline()
     if limit_command_line is not None and len(command_line) > limit_command_line:
       command_line = command_line[:limit_command_line-3] + '...'
 
-    job_id = "%d" % self.id + (" [%d-%d:%d]" % self.get_array() if self.array else "")
-    status = "%s" % self.status + (" (%d)" % self.result if self.result is not None else "" )
-    queue = self.queue_name if self.machine_name is None else self.machine_name
     if limit_command_line is None:
       grid_opt = self.get_arguments()
       if grid_opt:
@@ -330,22 +1004,57 @@ class Job(Base):
       if self.exec_dir is not None:
         command_line += "; [Executed in directory: '%s']" % self.exec_dir
 
+    fields = self.summary()['fields']
     if dependencies:
       deps = str(sorted(list(set([dep.unique for dep in self.get_jobs_we_wait_for()]))))
       if dependencies < len(deps):
         deps = deps[:dependencies-3] + '...'
-      return format.format(self.unique, job_id, queue[:12], status, str(self.name), deps, command_line)
+      return format.format(*(fields + [deps, command_line]))
     else:
-      return format.format(self.unique, job_id, queue[:12], status, str(self.name), command_line)
+      return format.format(*(fields + [command_line]))
 
 
+class JobRow(object):
+  """A read-only view on a row of the :py:class:`Job` table, see :py:func:`job_rows`.
+  It provides the methods of :py:class:`Job` that are needed to list jobs, without the overhead of ORM objects."""
+  def __init__(self, **columns):
+    self.__dict__.update(columns)
+    self.array = []
+    self.dependencies = []
+
+  def get_jobs_we_wait_for(self):
+    return [JobRow(unique = unique) for unique in self.dependencies]
+
+  refresh = Job.refresh
+  array_size = Job.array_size
+  array_finished = Job.array_finished
+  progress = Job.progress
+  is_compact = Job.is_compact
+  get_array_ids = Job.get_array_ids
+  get_array_jobs = Job.get_array_jobs
+  _array_states = Job._array_states
+  _array_result = Job._array_result
+  get_command_line = Job.get_command_line
+  get_exec_dir = Job.get_exec_dir
+  get_array = Job.get_array
+  get_arguments = Job.get_arguments
+  get_resources = Job.get_resources
+  std_out_file = Job.std_out_file
+  std_err_file = Job.std_err_file
+  get_packed_log = Job.get_packed_log
+  get_usage = Job.get_usage
+  _cmdline = Job._cmdline
+  __str__ = Job.__str__
+  summary = Job.summary
+  format = Job.format
+
 
 class JobDependence(Base):
   """This table defines a many-to-many relationship between Jobs."""
   __tablename__ = 'JobDependence'
   id = Column(Integer, primary_key=True)
-  waiting_job_id = Column(Integer, ForeignKey('Job.unique')) # The ID of the waiting job
-  waited_for_job_id = Column(Integer, ForeignKey('Job.unique')) # The ID of the job to wait for
+  waiting_job_id = Column(Integer, ForeignKey('Job.unique'), index = True) # The ID of the waiting job
+  waited_for_job_id = Column(Integer, ForeignKey('Job.unique'), index = True) # The ID of the job to wait for
 
   # This is twisted: The 'jobs_we_have_to_wait_for' field in the Job class needs to be joined with the waiting job id, so that jobs_we_have_to_wait_for.waiting_job is correct
   # Honestly, I am lost but it seems to work...
@@ -357,38 +1066,134 @@ class JobDependence(Base):
     self.waited_for_job_id = waited_for_job_id
 
 
+class Attempt(Base):
+  """This table records each run of the (array) jobs of jobs with a retry policy (see :py:class:`Job`), with its result and timing."""
+  __tablename__ = 'Attempt'
 
-def add_job(session, command_line, name = 'job', dependencies = [], array = None, exec_dir=None, log_dir = None, stop_on_failure = False, **kwargs):
-  """Helper function to create a job, add the dependencies and the array jobs."""
-  job = Job(command_line=command_line, name=name, exec_dir=exec_dir, log_dir=log_dir, array_string=array, stop_on_failure=stop_on_failure, kwargs=kwargs)
+  unique = Column(Integer, primary_key = True)
+  job_id = Column(Integer, ForeignKey('Job.unique'))
+  array_id = Column(Integer)                   # The id of the array job, None for jobs that are not array jobs
+  number = Column(Integer)                     # The number of the attempt, starting with 1
+  result = Column(Integer)
+  machine_name = Column(String(10))
+  start_time = Column(DateTime)
+  finish_time = Column(DateTime)
+  retry_after = Column(DateTime)               # The time after which the next attempt may start, None if the (array) job was not retried
 
-  session.add(job)
-  session.flush()
-  session.refresh(job)
+  job = relationship("Job", backref = backref('attempts', cascade = 'all, delete-orphan', order_by = unique))
 
-  # by default id and unique id are identical, but the id might be overwritten later on
-  job.id = job.unique
-
-  for d in dependencies:
-    if d == job.unique:
-      logger.warn("Adding self-dependency of job %d is not allowed" % d)
-      continue
-    depending = list(session.query(Job).filter(Job.unique == d))
-    if len(depending):
-      session.add(JobDependence(job.unique, depending[0].unique))
-    else:
-      logger.warn("Could not find dependent job with id %d in database" % d)
+  __table_args__ = (Index('ix_Attempt_job_id_array_id', 'job_id', 'array_id'),)
 
-  if array:
-    (start, stop, step) = array
-    # add array jobs
-    for i in range(start, stop+1, step):
-      session.add(ArrayJob(i, job.unique))
+  def __init__(self, job_id, array_id, number, result, machine_name = None, start_time = None, retry_after = None, finish_time = None):
+    self.job_id = job_id
+    self.array_id = array_id
+    self.number = number
+    self.result = result
+    self.machine_name = machine_name
+    self.start_time = start_time
+    self.finish_time = finish_time if finish_time is not None else datetime.now()
+    self.retry_after = retry_after
+
+  def __str__(self):
+    array = " (%d)" % self.array_id if self.array_id is not None else ""
+    duration = " after %s" % (self.finish_time - self.start_time) if self.start_time is not None else ""
+    retry = "; retried after %s" % self.retry_after.ctime() if self.retry_after is not None else ""
+    machine = " on %s" % self.machine_name if self.machine_name is not None else ""
+    return "Attempt %d of job %d%s%s: finished %s with result %d%s%s" % (self.number, self.job_id, array, machine, self.finish_time.ctime(), self.result, duration, retry)
+
+
+class SchemaVersion(Base):
+  """This table stores the version of the database schema (in a single row), so that old databases can be upgraded in place."""
+  __tablename__ = 'SchemaVersion'
+  id = Column(Integer, primary_key=True)
+  version = Column(Integer)
+
+
+class ChangeCounter(Base):
+  """This table stores a counter (in a single row) that is incremented by database triggers whenever jobs are added, deleted or change their status.
+  Processes like the local scheduler read it to find out cheaply whether anything has changed."""
+  __tablename__ = 'ChangeCounter'
+  id = Column(Integer, primary_key=True)
+  counter = Column(Integer)
+
+
+
+def _encode_array_states(session, flush_context, instances):
+  """Encodes the changed states of the compact array jobs of the session (see :py:meth:`Job._array_states_changed`) once per flush, instead of once per changed array job."""
+  for job in session.dirty:
+    if isinstance(job, Job):
+      job._write_array_states()
+
+sqlalchemy.event.listen(sqlalchemy.orm.Session, 'before_flush', _encode_array_states)
+
+
+def add_job(session, command_line, name = 'job', dependencies = [], array = None, exec_dir=None, log_dir = None, stop_on_failure = False, **kwargs):
+  """Helper function to create a job, add the dependencies and the array jobs."""
+  job = add_jobs(session, [dict(command_line=command_line, name=name, dependencies=dependencies, array=array, exec_dir=exec_dir, log_dir=log_dir, stop_on_failure=stop_on_failure, **kwargs)])[0]
 
   session.commit()
 
   return job
 
+def add_jobs(session, specs):
+  """Helper function to create many jobs, add their dependencies and their array jobs in a single transaction, which is not committed.
+
+  Each spec is a dictionary with the keyword arguments of :py:func:`add_job`.
+  Additionally, the ``batch_dependencies`` of a spec might contain the indexes of other specs in the list that this job depends on.
+  Returns the list of created jobs, in the order of the specs."""
+  jobs = []
+  for spec in specs:
+    kwargs = dict(spec)
+    kwargs.pop('dependencies', None)
+    kwargs.pop('batch_dependencies', None)
+    jobs.append(Job(**kwargs))
+
+  session.add_all(jobs)
+  session.flush()
+
+  # by default id and unique id are identical, but the id might be overwritten later on
+  for job in jobs:
+    job.id = job.unique
+  session.flush()
+
+  # find all jobs that we depend on with a single query
+  requested = set(d for spec in specs for d in spec.get('dependencies', []))
+  existing = set(unique for (unique,) in session.query(Job.unique).filter(Job.unique.in_(requested))) if requested else set()
+
+  dependencies, array_jobs = [], []
+  submit_time = datetime.now()
+  for index, (spec, job) in enumerate(zip(specs, jobs)):
+    waited_for = []
+    for d in spec.get('dependencies', []):
+      if d == job.unique:
+        logger.warning("Adding self-dependency of job %d is not allowed" % d)
+      elif d not in existing:
+        logger.warning("Could not find dependent job with id %d in database" % d)
+      elif d not in waited_for:
+        waited_for.append(d)
+    for b in spec.get('batch_dependencies', []):
+      if b == index or not 0 <= b < len(jobs):
+        logger.warning("Ignoring invalid dependency of job %d on job number %d of the batch" % (job.unique, b))
+      elif jobs[b].unique not in waited_for:
+        waited_for.append(jobs[b].unique)
+    dependencies.extend({'waiting_job_id' : job.unique, 'waited_for_job_id' : d} for d in waited_for)
+
+    if spec.get('array') and not job.is_compact():
+      (start, stop, step) = spec['array']
+      # add array jobs
+      array_jobs.extend({'id' : i, 'job_id' : job.unique, 'status' : 'submitted', 'submit_time' : submit_time} for i in range(start, stop+1, step))
+
+  # insert dependencies and array jobs with one statement each
+  if dependencies:
+    session.execute(JobDependence.__table__.insert(), dependencies)
+  if array_jobs:
+    session.execute(ArrayJob.__table__.insert(), array_jobs)
+  if dependencies or array_jobs:
+    # the relationships of the jobs need to be reloaded from the database
+    session.expire_all()
+
+  return jobs
+
 def times(job):
   """Returns a string containing timing information for teh given job, which might be a :py:class:`Job` or an :py:class:`ArrayJob`."""
   timing = "Submitted: %s" % job.submit_time.ctime()
@@ -397,3 +1202,329 @@ def times(job):
   if job.finish_time is not None:
     timing += "\nFinished : %s \t Job executed: %s" % (job.finish_time.ctime(), job.finish_time - job.start_time)
   return timing
+
+
+def resources(job):
+  """Returns a string containing the resource usage of the given job, which might be a :py:class:`Job` or an :py:class:`ArrayJob`."""
+  usage = job.get_usage()
+  if usage is None:
+    return "Resources: unknown"
+  return "Resources: CPU time %.2f s (user) + %.2f s (system) \t max RSS %s \t block I/O %d (in) + %d (out) \t context switches %d" % (usage['user_time'], usage['system_time'], format_memory(usage['max_rss']), usage['block_input'], usage['block_output'], usage['context_switches'])
+
+
+# The statistics of the resource usage of tasks, see :py:func:`usage_statistics`
+USAGE_STATISTICS = ('cpu_time', 'max_rss', 'block_io', 'context_switches')
+
+def usage_statistics(usages):
+  """Returns the minimum, the median and the 95th percentile of the CPU time (user and system), the maximum resident set size, the block I/O operations and the context switches of the given resource usages (see :py:meth:`Job.get_usage`), as a dictionary with the keys of :py:data:`USAGE_STATISTICS`."""
+  values = {
+    'cpu_time' : sorted(usage['user_time'] + usage['system_time'] for usage in usages),
+    'max_rss' : sorted(usage['max_rss'] for usage in usages),
+    'block_io' : sorted(usage['block_input'] + usage['block_output'] for usage in usages),
+    'context_switches' : sorted(usage['context_switches'] for usage in usages),
+  }
+  statistics = {}
+  for key, sorted_values in values.items():
+    n = len(sorted_values)
+    median = (sorted_values[(n - 1) // 2] + sorted_values[n // 2]) / 2.
+    # the nearest-rank percentile
+    statistics[key] = (sorted_values[0], median, sorted_values[max(int(math.ceil(0.95 * n)) - 1, 0)])
+  return statistics
+
+
+def critical_path_lengths(session, estimate = None, queue_name = 'local'):
+  """Returns the critical path length of each unfinished job in the given queue, i.e., the length of the longest chain of unfinished jobs that starts with the job and follows the jobs that wait for it (see :py:class:`JobDependence`).
+  The length of a chain is the sum of the estimated runtimes of its jobs, which are returned by the function ``estimate`` for each :py:class:`Job`; by default, each job counts 1.
+  Jobs for which ``estimate`` returns None count as the average of the other estimates.
+  Returns a dictionary with the unique job ids as keys."""
+  jobs = session.query(Job).filter(Job.queue_name == queue_name).filter(Job.status.in_(('submitted', 'queued', 'waiting', 'executing'))).all()
+  weights = dict((job.unique, estimate(job) if estimate is not None else 1.) for job in jobs)
+  known = [weight for weight in weights.values() if weight is not None]
+  default = sum(known) / len(known) if known else 1.
+  weights = dict((unique, default if weight is None else weight) for unique, weight in weights.items())
+  # the jobs that wait for each job
+  waiting = {}
+  for waiting_id, waited_for_id in session.query(JobDependence.waiting_job_id, JobDependence.waited_for_job_id):
+    if waiting_id in weights and waited_for_id in weights:
+      waiting.setdefault(waited_for_id, []).append(waiting_id)
+
+  # the chains are followed depth first, without recursion; dependency cycles are broken
+  lengths, visiting = {}, set()
+  for unique in weights:
+    stack = [(unique, False)]
+    while stack:
+      current, expanded = stack.pop()
+      if current in lengths:
+        continue
+      if expanded:
+        visiting.discard(current)
+        lengths[current] = weights[current] + max([lengths.get(next, 0) for next in waiting.get(current, ())] or [0])
+      elif current not in visiting:
+        visiting.add(current)
+        stack.append((current, True))
+        stack.extend((next, False) for next in waiting.get(current, ()) if next not in lengths and next not in visiting)
+  return lengths
+
+
+def job_rows(session, job_ids = None, status = None, names = None, array_jobs = False, dependencies = False, batch_size = 1000):
+  """Yields a :py:class:`JobRow` for each job with one of the given ids, statuses and names, ordered by the unique id.
+  The filters are applied in SQL, and the rows are streamed in batches of ``batch_size`` jobs.
+  Only when requested, the array jobs and the dependencies of the jobs of each batch are read with one query per batch.
+  The jobs are already refreshed (see :py:meth:`Job.refresh`); the pickled Python calls and their return values are not read."""
+  query = session.query(*[column for column in Job.__table__.columns if column.name not in ('call', 'return_value')])
+  if job_ids is not None:
+    query = query.filter(IdSet.from_ids(job_ids).filter(Job.unique))
+  if names is not None:
+    query = query.filter(Job.name.in_(names))
+  if status is not None and not set(Status) <= set(status):
+    # executing array jobs might have finished, which is only known after refreshing them
+    query = query.filter(sqlalchemy.or_(Job.status.in_(status), sqlalchemy.and_(Job.status == 'executing', Job.array_start != None)))
+  rows = iter(query.order_by(Job.unique).yield_per(batch_size))
+
+  while True:
+    jobs = [JobRow(**row._asdict()) for row in itertools.islice(rows, batch_size)]
+    if not jobs:
+      break
+    uniques = [job.unique for job in jobs]
+    by_unique = dict((job.unique, job) for job in jobs)
+    if array_jobs:
+      for row in session.query(*ArrayJob.__table__.columns).filter(ArrayJob.job_id.in_(uniques)).order_by(ArrayJob.job_id, ArrayJob.id):
+        job = by_unique[row.job_id]
+        job.array.append(ArrayJobRow(job, **row._asdict()))
+    if dependencies:
+      waited_for = sqlalchemy.orm.aliased(Job)
+      for waiting_id, waited_for_id in session.query(JobDependence.waiting_job_id, JobDependence.waited_for_job_id).join(waited_for, waited_for.unique == JobDependence.waited_for_job_id).filter(JobDependence.waiting_job_id.in_(uniques)):
+        by_unique[waiting_id].dependencies.append(waited_for_id)
+
+    for job in jobs:
+      job.refresh()
+      if status is None or job.status in status:
+        yield job
+
+
+def _add_indexes(connection):
+  """Adds the indexes on the columns that are used to look up jobs, array jobs and dependencies."""
+  for statement in (
+      "CREATE INDEX IF NOT EXISTS ix_Job_id ON Job (id)",
+      "CREATE INDEX IF NOT EXISTS ix_Job_status ON Job (status)",
+      "CREATE INDEX IF NOT EXISTS ix_ArrayJob_job_id_id ON ArrayJob (job_id, id)",
+      "CREATE INDEX IF NOT EXISTS ix_JobDependence_waiting_job_id ON JobDependence (waiting_job_id)",
+      "CREATE INDEX IF NOT EXISTS ix_JobDependence_waited_for_job_id ON JobDependence (waited_for_job_id)",
+    ):
+    connection.execute(sqlalchemy.text(statement))
+
+def _unpickle(value):
+  """Decodes a value that was pickled by an older version of gridtk."""
+  # In python 2, the value is unicode, which needs to be converted to string before unpickling;
+  # In python 3, the value is bytes, which can be unpickled directly
+  return loads(value) if isinstance(value, bytes) else loads(value.encode())
+
+def _replace_pickled_columns(connection):
+  """Adds the structured columns that replace the pickled grid arguments and array string, and converts all pickled values."""
+  columns = set(row[1] for row in connection.execute(sqlalchemy.text("PRAGMA table_info(Job)")))
+  for name, type in (("memfree", "VARCHAR(20)"), ("hvmem", "VARCHAR(20)"), ("gpumem", "VARCHAR(20)"), ("pe_opt", "VARCHAR(30)"), ("io_big", "BOOLEAN"), ("environment", "TEXT"), ("sge_extra_args", "VARCHAR(255)"), ("array_start", "INTEGER"), ("array_stop", "INTEGER"), ("array_step", "INTEGER")):
+    if name not in columns:
+      connection.execute(sqlalchemy.text("ALTER TABLE Job ADD COLUMN %s %s" % (name, type)))
+  if 'grid_arguments' not in columns:
+    return
+
+  rows = connection.execute(sqlalchemy.text('SELECT "unique", command_line, grid_arguments, array_string FROM Job WHERE grid_arguments IS NOT NULL')).fetchall()
+  values = []
+  for unique, command_line, grid_arguments, array_string in rows:
+    args = _unpickle(grid_arguments).get('kwargs', {})
+    array = _unpickle(array_string) if array_string is not None else None
+    values.append({
+      'unique' : unique,
+      'command_line' : json.dumps(list(_unpickle(command_line))),
+      'memfree' : args.get('memfree'),
+      'hvmem' : args.get('hvmem'),
+      'gpumem' : args.get('gpumem'),
+      'pe_opt' : args.get('pe_opt'),
+      'io_big' : bool(args.get('io_big')),
+      'environment' : json.dumps(list(args['env'])) if args.get('env') else None,
+      'sge_extra_args' : args.get('sge_extra_args'),
+      'array_start' : array[0] if array else None,
+      'array_stop' : array[1] if array else None,
+      'array_step' : array[2] if array else None,
+    })
+  if values:
+    logger.info("Converting the pickled arguments of %d jobs" % len(values))
+    connection.execute(sqlalchemy.text('UPDATE Job SET command_line = :command_line, memfree = :memfree, hvmem = :hvmem, gpumem = :gpumem, pe_opt = :pe_opt, io_big = :io_big, environment = :environment, sge_extra_args = :sge_extra_args, array_start = :array_start, array_stop = :array_stop, array_step = :array_step, grid_arguments = NULL, array_string = NULL WHERE "unique" = :unique'), values)
+
+def _add_array_status(connection):
+  """Adds the column that stores the states of compact array jobs."""
+  columns = set(row[1] for row in connection.execute(sqlalchemy.text("PRAGMA table_info(Job)")))
+  if 'array_status' not in columns:
+    connection.execute(sqlalchemy.text("ALTER TABLE Job ADD COLUMN array_status TEXT"))
+
+def _add_array_counters(connection):
+  """Adds the counters of array jobs in each status, and computes them for all existing array jobs."""
+  columns = set(row[1] for row in connection.execute(sqlalchemy.text("PRAGMA table_info(Job)")))
+  for name in ['array_' + status for status in Status] + ['array_result']:
+    if name not in columns:
+      connection.execute(sqlalchemy.text("ALTER TABLE Job ADD COLUMN %s INTEGER" % name))
+
+  # array jobs with one ArrayJob per element
+  first_result = 'SELECT result FROM ArrayJob WHERE ArrayJob.job_id = Job."unique" AND ArrayJob.status = \'failure\' AND ArrayJob.result != 0 ORDER BY ArrayJob.id LIMIT 1'
+  counters = ", ".join("array_%s = (SELECT COUNT(*) FROM ArrayJob WHERE ArrayJob.job_id = Job.\"unique\" AND ArrayJob.status = '%s')" % (status, status) for status in Status)
+  connection.execute(sqlalchemy.text('UPDATE Job SET %s, array_result = (%s) WHERE array_start IS NOT NULL AND array_status IS NULL' % (counters, first_result)))
+
+  # compact array jobs
+  values = []
+  for unique, array_status in connection.execute(sqlalchemy.text('SELECT "unique", array_status FROM Job WHERE array_status IS NOT NULL')).fetchall():
+    states = ArrayStates(array_status)
+    values.append(dict([('unique', unique)] + [(status, states.count(status)) for status in Status]))
+  if values:
+    connection.execute(sqlalchemy.text('UPDATE Job SET %s, array_result = (%s) WHERE "unique" = :unique' % (", ".join("array_%s = :%s" % (status, status) for status in Status), first_result)), values)
+
+def _add_change_counter(connection):
+  """Adds the change counter, and the triggers that increment it whenever jobs are added, deleted or change their status."""
+  connection.execute(sqlalchemy.text("CREATE TABLE IF NOT EXISTS ChangeCounter (id INTEGER NOT NULL, counter INTEGER, PRIMARY KEY (id))"))
+  connection.execute(sqlalchemy.text("INSERT OR IGNORE INTO ChangeCounter (id, counter) VALUES (1, 0)"))
+  for name, event in (('insert', 'INSERT'), ('update', 'UPDATE OF status, array_queued'), ('delete', 'DELETE')):
+    condition = " WHEN OLD.status IS NOT NEW.status OR OLD.array_queued IS NOT NEW.array_queued" if name == 'update' else ""
+    connection.execute(sqlalchemy.text("CREATE TRIGGER IF NOT EXISTS count_job_%s AFTER %s ON Job%s BEGIN UPDATE ChangeCounter SET counter = counter + 1 WHERE id = 1; END" % (name, event, condition)))
+
+def _stamp_job_changes(connection):
+  """Adds the column that stores the value of the change counter when a job was added or changed its status, which is set by the triggers that increment the change counter."""
+  columns = set(row[1] for row in connection.execute(sqlalchemy.text("PRAGMA table_info(Job)")))
+  if 'changed' not in columns:
+    connection.execute(sqlalchemy.text("ALTER TABLE Job ADD COLUMN changed INTEGER"))
+  connection.execute(sqlalchemy.text('CREATE INDEX IF NOT EXISTS "ix_Job_changed" ON "Job" (changed)'))
+  for name, event in (('insert', 'INSERT'), ('update', 'UPDATE OF status, array_queued')):
+    condition = " WHEN OLD.status IS NOT NEW.status OR OLD.array_queued IS NOT NEW.array_queued" if name == 'update' else ""
+    connection.execute(sqlalchemy.text("DROP TRIGGER IF EXISTS count_job_%s" % name))
+    connection.execute(sqlalchemy.text('CREATE TRIGGER count_job_%s AFTER %s ON Job%s BEGIN UPDATE ChangeCounter SET counter = counter + 1 WHERE id = 1; UPDATE Job SET changed = (SELECT counter FROM ChangeCounter WHERE id = 1) WHERE "unique" = NEW."unique"; END' % (name, event, condition)))
+
+def _add_priority(connection):
+  """Adds the priority of jobs, which is 0 for all existing jobs."""
+  columns = set(row[1] for row in connection.execute(sqlalchemy.text("PRAGMA table_info(Job)")))
+  if 'priority' not in columns:
+    connection.execute(sqlalchemy.text("ALTER TABLE Job ADD COLUMN priority INTEGER"))
+  connection.execute(sqlalchemy.text("UPDATE Job SET priority = 0 WHERE priority IS NULL"))
+
+def _add_claimed_by(connection):
+  """Adds the scheduler that has claimed a job or an array job."""
+  for table in ('Job', 'ArrayJob'):
+    columns = set(row[1] for row in connection.execute(sqlalchemy.text("PRAGMA table_info(%s)" % table)))
+    if 'claimed_by' not in columns:
+      connection.execute(sqlalchemy.text("ALTER TABLE %s ADD COLUMN claimed_by VARCHAR(255)" % table))
+
+def _add_tasks_per_worker(connection):
+  """Adds the number of array jobs that one worker runs."""
+  columns = set(row[1] for row in connection.execute(sqlalchemy.text("PRAGMA table_info(Job)")))
+  if 'tasks_per_worker' not in columns:
+    connection.execute(sqlalchemy.text("ALTER TABLE Job ADD COLUMN tasks_per_worker INTEGER"))
+
+def _add_python_calls(connection):
+  """Adds the pickled Python calls of jobs, and their return values and errors."""
+  columns = set(row[1] for row in connection.execute(sqlalchemy.text("PRAGMA table_info(Job)")))
+  for column, column_type in (('call', 'BLOB'), ('return_value', 'BLOB'), ('error', 'TEXT')):
+    if column not in columns:
+      connection.execute(sqlalchemy.text("ALTER TABLE Job ADD COLUMN %s %s" % (column, column_type)))
+
+def _add_packed_logs(connection):
+  """Adds the indicator whether the logs of a job are packed."""
+  columns = set(row[1] for row in connection.execute(sqlalchemy.text("PRAGMA table_info(Job)")))
+  if 'packed_logs' not in columns:
+    connection.execute(sqlalchemy.text("ALTER TABLE Job ADD COLUMN packed_logs BOOLEAN"))
+
+def _add_resource_usage(connection):
+  """Adds the resource usage of jobs and array jobs."""
+  for table in ('Job', 'ArrayJob'):
+    columns = set(row[1] for row in connection.execute(sqlalchemy.text("PRAGMA table_info(%s)" % table)))
+    for column, column_type in (('user_time', 'FLOAT'), ('system_time', 'FLOAT'), ('max_rss', 'INTEGER'), ('block_input', 'INTEGER'), ('block_output', 'INTEGER'), ('context_switches', 'INTEGER')):
+      if column not in columns:
+        connection.execute(sqlalchemy.text("ALTER TABLE %s ADD COLUMN %s %s" % (table, column, column_type)))
+
+def _add_walltime(connection):
+  """Adds the walltime of jobs."""
+  columns = set(row[1] for row in connection.execute(sqlalchemy.text("PRAGMA table_info(Job)")))
+  if 'walltime' not in columns:
+    connection.execute(sqlalchemy.text("ALTER TABLE Job ADD COLUMN walltime INTEGER"))
+
+def _add_retry_policy(connection):
+  """Adds the retry policy of jobs; the Attempt table is created with the other new tables."""
+  columns = set(row[1] for row in connection.execute(sqlalchemy.text("PRAGMA table_info(Job)")))
+  for column, column_type in (('max_attempts', 'INTEGER'), ('retry_delay', 'FLOAT'), ('retry_results', 'TEXT')):
+    if column not in columns:
+      connection.execute(sqlalchemy.text("ALTER TABLE Job ADD COLUMN %s %s" % (column, column_type)))
+
+def _add_process_ids(connection):
+  """Adds the processes that run jobs and array jobs."""
+  for table in ('Job', 'ArrayJob'):
+    columns = set(row[1] for row in connection.execute(sqlalchemy.text("PRAGMA table_info(%s)" % table)))
+    for column in ('pid', 'pid_start'):
+      if column not in columns:
+        connection.execute(sqlalchemy.text("ALTER TABLE %s ADD COLUMN %s INTEGER" % (table, column)))
+
+def _add_array_dependency(connection):
+  """Adds the indicator whether a job has element-wise array dependencies."""
+  columns = set(row[1] for row in connection.execute(sqlalchemy.text("PRAGMA table_info(Job)")))
+  if 'array_dependency' not in columns:
+    connection.execute(sqlalchemy.text("ALTER TABLE Job ADD COLUMN array_dependency BOOLEAN"))
+
+# The migrations that bring a database from the previous schema version to the given one.
+# Databases that were created before the schema was versioned have version 0.
+# New migrations need to be appended here, and must not rely on the current state of the ORM classes.
+MIGRATIONS = (
+  (1, _add_indexes),
+  (2, _replace_pickled_columns),
+  (3, _add_array_status),
+  (4, _add_array_counters),
+  (5, _add_change_counter),
+  (6, _stamp_job_changes),
+  (7, _add_priority),
+  (8, _add_claimed_by),
+  (9, _add_tasks_per_worker),
+  (10, _add_python_calls),
+  (11, _add_packed_logs),
+  (12, _add_resource_usage),
+  (13, _add_walltime),
+  (14, _add_retry_policy),
+  (15, _add_process_ids),
+  (16, _add_array_dependency),
+)
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def change_counter(session):
+  """Returns the value of the change counter (see :py:class:`ChangeCounter`)."""
+  # this is read very often, so we avoid the overhead of building an ORM query
+  return session.execute(sqlalchemy.text("SELECT counter FROM ChangeCounter WHERE id = 1")).scalar()
+
+
+def _schema_version(connection):
+  """Returns the schema version stored in the database, or None if it has not been stored yet."""
+  row = connection.execute(sqlalchemy.text("SELECT version FROM SchemaVersion WHERE id = 1")).fetchone()
+  return row[0] if row is not None else None
+
+def create_schema(engine):
+  """Creates all tables of a new database, which is labeled with the current :py:data:`SCHEMA_VERSION`."""
+  Base.metadata.create_all(engine)
+  with engine.begin() as connection:
+    _add_change_counter(connection)
+    _stamp_job_changes(connection)
+    connection.execute(sqlalchemy.text("INSERT OR REPLACE INTO SchemaVersion (id, version) VALUES (1, :version)"), {'version' : SCHEMA_VERSION})
+
+def upgrade_schema(engine):
+  """Upgrades an existing database to the current :py:data:`SCHEMA_VERSION` by applying all missing migrations in place.
+  Returns the schema version that the database had before."""
+  # add tables that are new in the current version (including the SchemaVersion table itself)
+  Base.metadata.create_all(engine)
+  with engine.begin() as connection:
+    old_version = _schema_version(connection)
+    if old_version == SCHEMA_VERSION:
+      return old_version
+    # this write obtains the database lock, so that concurrent processes do not migrate the database twice
+    connection.execute(sqlalchemy.text("INSERT OR IGNORE INTO SchemaVersion (id, version) VALUES (1, 0)"))
+    old_version = _schema_version(connection)
+    if old_version > SCHEMA_VERSION:
+      raise RuntimeError("The database has schema version %d, which is newer than the version %d supported by this version of gridtk." % (old_version, SCHEMA_VERSION))
+    for version, migration in MIGRATIONS:
+      if version > old_version:
+        logger.info("Upgrading database schema to version %d" % version)
+        migration(connection)
+    connection.execute(sqlalchemy.text("UPDATE SchemaVersion SET version = :version WHERE id = 1"), {'version' : SCHEMA_VERSION})
+  return old_version
@@ -15,18 +15,25 @@ __epilog__ = """ For a list of available commands:
 
 import os
 import sys
+import copy
 
 import argparse
 import logging
+import math
 import string
 
-from ..tools import make_shell, logger
-from .. import local, sge
-from ..models import Status
+from ..tools import make_shell, logger, walltime_in_seconds
+from .. import local, sge, server, history
+from ..models import Status, IdSet
 
 GPU_QUEUES = ['gpu', 'lgpu', 'sgpu', 'gpum']
 QUEUES = ['all.q', 'q1d', 'q1w', 'q1m', 'q1dm', 'q1wm'] + GPU_QUEUES
 
+# The minimum walltime in seconds that is set from the predicted runtime of a job (see --walltime-factor)
+MIN_WALLTIME = 60
+# The predicted runtime of a job is multiplied with this margin to choose its queue (see "--queue auto")
+QUEUE_MARGIN = 2.
+
 
 def appropriate_for_gpu(args, kwargs):
   # don't set these for GPU processing or the maximum virtual memory will be
@@ -48,7 +55,9 @@ def appropriate_for_gpu(args, kwargs):
 def setup(args):
   """Returns the JobManager and sets up the basic infrastructure"""
 
-  kwargs = {'wrapper_script' : args.wrapper_script, 'debug' : args.verbose==3, 'database' : args.database}
+  kwargs = {'wrapper_script' : args.wrapper_script, 'debug' : args.verbose==3, 'database' : args.database, 'server' : args.server, 'history' : args.history}
+  if args.wal is not None:
+    kwargs['wal'] = args.wal
   if args.local:
     jm = local.JobManagerLocal(**kwargs)
   else:
@@ -95,23 +104,24 @@ def get_array(array):
 
 
 def get_ids(jobs):
+  """Returns the :py:class:`gridtk.models.IdSet` of the given job (or array) ids, which might contain ranges like ``1-4`` or ``10+2``."""
   if jobs is None:
     return None
-  indexes = []
+  intervals = []
   for job in jobs:
     if '-' not in job and '+' not in job:
       index = int(job)
-      indexes.append(index)
+      intervals.append((index, index))
     # check if a range is specified
     elif '-' in job and '+' not in job:
       first, last = job.split('-', 1)
-      indexes.extend(range(int(first), int(last) + 1))
+      intervals.append((int(first), int(last)))
     # check if a plus sign is specified
     elif '+' in job and '-' not in job:
       first, add = job.split('+', 1)
       first, add = int(first), int(add)
-      indexes.extend(range(first, first + add + 1))
-  return indexes
+      intervals.append((first, first + add))
+  return IdSet(intervals)
 
 
 def get_memfree(memory, parallel):
@@ -122,20 +132,32 @@ def get_memfree(memory, parallel):
     memtype = "G"
   return "%d%s" % (number*parallel, memtype)
 
-def submit(args):
-  """Submission command"""
-
+def _submit_arguments(args):
+  """Returns the command line and the keyword arguments for the submission of the job, which are read from the parsed arguments."""
   # set full path to command
-  if args.job[0] == '--':
-    del args.job[0]
-  if not os.path.isabs(args.job[0]):
-    args.job[0] = os.path.abspath(args.job[0])
+  command_line = args.job[:]
+  if command_line and command_line[0] == '--':
+    del command_line[0]
+  if not command_line:
+    raise ValueError("Please specify the command that should be executed")
+  if not os.path.isabs(command_line[0]):
+    command_line[0] = os.path.abspath(command_line[0])
+
+  walltime = walltime_in_seconds(args.walltime) if args.walltime is not None else None
+  qname = args.qname
+  if args.history is not None and ((walltime is None and args.walltime_factor is not None) or qname == 'auto'):
+    predicted = history.RuntimeHistory(args.history).predict(args.name, command_line)
+    if predicted is not None and walltime is None and args.walltime_factor is not None:
+      walltime = max(int(math.ceil(args.walltime_factor * predicted)), MIN_WALLTIME)
+    if qname == 'auto' and (walltime is not None or predicted is not None):
+      qname = history.choose_queue(walltime if walltime is not None else QUEUE_MARGIN * predicted, parallel=args.parallel is not None)
+  if qname == 'auto':
+    # without history, the job goes to the default queue
+    qname = 'all.q'
 
-  jm = setup(args)
   kwargs = {
-      'queue': args.qname,
+      'queue': qname,
       'cwd': True,
-      'verbosity' : args.verbose,
       'name': args.name,
       'env': args.env,
       'memfree': args.memory,
@@ -144,22 +166,101 @@ def submit(args):
   }
 
   if args.array is not None:         kwargs['array'] = get_array(args.array)
+  if args.compact_array:             kwargs['compact_array'] = True
+  if args.tasks_per_worker > 1:      kwargs['tasks_per_worker'] = args.tasks_per_worker
   if args.exec_dir is not None:      kwargs['exec_dir'] = args.exec_dir
   if args.log_dir is not None:       kwargs['log_dir'] = args.log_dir
-  if args.dependencies is not None:  kwargs['dependencies'] = args.dependencies
-  if args.qname != 'all.q':          kwargs['hvmem'] = args.memory
-  if args.qname in GPU_QUEUES:
+  if args.packed_logs:               kwargs['packed_logs'] = True
+  if args.dependencies is not None:  kwargs['dependencies'] = args.dependencies[:]
+  if args.array_dependency:          kwargs['array_dependency'] = True
+  if args.priority:                  kwargs['priority'] = args.priority
+  if walltime is not None:           kwargs['walltime'] = walltime
+  if args.max_attempts > 1:          kwargs['max_attempts'] = args.max_attempts
+  if args.retry_delay is not None:   kwargs['retry_delay'] = args.retry_delay
+  if args.retry_on is not None:      kwargs['retry_results'] = args.retry_on[:]
+  if qname != 'all.q':               kwargs['hvmem'] = args.memory
+  if qname in GPU_QUEUES:
     appropriate_for_gpu(args, kwargs)
   if args.parallel is not None:
     kwargs['pe_opt'] = "pe_mth %d" % args.parallel
     if args.memory is not None:
       kwargs['memfree'] = get_memfree(args.memory, args.parallel)
-  kwargs['dry_run'] = args.dry_run
   kwargs['stop_on_failure'] = args.stop_on_failure
 
+  return command_line, kwargs
+
+
+def _parse_line(parser, arguments, namespace):
+  """Parses the arguments of one line of a ``--from-file`` file with the given parser, raising a ValueError instead of exiting on errors."""
+  def error(message):
+    raise ValueError(message)
+  line_parser = copy.copy(parser)
+  line_parser.error = error
+  return line_parser.parse_args(arguments, namespace=namespace)
+
+
+def _read_submissions(args):
+  """Reads the jobs for ``jman submit --from-file``.
+  Each line of the file contains the options and the command of one job, as they would be given to ``jman submit``; the options given on the command line are used as defaults.
+  Empty lines and lines starting with '#' are ignored.
+  Errors are reported with the number of the line; in this case, none of the jobs of the file is submitted."""
+  import shlex
+  stream = sys.stdin if args.from_file == '-' else open(args.from_file)
+  specs = []
+  # the index of the (last) spec that was created for each line of the file
+  line_specs = {}
+  try:
+    for line_number, line in enumerate(stream, 1):
+      line = line.strip()
+      if not line or line.startswith('#'):
+        continue
+      # each line gets its own copy of the defaults, so that the lines do not share their lists, e.g., of dependencies
+      defaults = argparse.Namespace(**dict((key, value if key == 'parser' else copy.deepcopy(value)) for key, value in vars(args).items()))
+      defaults.from_file, defaults.batch_dependencies = None, []
+      try:
+        line_args = _parse_line(args.parser, shlex.split(line), defaults)
+        command_line, kwargs = _submit_arguments(line_args)
+      except ValueError as e:
+        raise ValueError("Line %d of '%s': %s" % (line_number, args.from_file, e))
+
+      batch_dependencies = []
+      for dependency in line_args.batch_dependencies:
+        if dependency not in line_specs:
+          raise ValueError("Line %d of '%s' depends on line %d, which is not an earlier line that defines a job" % (line_number, args.from_file, dependency))
+        batch_dependencies.append(line_specs[dependency])
+
+      # submit the job(s); each job depends on the job before
+      for _ in range(line_args.repeat):
+        specs.append(dict(kwargs, command_line=command_line, batch_dependencies=batch_dependencies))
+        batch_dependencies = batch_dependencies + [len(specs) - 1]
+      line_specs[line_number] = len(specs) - 1
+  finally:
+    if stream is not sys.stdin:
+      stream.close()
+
+  return specs
+
+
+def submit(args):
+  """Submission command"""
+  jm = setup(args)
+
+  if args.batch_dependencies and args.from_file is None:
+    raise ValueError("The --batch-dependencies option can only be used inside the file given to --from-file")
+  if args.from_file is not None:
+    # submit all jobs from the file at once
+    job_ids = jm.submit_many(_read_submissions(args), dry_run=args.dry_run, verbosity=args.verbose)
+    if args.print_id:
+      print (" ".join(str(job_id) for job_id in job_ids), end='')
+    return
+
+  command_line, kwargs = _submit_arguments(args)
+  kwargs['verbosity'] = args.verbose
+  kwargs['dry_run'] = args.dry_run
+
   # submit the job(s)
   for _ in range(args.repeat):
-    job_id = jm.submit(args.job, **kwargs)
+    job_id = jm.submit(command_line, **kwargs)
     dependencies = kwargs.get('dependencies', [])
     dependencies.append(job_id)
     kwargs['dependencies'] = dependencies
@@ -191,6 +292,8 @@ def resubmit(args):
     kwargs['io_big'] = True
   if args.no_io_big:
     kwargs['io_big'] = False
+  if args.priority is not None:
+    kwargs['priority'] = args.priority
 
   jm.resubmit(get_ids(args.job_ids), args.also_success, args.running_jobs, args.overwrite_command, keep_logs=args.keep_logs, **kwargs)
 
@@ -200,7 +303,10 @@ def run_scheduler(args):
   if not args.local:
     raise ValueError("The execute command can only be used with the '--local' command line option")
   jm = setup(args)
-  jm.run_scheduler(parallel_jobs=args.parallel, job_ids=get_ids(args.job_ids), sleep_time=args.sleep_time, die_when_finished=args.die_when_finished, no_log=args.no_log_files, nice=args.nice, verbosity=args.verbose)
+  fair_share = None
+  if args.fair_share is not None:
+    fair_share = dict((name, float(weight or 1)) for name, _, weight in (share.partition('=') for share in args.fair_share))
+  jm.run_scheduler(parallel_jobs=args.parallel or args.cores or 1, job_ids=get_ids(args.job_ids), sleep_time=args.sleep_time, die_when_finished=args.die_when_finished, no_log=args.no_log_files, nice=args.nice, verbosity=args.verbose, event_driven=args.event_driven, direct=args.direct, cores=args.cores, memory=args.memory, fair_share=fair_share, preload=args.preload, adopt=args.adopt, critical_path=args.critical_path)
 
 
 def list(args):
@@ -209,7 +315,7 @@ def list(args):
   if not args.local:
     # update the status of jobs from SGE before listing them.
     jm.communicate(job_ids=get_ids(args.job_ids))
-  jm.list(job_ids=get_ids(args.job_ids), print_array_jobs=args.print_array_jobs, print_dependencies=args.print_dependencies, status=args.status, long=args.long, print_times=args.print_times, ids_only=args.ids_only, names=args.names)
+  jm.list(job_ids=get_ids(args.job_ids), print_array_jobs=args.print_array_jobs, print_dependencies=args.print_dependencies, status=args.status, long=args.long, print_times=args.print_times, ids_only=args.ids_only, names=args.names, print_resources=args.print_resources, print_attempts=args.print_attempts, print_eta=args.eta)
 
 
 def communicate(args):
@@ -244,12 +350,25 @@ def delete(args):
   jm.delete(job_ids=get_ids(args.job_ids), array_ids=get_ids(args.array_ids), delete_logs=not args.keep_logs, delete_log_dir=not args.keep_log_dir, status=args.status)
 
 
+def serve(args):
+  """Runs the state server, which owns the database. To stop it, please use Ctrl-C."""
+  if args.server is None:
+    raise ValueError("Please specify the address of the state server with the '--server' option")
+  jm = setup(args)
+  server.StateServer(jm, args.server, refresh_interval=args.refresh_interval).serve_forever()
+
+
 def run_job(args):
   """Starts the wrapper script to execute a job, interpreting the JOB_ID and SGE_TASK_ID keywords that are set by the grid or by us."""
   jm = setup(args)
   job_id = int(os.environ['JOB_ID'])
   array_id = int(os.environ['SGE_TASK_ID']) if os.environ['SGE_TASK_ID'] != 'undefined' else None
-  jm.run_job(job_id, array_id)
+  array_ids = args.array_ids or None
+  if array_ids is None and array_id is not None and args.tasks_per_worker > 1:
+    # the grid task runs the array jobs up to the next grid task, whose id is SGE_TASK_STEPSIZE ahead
+    step = int(os.environ['SGE_TASK_STEPSIZE'])
+    array_ids = range(array_id, min(array_id + step, int(os.environ['SGE_TASK_LAST']) + 1), step // args.tasks_per_worker)
+  jm.run_job(job_id, array_id, array_ids, walltime=args.walltime, retry_delay=args.retry_delay)
 
 
 class AliasedSubParsersAction(argparse._SubParsersAction):
@@ -308,11 +427,20 @@ def main(command_line_options = None):
 
   parser.add_argument('-l', '--local', action='store_true',
         help = 'Uses the local job manager instead of the SGE one.')
+  parser.add_argument('--server', metavar='ADDRESS',
+        help = 'The address of the state server (see the "serve" command), either a Unix socket file or HOST:PORT. Running jobs send their status to this server instead of writing it to the database, and jobs are listed by the server.')
+  parser.add_argument('-H', '--history', metavar='FILE', default=rc.get('gridtk.history'),
+        help = 'The runtime history (e.g. ~/.gridtk/history.sql3), which records the runtimes of the successful jobs of all databases that use it. It is used to predict the runtimes of jobs for the --walltime-factor and "--queue auto" options of submit, the --eta option of list and the --critical-path option of run-scheduler.')
+  wal_group = parser.add_mutually_exclusive_group()
+  wal_group.add_argument('--wal', dest='wal', action='store_true', default=None,
+        help = 'Uses the WAL mode of the database, in which listing jobs does not block running jobs; this is the default for the --local job manager. WAL mode only works when all processes that access the database run on the machine that stores it.')
+  wal_group.add_argument('--no-wal', dest='wal', action='store_false',
+        help = 'Uses the classic rollback journal instead of the WAL mode of the database, e.g., when the database is stored on a network file system; this is the default for the SGE job manager, whose jobs access the database from other hosts.')
   cmdparser = parser.add_subparsers(title='commands', help='commands accepted by %(prog)s')
 
   # subcommand 'submit'
   submit_parser = cmdparser.add_parser('submit', aliases=['sub'], formatter_class=formatter, help='Submits jobs to the SGE queue or to the local job scheduler and logs them in a database.')
-  submit_parser.add_argument('-q', '--queue', metavar='QNAME', dest='qname', default='all.q', choices=QUEUES, help='the name of the SGE queue to submit the job to')
+  submit_parser.add_argument('-q', '--queue', metavar='QNAME', dest='qname', default='all.q', choices=QUEUES + ['auto'], help='the name of the SGE queue to submit the job to; "auto" chooses the shortest of the q1d, q1w and q1m queues (q1dm, q1wm and q1m for --parallel jobs) that fits the walltime of the job, or twice its runtime predicted from the --history')
   submit_parser.add_argument('-e', '--sge-extra-args', default=rc.get('gridtk.sge.extra.args.default', ''), type=str, help='Passes extra arguments to qsub. See the documentation of the package for usage and ways of overriding default behavior.')
   submit_parser.add_argument('-m', '--memory', help='Sets both the h_vmem and the mem_free parameters when submitting '
                                                     'the job to a non-GPU queue, e.g., 8G to set the memory '
@@ -320,18 +448,30 @@ def main(command_line_options = None):
                                                     'submitting the job to a GPU-based queue.')
   submit_parser.add_argument('-p', '--parallel', '--pe_mth', type=int, help='Sets the number of slots per job (-pe pe_mth) and multiplies the mem_free parameter. E.g. to get 16 G of memory, use -m 8G -p 2.')
   submit_parser.add_argument('-n', '--name', dest='name', help='Gives the job a name')
+  submit_parser.add_argument('-P', '--priority', type=int, default=0, help='Sets the priority of the job; jobs with higher priority are started first by the local scheduler. In the SGE, this is the -p option of qsub (which only allows negative values for normal users).')
+  submit_parser.add_argument('-w', '--walltime', metavar='TIME', help='Sets the maximum time that the job (or each of its array jobs) may run, e.g., 2:30:00 (hours, minutes and seconds), 90m or 3600 (seconds). Jobs that run longer are stopped and fail with the result 84. In the SGE, this is the h_rt limit of the job.')
+  submit_parser.add_argument('-W', '--walltime-factor', type=float, metavar='FACTOR', help='Without --walltime, sets the walltime of the job to FACTOR times its runtime predicted from the --history (but at least %d seconds); jobs without history have no walltime.' % MIN_WALLTIME)
+  submit_parser.add_argument('-A', '--max-attempts', type=int, metavar='N', default=1, help='Runs each failing (array) job up to N times; only the array jobs that failed are run again.')
+  submit_parser.add_argument('--retry-delay', type=float, metavar='SECONDS', help='Waits the given number of seconds before the first retry of a failed (array) job; the delay doubles with every further retry.')
+  submit_parser.add_argument('--retry-on', type=int, metavar='RESULT', nargs='+', help='Retries only (array) jobs that failed with one of the given results (exit codes); by default, all failures are retried.')
   submit_parser.add_argument('-x', '--dependencies', type=int, default=[], metavar='ID', nargs='*', help='Set job dependencies to the list of job identifiers separated by spaces')
+  submit_parser.add_argument('--array-dependency', action='store_true', help='Makes each array job wait only for the array jobs with the same id of the --dependencies (qsub -hold_jid_ad), so that the array jobs of a pipeline can start before the whole previous array job has finished.')
   submit_parser.add_argument('-k', '--stop-on-failure', action='store_true', help='Stop depending jobs when this job finished with an error.')
   submit_parser.add_argument('-d', '--exec-dir', metavar='DIR', help='Sets the executing directory, where the script should be executed. If not given, jobs will be executed in the current directory')
   submit_parser.add_argument('-l', '--log-dir', metavar='DIR', help='Sets the log directory. By default, "logs" is selected for the SGE. If the jobs are executed locally, by default the result is written to console.')
+  submit_parser.add_argument('-L', '--packed-logs', action='store_true', help='Writes the logs of all (array) jobs of the job into one file in the log directory, instead of two files per array job; use "jman report" to read them.')
   submit_parser.add_argument('-s', '--environment', metavar='KEY=VALUE', dest='env', nargs='*', default=[], help='Passes specific environment variables to the job.')
   submit_parser.add_argument('-t', '--array', '--parametric', metavar='(first-)last(:step)', help="Creates a parametric (array) job. You must specify the 'last' value, but 'first' (default=1) and 'step' (default=1) can be specified as well (when specifying 'step', 'first' has to be given, too).")
+  submit_parser.add_argument('-C', '--compact-array', action='store_true', help="Stores the status of the elements of the array job compactly, which is much faster for arrays with many thousands of elements; only the elements that are running or failed are stored individually, so that the elements that succeeded do not keep their start and finish times, their machine and their resource usage (which only counts towards the usage of the job).")
+  submit_parser.add_argument('-T', '--tasks-per-worker', type=int, metavar='K', default=1, help="Runs K consecutive array jobs one after the other in the same process, which is faster for array jobs with many short tasks; the output of these array jobs is written into the log files of the first of them.")
   submit_parser.add_argument('-z', '--dry-run', action='store_true', help='Do not really submit anything, just print out what would submit in this case')
   submit_parser.add_argument('-i', '--io-big', action='store_true', help='Sets "io_big" on the submitted jobs so it limits the machines in which the job is submitted to those that can do high-throughput.')
   submit_parser.add_argument('-r', '--repeat', type=int, metavar='N', default=1, help='Submits the job N times. Each job will depend on the job before.')
   submit_parser.add_argument('-o', '--print-id', action='store_true', help='Prints the new job id (so that they can be parsed by automatic scripts).')
+  submit_parser.add_argument('-f', '--from-file', metavar='FILE', help="Submits all jobs listed in the given file (or '-' for stdin) at once. Each line contains the options and the command of one job; the options given on the command line are used as defaults.")
+  submit_parser.add_argument('-X', '--batch-dependencies', type=int, default=[], metavar='LINE', nargs='*', help='Only valid inside a --from-file file: Set dependencies to the jobs defined in the given (earlier) lines of the file.')
   submit_parser.add_argument('job', metavar='command', nargs=argparse.REMAINDER, help = "The job that should be executed. Sometimes a -- is required to separate the job from other command line options.")
-  submit_parser.set_defaults(func=submit)
+  submit_parser.set_defaults(func=submit, parser=submit_parser)
 
   # subcommand 're-submit'
   resubmit_parser = cmdparser.add_parser('resubmit', aliases=['reset', 'requeue', 're'], formatter_class=formatter, help='Re-submits a list of jobs.')
@@ -342,6 +482,7 @@ def main(command_line_options = None):
                                                       'to set the memory requirements to 8 gigabytes. Resets gpumem '
                                                       'parameter when submitting the job to a GPU-based queue.')
   resubmit_parser.add_argument('-p', '--parallel', '--pe_mth', type=int, help='Resets the number of slots per job (-pe pe_mth) and multiplies the mem_free parameter. E.g. to get 16 G of memory, use -m 8G -p 2.')
+  resubmit_parser.add_argument('-P', '--priority', type=int, help='Resets the priority of the jobs.')
   resubmit_parser.add_argument('-i', '--io-big', action='store_true', help='Resubmits the job to the "io_big" queue.')
   resubmit_parser.add_argument('-I', '--no-io-big', action='store_true', help='Resubmits the job NOT to the "io_big" queue.')
   resubmit_parser.add_argument('-k', '--keep-logs', action='store_true', help='Do not clean the log files of the old job before re-submitting.')
@@ -362,6 +503,9 @@ def main(command_line_options = None):
   list_parser.add_argument('-a', '--print-array-jobs', action='store_true', help='Also list the array ids.')
   list_parser.add_argument('-l', '--long', action='store_true', help='Prints additional information about the submitted job.')
   list_parser.add_argument('-t', '--print-times', action='store_true', help='Prints timing information on when jobs were submited, executed and finished')
+  list_parser.add_argument('-r', '--resources', dest='print_resources', action='store_true', help='Prints the CPU time, the maximum memory (RSS), the block I/O and the context switches of the finished jobs, and a summary (minimum, median and 95th percentile) of the (array) jobs for each job name.')
+  list_parser.add_argument('-A', '--print-attempts', action='store_true', help='Prints the result and the timing of each attempt of the (array) jobs of jobs that are retried (see "jman submit --max-attempts").')
+  list_parser.add_argument('-e', '--eta', action='store_true', help='Prints the remaining runtime of the executing jobs, which is predicted from the --history.')
   list_parser.add_argument('-x', '--print-dependencies', action='store_true', help='Print the dependencies of the jobs as well.')
   list_parser.add_argument('-o', '--ids-only', action='store_true', help='Prints ONLY the job ids (so that they can be parsed by automatic scripts).')
   list_parser.add_argument('-s', '--status', nargs='+', choices = Status, default = Status, help='Delete only jobs that have the given statuses; by default all jobs are deleted.')
@@ -394,17 +538,34 @@ def main(command_line_options = None):
 
   # subcommand 'run_scheduler'
   scheduler_parser = cmdparser.add_parser('run-scheduler', aliases=['sched', 'x'], formatter_class=formatter, help='Runs the scheduler on the local machine. To stop the scheduler safely, please use Ctrl-C; only valid in combination with the \'--local\' option.')
-  scheduler_parser.add_argument('-p', '--parallel', type=int, default=1, help='Select the number of parallel jobs that you want to execute locally')
+  scheduler_parser.add_argument('-p', '--parallel', type=int, help='Select the number of parallel jobs that you want to execute locally; by default, this is the number of --cores, or 1')
+  scheduler_parser.add_argument('-c', '--cores', type=int, help='The number of cores of this machine; jobs are only started when the cores that they require (-p option of submit) are free.')
+  scheduler_parser.add_argument('-m', '--memory', help='The memory of this machine (e.g. 64G); jobs are only started when the memory that they require (-m option of submit) is free.')
   scheduler_parser.add_argument('-j', '--job-ids', metavar='ID', nargs='+', help='Select the job ids that should be run (be default, all submitted and queued jobs are run).')
   scheduler_parser.add_argument('-s', '--sleep-time', type=float, default=0.1, help='Set the sleep time between for the scheduler in seconds.')
   scheduler_parser.add_argument('-x', '--die-when-finished', action='store_true', help='Let the job manager die when it has finished all jobs of the database.')
   scheduler_parser.add_argument('-l', '--no-log-files', action='store_true', help='Overwrites the log file setup to print the results to the console.')
   scheduler_parser.add_argument('-n', '--nice', type=int, help='Jobs will be run with the given priority (can only be positive, i.e., to have lower priority')
+  scheduler_parser.add_argument('-e', '--event-driven', action='store_true', help='Wake up the scheduler only when a job finishes or the database changes, instead of checking all jobs in every cycle; the --sleep-time is then the interval for checking the database for changes.')
+  scheduler_parser.add_argument('-D', '--direct', action='store_true', help='Execute the command lines of the jobs directly instead of through the "jman run-job" wrapper, which is faster for short jobs; the scheduler writes the status of the jobs into the database.')
+  scheduler_parser.add_argument('-f', '--fair-share', metavar='NAME=WEIGHT', nargs='*', help='Share this machine between the jobs with different names (among the jobs of the same priority), according to the given weights (1 by default); without this option, the jobs with the lowest ids are started first.')
+  scheduler_parser.add_argument('-a', '--adopt', action='store_true', help='Adopt the jobs that a previous scheduler on this machine has left running (e.g. since it crashed) and re-queue the jobs whose processes have gone; when this scheduler is interrupted, its jobs are left running, so that they can be adopted by the next scheduler.')
+  scheduler_parser.add_argument('-C', '--critical-path', action='store_true', help='Start the jobs that begin the longest chains of dependent jobs first (among the jobs of the same priority), instead of the jobs with the lowest ids, which shortens the time until all jobs have finished; with a --history, the length of a chain is the sum of the predicted runtimes of its jobs.')
+  scheduler_parser.add_argument('--preload', metavar='MODULE', nargs='+', help='The Python modules that the worker processes for Python calls (submitted with JobManagerLocal.submit_callable) import before they are started, e.g., numpy.')
   scheduler_parser.set_defaults(func=run_scheduler)
 
 
+  # subcommand 'serve'
+  serve_parser = cmdparser.add_parser('serve', formatter_class=formatter, help='Runs the state server that writes the status changes of running jobs to the database; use the --server option to specify the address that the server listens on. Only clients that can read the secret token, which the server writes next to the database, are served; the connections are not encrypted.')
+  serve_parser.add_argument('-r', '--refresh-interval', type=float, default=10., metavar='T', help='The interval in seconds, in which the server re-reads the status of all jobs from the database, e.g., to see newly submitted jobs.')
+  serve_parser.set_defaults(func=serve)
+
   # subcommand 'run-job'; this should not be seen on the command line since it is actually a wrapper script
   run_parser = cmdparser.add_parser('run-job', help=argparse.SUPPRESS)
+  run_parser.add_argument('--tasks-per-worker', type=int, default=1)
+  run_parser.add_argument('--walltime', type=int)
+  run_parser.add_argument('--retry-delay', type=float)
+  run_parser.add_argument('array_ids', type=int, nargs='*')
   run_parser.set_defaults(func=run_job)
 
 
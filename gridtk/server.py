@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+"""Defines a state server that owns the job database, and a client to talk to it.
+
+When thousands of jobs start and finish at the same time, each of them needs to lock the database to write its new status, which can be slow, especially on network file systems.
+Instead, the jobs can send their status changes to a state server (``jman serve``), which writes the changes of all jobs that arrive at the same time in a single transaction.
+The server also keeps the status of all jobs in memory, so that ``jman list`` does not need to access the database.
+
+The server listens either on a Unix socket (when the address is a file name) or on a TCP port (when the address is ``host:port``).
+The messages are JSON objects, one per line; each request is answered by an object that contains either the ``result`` or an ``error`` message.
+
+Every request needs to contain the secret token that the server writes into a file next to the database (see :py:func:`token_file`), which only the user can read.
+Hence, only the processes of the user that can read the database (e.g. the jobs that run on the grid) can talk to the server, even when its TCP port can be reached from other hosts.
+The connections themselves are not encrypted, so the server should only listen on ports that cannot be reached from outside of the cluster.
+"""
+
+from __future__ import print_function
+
+import binascii
+import hmac
+import json
+import os
+import signal
+import socket
+import threading
+import time
+
+try:
+  import socketserver
+  import queue
+except ImportError:
+  import SocketServer as socketserver
+  import Queue as queue
+
+from .tools import logger
+from .models import IdSet
+
+
+def _address(address):
+  """Returns the socket family and the socket address for the given address string."""
+  host, _, port = address.rpartition(':')
+  if host and port.isdigit() and os.sep not in address:
+    return socket.AF_INET, (host, int(port))
+  return socket.AF_UNIX, address
+
+
+def token_file(database):
+  """Returns the name of the file that holds the secret token of the state server of the given database."""
+  return database + '.token'
+
+
+def create_token(filename):
+  """Writes a new random token into the file with the given name, which only the user can read, and returns the token."""
+  token = binascii.hexlify(os.urandom(16)).decode()
+  if os.path.exists(filename):
+    os.remove(filename)
+  with os.fdopen(os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'w') as f:
+    f.write(token)
+  return token
+
+
+def read_token(filename):
+  """Returns the token stored in the file with the given name, or None if the file does not exist."""
+  try:
+    with open(filename) as f:
+      return f.read().strip()
+  except IOError:
+    return None
+
+
+class StateClient(object):
+  """Sends requests to a :py:class:`StateServer`, authenticated by the given ``token`` (see :py:func:`read_token`)."""
+
+  def __init__(self, address, timeout = 600, token = None):
+    self.address = address
+    self.timeout = timeout
+    self.token = token
+
+  def request(self, command, **kwargs):
+    """Sends the given command with the given keyword arguments to the server, and returns the result.
+    Raises a :py:class:`socket.error` if the server cannot be reached, and a :py:class:`RuntimeError` when the server could not handle the request."""
+    family, address = _address(self.address)
+    connection = socket.socket(family, socket.SOCK_STREAM)
+    try:
+      connection.settimeout(self.timeout)
+      connection.connect(address)
+      kwargs['command'] = command
+      if self.token is not None:
+        kwargs['token'] = self.token
+      connection.sendall((json.dumps(kwargs) + "\n").encode())
+      response = connection.makefile('rb').readline()
+    finally:
+      connection.close()
+    if not response:
+      raise socket.error("The state server closed the connection")
+    response = json.loads(response.decode())
+    if 'error' in response:
+      raise RuntimeError("The state server could not handle the '%s' request: %s" % (command, response['error']))
+    return response['result']
+
+
+def _interrupt(signum, frame):
+  raise KeyboardInterrupt()
+
+
+class _Event(object):
+  """An event of a running job that waits for being written to the database."""
+  def __init__(self, request):
+    self.request = request
+    self.response = None
+    self.done = threading.Event()
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+  """Handles the requests of one client connection."""
+  def handle(self):
+    for line in self.rfile:
+      try:
+        response = self.server.state_server.handle(json.loads(line.decode()))
+      except Exception as e:
+        response = {'error' : str(e)}
+      self.wfile.write((json.dumps(response) + "\n").encode())
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+  daemon_threads = True
+
+class _TCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+  daemon_threads = True
+  allow_reuse_address = True
+
+
+class StateServer(object):
+  """A server that owns the database of the given :py:class:`gridtk.manager.JobManager`.
+
+  The ``execute`` and ``finish`` events of running jobs (see :py:meth:`gridtk.manager.JobManager.apply_job_event`) are collected by a single writer thread, which writes all events that arrived in the meantime with one commit.
+  The ``list`` requests are answered from the summaries of the jobs (see :py:meth:`gridtk.models.Job.summary`) that are kept in memory.
+  Since other processes (e.g. ``jman submit``) still write to the database, the summaries of all jobs are re-read every ``refresh_interval`` seconds.
+  While the server runs, only requests that contain the token of its :py:func:`token_file` are handled.
+  """
+
+  def __init__(self, job_manager, address, refresh_interval = 10.):
+    self.job_manager = job_manager
+    self.address = address
+    self.refresh_interval = refresh_interval
+    self._events = queue.Queue()
+    self._summaries = {}
+    self._summaries_lock = threading.Lock()
+    self._stopped = threading.Event()
+    self._server = None
+    self._token = None
+
+
+  def handle(self, request):
+    """Handles one request, and returns the response."""
+    if self._token is None or not hmac.compare_digest(str(request.pop('token', '')), self._token):
+      return {'error' : "Invalid token; the token of the server is stored in '%s'" % token_file(self.job_manager.database)}
+    command = request.pop('command', None)
+    if command == 'list':
+      return {'result' : self._list(**request)}
+    if command not in ('execute', 'finish'):
+      return {'error' : "Unknown command '%s'" % command}
+    # wait until the writer thread has written the event
+    event = _Event(dict(request, event = command))
+    self._events.put(event)
+    event.done.wait()
+    return event.response
+
+
+  def _list(self, job_ids = None, status = None, names = None):
+    """Returns the summaries of the jobs with the given ids (given as intervals, see :py:class:`gridtk.models.IdSet`), status and names."""
+    job_ids = None if job_ids is None else IdSet(job_ids)
+    with self._summaries_lock:
+      summaries = [self._summaries[unique] for unique in sorted(self._summaries) if job_ids is None or unique in job_ids]
+    return [summary for summary in summaries if (status is None or summary['status'] in status) and (names is None or summary['name'] in names)]
+
+
+  def _refresh(self, job_ids = None):
+    """Re-reads the summaries of the given jobs (or of all jobs) from the database."""
+    self.job_manager.lock(write=False)
+    try:
+      summaries = dict((job.unique, job.summary()) for job in self.job_manager.get_jobs(job_ids))
+    finally:
+      self.job_manager.unlock()
+    with self._summaries_lock:
+      if job_ids is None:
+        self._summaries = summaries
+      else:
+        for unique in job_ids:
+          self._summaries.pop(unique, None)
+        self._summaries.update(summaries)
+
+
+  def _write(self, events):
+    """Writes the given events to the database with a single commit."""
+    stop = set()
+    try:
+      values, touched = self.job_manager.apply_job_events([(event.request['event'], event.request['job_id'], event.request.get('array_id'), dict((key, value) for key, value in event.request.items() if key not in ('event', 'job_id', 'array_id'))) for event in events])
+      for event, value in zip(events, values):
+        if isinstance(value, Exception):
+          event.response = {'error' : str(value)}
+          continue
+        if event.request['event'] == 'finish':
+          # the dependent jobs are stopped by the server, not by the client
+          stop.update(value)
+          value = []
+        event.response = {'result' : value}
+    except Exception as e:
+      for event in events:
+        event.response = {'error' : str(e)}
+      touched = set()
+
+    logger.debug("Wrote %d job events to the database", len(events))
+
+    if stop:
+      # This might not be working properly, so use with care!
+      self.job_manager.stop_jobs(sorted(stop))
+      logger.warning("Stopped dependent jobs '%s' since jobs failed.", str(sorted(stop)))
+      touched.update(stop)
+    if touched:
+      self._refresh(sorted(touched))
+
+    # the clients are answered only now, so that they see their changes when listing the jobs
+    for event in events:
+      event.done.set()
+
+
+  def _writer(self):
+    """Collects the events that arrive, and writes them to the database; this is the only thread that writes to the database."""
+    last_refresh = time.time()
+    while not self._stopped.is_set():
+      try:
+        events = [self._events.get(timeout = 0.1)]
+      except queue.Empty:
+        events = []
+      # all events that arrived while the last events were written are written together
+      while True:
+        try:
+          events.append(self._events.get_nowait())
+        except queue.Empty:
+          break
+      if events:
+        self._write(events)
+      if time.time() - last_refresh > self.refresh_interval:
+        self._refresh()
+        last_refresh = time.time()
+
+
+  def serve_forever(self):
+    """Starts the server, and handles requests until :py:meth:`shutdown` is called (e.g. from another thread) or the process is interrupted."""
+    family, address = _address(self.address)
+    self._token = create_token(token_file(self.job_manager.database))
+    if family == socket.AF_UNIX:
+      if os.path.exists(address):
+        # the socket of a previous server that did not shut down properly
+        os.remove(address)
+      self._server = _UnixServer(address, _RequestHandler)
+    else:
+      self._server = _TCPServer(address, _RequestHandler)
+    self._server.state_server = self
+
+    if isinstance(threading.current_thread(), threading._MainThread):
+      # stop the server properly when it gets killed
+      signal.signal(signal.SIGTERM, _interrupt)
+
+    self._refresh()
+    writer = threading.Thread(target = self._writer)
+    writer.start()
+    logger.info("State server of database '%s' is listening on '%s'", self.job_manager.database, self.address)
+    try:
+      self._server.serve_forever()
+    except KeyboardInterrupt:
+      logger.info("Stopping state server due to user interrupt.")
+    finally:
+      self._stopped.set()
+      writer.join()
+      self._server.server_close()
+      if family == socket.AF_UNIX and os.path.exists(address):
+        os.remove(address)
+      os.remove(token_file(self.job_manager.database))
+
+
+  def shutdown(self):
+    """Stops the server that runs :py:meth:`serve_forever` in another thread."""
+    self._server.shutdown()
@@ -10,8 +10,8 @@ from __future__ import print_function
 
 from .manager import JobManager
 from .setshell import environ
-from .models import add_job, Job
-from .tools import logger, qsub, qstat, qdel, make_shell, makedirs_safe
+from .models import add_job, add_jobs, Job
+from .tools import logger, qsub, qstat, qdel, make_shell, makedirs_safe, TERMINATE_TIMEOUT
 
 import os
 import sys
@@ -66,9 +66,15 @@ class JobManagerSGE(JobManager):
     assert os.path.isdir(job.log_dir), "Please make sure --log-dir `{}' either does not exist or is a directory.".format(job.log_dir)
 
     # generate call to the wrapper script
-    command = make_shell(python, [jman, '-%sd' % ('v'*verbosity), self._database, 'run-job'])
-    q_array = "%d-%d:%d" % array if array else None
-    grid_id = qsub(command, context=self.context, name=name, deps=deps, array=q_array, stdout=log_dir, stderr=log_dir, **kwargs)
+    command = make_shell(python, [jman, '-%sd' % ('v'*verbosity), self._database] + self._wrapper_options() + ['run-job'] + (['--tasks-per-worker', str(job.tasks_per_worker)] if job.tasks_per_worker else []) + (['--walltime', str(job.walltime)] if job.walltime else []) + (['--retry-delay', str(job.retry_delay or 0)] if job.max_attempts else []))
+    # each grid task runs several array jobs, if requested
+    q_array = "%d-%d:%d" % (array[0], array[1], array[2] * (job.tasks_per_worker or 1)) if array else None
+    if kwargs.get('walltime'):
+      # the wrapper stops each array job after the walltime; the grid stops the whole grid task, which needs time to stop its array jobs and to write their results
+      kwargs['walltime'] = (kwargs['walltime'] + TERMINATE_TIMEOUT) * (job.tasks_per_worker or 1) + TERMINATE_TIMEOUT
+    # the wrapper writes packed logs itself, so that the grid does not create two log files per task
+    log_dir = '/dev/null' if job.packed_logs else log_dir
+    grid_id = qsub(command, context=self.context, name=name, deps=deps, array=q_array, stdout=log_dir, stderr=log_dir, array_dependency=bool(job.array_dependency and array), **kwargs)
 
     # get the result of qstat
     status = qstat(grid_id, context=self.context)
@@ -79,21 +85,23 @@ class JobManagerSGE(JobManager):
     logger.info("Submitted job '%s' with dependencies '%s' to the SGE grid." % (job, str(deps)))
 
     if 'io_big' in kwargs and kwargs['io_big'] and ('queue' not in kwargs or kwargs['queue'] == 'all.q'):
-      logger.warn("This job will never be executed since the 'io_big' flag is not available for the 'all.q'.")
+      logger.warning("This job will never be executed since the 'io_big' flag is not available for the 'all.q'.")
     if 'pe_opt' in kwargs and ('queue' not in kwargs or kwargs['queue'] not in ('q1dm', 'q_1day_mth', 'q1wm', 'q_1week_mth')):
-      logger.warn("This job will never be executed since the queue '%s' does not support multi-threading (pe_mth) -- use 'q1dm' or 'q1wm' instead." % kwargs['queue'] if 'queue' in kwargs else 'all.q')
+      logger.warning("This job will never be executed since the queue '%s' does not support multi-threading (pe_mth) -- use 'q1dm' or 'q1wm' instead." % kwargs['queue'] if 'queue' in kwargs else 'all.q')
     if 'gpumem' in kwargs and 'queue' in kwargs and kwargs['queue'] in ('gpu', 'lgpu', 'sgpu') and int(re.sub("\D", "", kwargs['gpumem'])) > 24:
-      logger.warn("This job will never be executed since the GPU queue '%s' cannot have more than 24GB of memory." % kwargs['queue'])
+      logger.warning("This job will never be executed since the GPU queue '%s' cannot have more than 24GB of memory." % kwargs['queue'])
 
     assert job.id == grid_id
     return job.unique
 
 
-  def submit(self, command_line, name = None, array = None, dependencies = [], exec_dir = None, log_dir = "logs", dry_run = False, verbosity = 0, stop_on_failure = False, **kwargs):
-    """Submits a job that will be executed in the grid."""
+  def submit(self, command_line, name = None, array = None, dependencies = [], exec_dir = None, log_dir = "logs", dry_run = False, verbosity = 0, stop_on_failure = False, compact_array = False, tasks_per_worker = None, packed_logs = False, max_attempts = None, retry_delay = None, retry_results = None, array_dependency = False, **kwargs):
+    """Submits a job that will be executed in the grid.
+    With ``array_dependency``, each task of the array job waits only for the tasks with the same index of the array jobs that it depends on (``qsub -hold_jid_ad``), which need to have the same array range and ``tasks_per_worker``.
+    Failing (array) jobs are run up to ``max_attempts`` times, see :py:class:`gridtk.models.Job` for the retry policy."""
     # add job to database
     self.lock()
-    job = add_job(self.session, command_line, name, dependencies, array, exec_dir=exec_dir, log_dir=log_dir, stop_on_failure=stop_on_failure, context=self.context, **kwargs)
+    job = add_job(self.session, command_line, name, dependencies, array, exec_dir=exec_dir, log_dir=log_dir, stop_on_failure=stop_on_failure, compact_array=compact_array, tasks_per_worker=tasks_per_worker, packed_logs=packed_logs, max_attempts=max_attempts, retry_delay=retry_delay, retry_results=retry_results, array_dependency=array_dependency, context=self.context, **kwargs)
     logger.info("Added job '%s' to the database." % job)
     if dry_run:
       print("Would have added the Job")
@@ -112,8 +120,47 @@ class JobManagerSGE(JobManager):
     return job_id
 
 
+  def submit_many(self, specs, dry_run = False, verbosity = 0):
+    """Submits many jobs at once, which are added to the database in a single transaction before they are submitted to the grid.
+    Each spec is a dictionary with the keyword arguments of :py:meth:`submit`, including the ``command_line``.
+    The ``batch_dependencies`` of a spec might contain the indexes of earlier specs in the list that this job depends on.
+    Returns the list of new job ids."""
+    keys = ('command_line', 'name', 'array', 'dependencies', 'batch_dependencies', 'exec_dir', 'log_dir', 'stop_on_failure', 'compact_array', 'tasks_per_worker', 'packed_logs', 'max_attempts', 'retry_delay', 'retry_results', 'array_dependency')
+    specs = [dict(spec) for spec in specs]
+    for index, spec in enumerate(specs):
+      spec.setdefault('log_dir', 'logs')
+      # the grid ids of the jobs that we depend on need to be known when submitting to the grid
+      if any(b >= index for b in spec.get('batch_dependencies', [])):
+        raise ValueError("Job number %d of the batch can only depend on jobs that are submitted before it" % index)
+
+    self.lock()
+    jobs = add_jobs(self.session, specs)
+    logger.info("Added %d jobs to the database." % len(jobs))
+    if dry_run:
+      for spec, job in zip(specs, jobs):
+        print("Would have added the Job")
+        print(job)
+        print("to the database to be executed in the grid with options:", str(dict((key, value) for key, value in spec.items() if key not in keys)))
+      self.session.rollback()
+      job_ids = [None] * len(jobs)
+
+    else:
+      self.session.commit()
+      job_ids = []
+      for spec, job in zip(specs, jobs):
+        kwargs = dict((key, value) for key, value in spec.items() if key not in keys)
+        dependencies = list(spec.get('dependencies', [])) + [jobs[b].unique for b in spec.get('batch_dependencies', [])]
+        job_ids.append(self._submit_to_grid(job, spec.get('name'), spec.get('array'), dependencies, spec['log_dir'], verbosity, **kwargs))
+        # commit after each job to avoid failures of not finding the job during execution in the grid
+        self.session.commit()
+
+    self.unlock()
+    return job_ids
+
+
   def communicate(self, job_ids = None):
-    """Communicates with the SGE grid (using qstat) to see if jobs are still running."""
+    """Communicates with the SGE grid (using qstat) to see if jobs are still running.
+    When a job with a retry policy has disappeared from the grid, each of its queued and executing (array) jobs fails one attempt, and the job is re-submitted (with its unfinished dependencies) if the retry policy queues any of them again; the grid starts it when their retry delays have passed."""
     self.lock()
     # iterate over all jobs
     jobs = self.get_jobs(job_ids)
@@ -121,14 +168,22 @@ class JobManagerSGE(JobManager):
       job.refresh()
       if job.status in ('queued', 'executing', 'waiting') and job.queue_name != 'local':
         status = qstat(job.id, context=self.context)
+        if len(status) == 0 and job.max_attempts:
+          # the grid stopped the job (e.g. due to a time-out) or lost it, so the (array) jobs that were running or waiting to be run failed
+          for array_id in (job.get_array_ids(('queued', 'executing')) if job.get_array() else [None] if job.status in ('queued', 'executing') else []):
+            job.finish(70, array_id) # ASCII: 'F'
+          if job.status == 'queued' or job.get_array() and job.get_array_ids(('queued',)):
+            retry_times = job.get_retry_times()
+            start_after = max(retry_times.values()) if retry_times else None
+            logger.warning("The job '%s' was not executed successfully (maybe a time-out happened); re-submitting it to retry its failed (array) jobs%s." % (job, " after %s" % start_after.ctime() if start_after is not None else ""))
+            dependencies = [dep.unique for dep in job.get_jobs_we_wait_for() if dep.status in ('submitted', 'queued', 'waiting', 'executing')]
+            self._submit_to_grid(job, job.name, job.get_array(), dependencies, job.log_dir, 0, start_after=start_after, **job.get_arguments())
+            continue
         if len(status) == 0:
           job.status = 'failure'
           job.result = 70 # ASCII: 'F'
-          logger.warn("The job '%s' was not executed successfully (maybe a time-out happened). Please check the log files." % job)
-          for array_job in job.array:
-            if array_job.status in ('queued', 'executing'):
-              array_job.status = 'failure'
-              array_job.result = 70 # ASCII: 'F'
+          logger.warning("The job '%s' was not executed successfully (maybe a time-out happened). Please check the log files." % job)
+          job.change_array_status(('queued', 'executing'), 'failure', 70) # ASCII: 'F'
 
 
     self.session.commit()
@@ -144,14 +199,14 @@ class JobManagerSGE(JobManager):
       if len(jobs) == 1:
         jobs[0].set_command_line(new_command)
       else:
-        logger.warn("Ignoring new command since no single job id was specified")
+        logger.warning("Ignoring new command since no single job id was specified")
     accepted_old_status = ('submitted', 'success', 'failure') if also_success else ('submitted', 'failure',)
     for job in jobs:
       # check if this job needs re-submission
       if running_jobs or job.status in accepted_old_status:
         grid_status = qstat(job.id, context=self.context)
         if len(grid_status) != 0:
-          logger.warn("Deleting job '%d' since it was still running in the grid." % job.unique)
+          logger.warning("Deleting job '%d' since it was still running in the grid." % job.unique)
           qdel(job.id, context=self.context)
         # re-submit job to the grid
         arguments = job.get_arguments()
@@ -160,13 +215,13 @@ class JobManagerSGE(JobManager):
           for arg in ('hvmem', 'pe_opt', 'io_big'):
             if arg in arguments:
               del arguments[arg]
-        job.set_arguments(kwargs=arguments)
+        job.set_arguments(**arguments)
         # delete old status and result of the job
         if not keep_logs:
           self.delete_logs(job)
         job.submit()
         if job.queue_name == 'local' and 'queue' not in arguments:
-          logger.warn("Re-submitting job '%s' locally (since no queue name is specified)." % job)
+          logger.warning("Re-submitting job '%s' locally (since no queue name is specified)." % job)
         else:
           deps = [dep.unique for dep in job.get_jobs_we_wait_for()]
           logger.debug("Re-submitting job '%s' with dependencies '%s' to the grid." % (job, deps))
@@ -177,18 +232,12 @@ class JobManagerSGE(JobManager):
     self.unlock()
 
 
-  def run_job(self, job_id, array_id = None):
-    """Overwrites the run-job command from the manager to extract the correct job id before calling base class implementation."""
-    # get the unique job id from the given grid id
-    self.lock()
-    jobs = list(self.session.query(Job).filter(Job.id == job_id))
+  def _unique_job_id(self, job_id):
+    """Returns the unique job id of the job with the given grid id."""
+    jobs = list(self.session.query(Job.unique).filter(Job.id == job_id))
     if len(jobs) != 1:
-      self.unlock()
       raise ValueError("Could not find job id '%d' in the database'" % job_id)
-    job_id = jobs[0].unique
-    self.unlock()
-    # call base class implementation with the corrected job id
-    return JobManager.run_job(self, job_id, array_id)
+    return jobs[0][0]
 
 
   def stop_jobs(self, job_ids):
@@ -288,6 +288,20 @@ class GridTKTest(unittest.TestCase):
       pass
 
 
+  def test03_submit_from_file(self):
+    # Errors in the lines of --from-file files are reported with their line number, and no job of the file is submitted
+    from gridtk.script import jman
+    submissions = os.path.join(self.temp_dir, 'jobs.txt')
+    with open(submissions, 'w') as f:
+      f.write("-n first -s A=1 -- /bin/true\n-n second --queue unknown /bin/true\n")
+    try:
+      jman.main([self.jman, '--local', '--database', self.database, 'submit', '--from-file', submissions])
+      self.fail("The invalid line was accepted")
+    except ValueError as e:
+      self.assertTrue(str(e).startswith("Line 2 of '%s'" % submissions))
+    self.assertFalse(os.path.exists(self.database))
+
+
   def notest02_grid(self):
     # Tests the functionality of the grid toolkit in the grid
     import nose
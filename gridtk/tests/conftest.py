@@ -0,0 +1,22 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+'''Fixtures that are shared by the tests'''
+
+import os
+
+import pytest
+
+from ..local import JobManagerLocal
+
+
+@pytest.fixture
+def database(tmp_path):
+  """The file name of a new job database in a temporary directory."""
+  return os.path.join(str(tmp_path), 'database.sql3')
+
+
+@pytest.fixture
+def job_manager(database):
+  """A local job manager of the new job database."""
+  return JobManagerLocal(database=database)
@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+'''Tests for the runtime history'''
+
+import os
+
+from ..history import RuntimeHistory, signature, median, ewma, choose_queue
+
+
+def test_predictors():
+  # runs with different numbers share their signature
+  assert signature(['/bin/train', '--seed', '3', '--rate', '0.1']) == signature(['/bin/train', '--seed', '12', '--rate', '1e-3'])
+  assert signature(['/bin/train']) != signature(['/bin/test'])
+  assert median([3., 1., 2.]) == 2.
+  assert median([4., 1., 2., 3.]) == 2.5
+  assert abs(ewma([10., 20.], alpha=0.5) - 15.) < 1e-9
+  assert choose_queue(3600) == 'q1d'
+  assert choose_queue(3 * 86400) == 'q1w'
+  assert choose_queue(60 * 86400) == 'q1m'
+  # parallel jobs need queues that support multi-threading
+  assert choose_queue(3600, parallel=True) == 'q1dm'
+  assert choose_queue(3 * 86400, parallel=True) == 'q1wm'
+  assert choose_queue(20 * 86400, parallel=True) == 'q1m'
+
+
+def test_runtime_history(tmp_path):
+  history = RuntimeHistory(os.path.join(str(tmp_path), 'history', 'history.sql3'), window=3)
+  assert history.predict('train', ['/bin/train', '1']) is None
+  history.record([('train', ['/bin/train', str(index)], runtime) for index, runtime in enumerate((100., 10., 20., 30.))])
+  history.record([('test', ['/bin/test'], 5.)])
+  # the oldest run is outside of the window
+  assert history.runtimes('train', ['/bin/train', '7']) == [10., 20., 30.]
+  assert history.predict('train', ['/bin/train', '7']) == 20.
+  # other command lines of the same job name fall back to the runs of the name
+  assert RuntimeHistory(history.filename, window=3).predict('train', ['/bin/train', '--other']) == 20.
+  assert history.predict(None, ['/bin/test']) is None
+  assert history.predict('test', ['/bin/test']) == 5.
@@ -0,0 +1,508 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+'''Tests for the local scheduler'''
+
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+
+from ..local import JobManagerLocal
+from ..models import usage_statistics
+
+
+def test_event_driven_scheduler(tmp_path, job_manager, database):
+  temp_dir = str(tmp_path)
+  first = job_manager.submit(['/bin/sleep', '0.1'], log_dir=temp_dir)
+  array = job_manager.submit(['/bin/echo', 'hello'], array=(1, 4, 1), dependencies=[first], log_dir=temp_dir)
+  failing = job_manager.submit(['/bin/false'], dependencies=[array], log_dir=temp_dir)
+
+  # the scheduler dies when all jobs have finished, even though it does not check the database periodically
+  failures = job_manager.run_scheduler(parallel_jobs=2, die_when_finished=True, sleep_time=60, event_driven=True)
+  assert failures == [failing]
+
+  job_manager.lock()
+  assert [job.status for job in job_manager.get_jobs()] == ['success', 'success', 'failure']
+  job_manager.unlock()
+
+
+def test_scheduler_picks_up_new_jobs(tmp_path, job_manager, database):
+  temp_dir = str(tmp_path)
+  first = job_manager.submit(['/bin/sleep', '2'], log_dir=temp_dir)
+
+  failures = []
+  scheduler = threading.Thread(target=lambda: failures.extend(JobManagerLocal(database=database).run_scheduler(parallel_jobs=2, die_when_finished=True)))
+  scheduler.start()
+  time.sleep(0.5)
+  # jobs that are submitted while the scheduler is running are added to its ready queue
+  second = job_manager.submit(['/bin/false'], log_dir=temp_dir)
+  scheduler.join()
+  assert failures == [second]
+
+  job_manager.lock()
+  assert [job.status for job in job_manager.get_jobs((first, second))] == ['success', 'failure']
+  job_manager.unlock()
+
+
+def test_direct_execution(tmp_path, job_manager):
+  temp_dir = str(tmp_path)
+  first = job_manager.submit(['/bin/pwd'], exec_dir=temp_dir, log_dir=temp_dir)
+  array = job_manager.submit(['/bin/sh', '-c', 'exit $((SGE_TASK_ID - 1))'], array=(1, 3, 1), dependencies=[first], log_dir=temp_dir)
+  missing = job_manager.submit([os.path.join(temp_dir, 'missing')], dependencies=[array], log_dir=temp_dir)
+
+  # the jobs are run without the wrapper script, with the same results
+  failures = job_manager.run_scheduler(parallel_jobs=2, die_when_finished=True, direct=True, event_driven=True)
+  assert failures == [array]
+
+  job_manager.lock()
+  jobs = job_manager.get_jobs()
+  assert [job.status for job in jobs] == ['success', 'failure', 'failure']
+  # the array job has the result of the array job that failed first
+  assert (jobs[0].result, jobs[1].result in (1, 2), jobs[2].result) == (0, True, 69)
+  assert jobs[0].machine_name is not None
+  assert [(array_job.status, array_job.result) for array_job in jobs[1].get_array_jobs()] == [('success', 0), ('failure', 1), ('failure', 2)]
+  job_manager.unlock()
+  assert open(os.path.join(temp_dir, 'job.o%d' % first)).read().strip() == os.path.realpath(temp_dir)
+
+
+def test_direct_execution_of_missing_commands(tmp_path, job_manager):
+  temp_dir = str(tmp_path)
+  missing = job_manager.submit(['./missing'], exec_dir=temp_dir)
+  dependent = job_manager.submit(['/bin/true'], dependencies=[missing])
+  array = job_manager.submit(['./missing'], array=(1, 3, 1), exec_dir=temp_dir)
+
+  # the jobs that cannot be executed are finished, and the scheduler goes on with the jobs that they release
+  job_manager.run_scheduler(parallel_jobs=2, die_when_finished=True, direct=True, event_driven=True)
+  job_manager.lock()
+  jobs = job_manager.get_jobs((missing, dependent, array))
+  assert [(job.status, job.result) for job in jobs] == [('failure', 69), ('success', 0), ('failure', 69)]
+  assert [(array_job.status, array_job.result) for array_job in jobs[2].get_array_jobs()] == [('failure', 69)] * 3
+  job_manager.unlock()
+
+
+def test_resource_aware_scheduling(job_manager):
+  big_memory = job_manager.submit(['/bin/sleep', '1'], memfree='4G')
+  waiting = job_manager.submit(['/bin/true'], pe_opt='pe_mth 2', memfree='2G')
+  small = job_manager.submit(['/bin/true'])
+  parallel = job_manager.submit(['/bin/true'], pe_opt='pe_mth 2')
+
+  job_manager.lock()
+  assert job_manager.get_jobs((waiting,))[0].get_resources() == (2, 2 * 1024 ** 3)
+  job_manager.unlock()
+
+  assert job_manager.run_scheduler(parallel_jobs=4, die_when_finished=True, direct=True, cores=4, memory='4G') == []
+
+  job_manager.lock()
+  jobs = dict((job.unique, job) for job in job_manager.get_jobs())
+  # the small job fills the gap, while the other jobs wait for the memory and the cores that are reserved for the waiting job
+  assert jobs[small].start_time < jobs[big_memory].finish_time
+  assert jobs[waiting].start_time >= jobs[big_memory].finish_time
+  assert jobs[parallel].start_time >= jobs[big_memory].finish_time
+  job_manager.unlock()
+
+
+def test_priority_and_fair_share(job_manager):
+  sweep = [job_manager.submit(['/bin/true'], name='sweep') for _ in range(4)]
+  other = [job_manager.submit(['/bin/true'], name='other') for _ in range(2)]
+  urgent = job_manager.submit(['/bin/true'], name='urgent', priority=5)
+  # the priority can be changed when re-submitting
+  job_manager.resubmit((other[1],), priority=-1)
+
+  def start_order():
+    job_manager.lock()
+    jobs = sorted(job_manager.get_jobs(), key=lambda job: job.start_time)
+    job_manager.unlock()
+    return [job.unique for job in jobs]
+
+  assert job_manager.run_scheduler(parallel_jobs=1, die_when_finished=True, direct=True) == []
+  assert start_order() == [urgent] + sweep + other[:1] + other[1:]
+
+  job_manager.resubmit(also_success=True)
+  assert job_manager.run_scheduler(parallel_jobs=1, die_when_finished=True, direct=True, fair_share={'sweep' : 2}) == []
+  # two sweep jobs are started for every other job
+  assert start_order() == [urgent, sweep[0], other[0], sweep[1], sweep[2], sweep[3], other[1]]
+
+
+def test_concurrent_schedulers(tmp_path, job_manager, database):
+  temp_dir = str(tmp_path)
+  started = os.path.join(temp_dir, 'started')
+  command = ['/bin/sh', '-c', 'echo $JOB_ID.$SGE_TASK_ID >> %s' % started]
+  for _ in range(10):
+    job_manager.submit(command)
+  job_manager.submit(command, array=(1, 10, 1))
+  job_manager.submit(command, array=(1, 10, 1), compact_array=True)
+
+  # two schedulers run the jobs of the same database at the same time
+  schedulers = [threading.Thread(target=JobManagerLocal(database=database).run_scheduler, kwargs=dict(parallel_jobs=3, die_when_finished=True, direct=True)) for _ in range(2)]
+  for scheduler in schedulers:
+    scheduler.start()
+  for scheduler in schedulers:
+    scheduler.join()
+
+  # each (array) job has been started exactly once
+  with open(started) as f:
+    lines = f.read().split()
+  assert len(lines) == 30
+  assert len(set(lines)) == 30
+  job_manager.lock()
+  assert [job.status for job in job_manager.get_jobs()] == ['success'] * 12
+  job_manager.unlock()
+
+
+def _scheduler(database):
+  JobManagerLocal(database=database).run_scheduler(parallel_jobs=1, sleep_time=0.1)
+
+
+def test_stop_one_of_two_schedulers(tmp_path, job_manager, database):
+  started = os.path.join(str(tmp_path), 'started')
+  job_id = job_manager.submit(['/bin/sh', '-c', 'echo >> %s; sleep 60' % started])
+  queued = job_manager.submit(['/bin/sh', '-c', 'sleep 60'], dependencies=[job_id])
+
+  # the first scheduler runs the job, the second one waits for the queued job
+  schedulers = [multiprocessing.Process(target=_scheduler, args=(database,)) for _ in range(2)]
+  try:
+    schedulers[0].start()
+    start = time.time()
+    while not os.path.exists(started) and time.time() - start < 30:
+      time.sleep(0.1)
+    schedulers[1].start()
+    time.sleep(2)
+
+    # interrupting the second scheduler does not reset the job of the first one
+    os.kill(schedulers[1].pid, signal.SIGINT)
+    schedulers[1].join()
+    job_manager.lock(write=False)
+    job = job_manager.get_jobs((job_id,))[0]
+    status, claimed_by = job.status, job.claimed_by
+    job_manager.unlock()
+    assert status == 'executing'
+    assert claimed_by.endswith(':%d' % schedulers[0].pid)
+  finally:
+    for scheduler in schedulers:
+      if scheduler.is_alive():
+        os.kill(scheduler.pid, signal.SIGINT)
+        scheduler.join()
+
+  # the first scheduler has reset its own job when it was interrupted
+  job_manager.lock(write=False)
+  assert [(job.status, job.claimed_by) for job in job_manager.get_jobs((job_id, queued))] == [('submitted', None), ('submitted', None)]
+  job_manager.unlock()
+
+
+def test_tasks_per_worker(tmp_path, job_manager):
+  temp_dir = str(tmp_path)
+  started = os.path.join(temp_dir, 'started')
+  # each task writes its task id and the process id of the wrapper that runs it
+  job_id = job_manager.submit(['/bin/sh', '-c', 'echo $SGE_TASK_ID $PPID >> %s; test $SGE_TASK_ID != 5' % started], array=(1, 10, 1), tasks_per_worker=4, log_dir=temp_dir)
+
+  assert job_manager.run_scheduler(parallel_jobs=2, die_when_finished=True) == [job_id]
+
+  with open(started) as f:
+    tasks = [line.split() for line in f]
+  assert sorted(int(array_id) for array_id, _ in tasks) == list(range(1, 11))
+  # three wrappers ran the array jobs 1-4, 5-8 and 9-10
+  assert len(set(pid for _, pid in tasks)) == 3
+  job_manager.lock()
+  job = job_manager.get_jobs((job_id,))[0]
+  assert (job.status, job.array_success, job.array_failure) == ('failure', 9, 1)
+  assert [array_job.id for array_job in job.get_array_jobs(('failure',))] == [5]
+  job_manager.unlock()
+
+
+def _divide(a, b):
+  return a / b
+
+
+def test_submit_callable(job_manager):
+  quotient = job_manager.submit_callable(_divide, 6, 3)
+  failing = job_manager.submit_callable(_divide, 1, 0, dependencies=[quotient])
+  command = job_manager.submit(['/bin/true'], dependencies=[quotient])
+
+  assert job_manager.run_scheduler(parallel_jobs=2, die_when_finished=True, event_driven=True, preload=['json']) == [failing]
+
+  assert job_manager.get_result(quotient) == 2
+  try:
+    job_manager.get_result(failing)
+    assert False, "the exception of the call was not raised"
+  except RuntimeError as e:
+    assert 'ZeroDivisionError' in str(e)
+  job_manager.lock()
+  jobs = job_manager.get_jobs((quotient, failing, command))
+  assert [(job.status, job.result) for job in jobs] == [('success', 0), ('failure', 1), ('success', 0)]
+  assert jobs[0].get_command_line() == ['gridtk.tests.test_local._divide(6, 3)']
+  job_manager.unlock()
+
+
+def test_packed_logs(tmp_path, job_manager):
+  temp_dir = str(tmp_path)
+  log_dir = os.path.join(temp_dir, 'logs')
+  command = ['/bin/sh', '-c', 'echo out $SGE_TASK_ID; echo err $SGE_TASK_ID >&2']
+  wrapped = job_manager.submit(command, name='wrapped', array=(1, 5, 1), tasks_per_worker=2, log_dir=log_dir, packed_logs=True)
+  assert job_manager.run_scheduler(parallel_jobs=2, die_when_finished=True) == []
+  direct = job_manager.submit(command, name='direct', log_dir=log_dir, packed_logs=True)
+  assert job_manager.run_scheduler(parallel_jobs=2, die_when_finished=True, direct=True) == []
+
+  # each job has one segment and one index file
+  assert sorted(os.listdir(log_dir)) == ['direct.l%d' % direct, 'direct.l%d.index' % direct, 'wrapped.l%d' % wrapped, 'wrapped.l%d.index' % wrapped]
+  job_manager.lock(write=False)
+  job, = job_manager.get_jobs((wrapped,))
+  assert [job.get_packed_log().read(array_id, 'out') for array_id in range(1, 6)] == [b'out %d\n' % array_id for array_id in range(1, 6)]
+  assert job.get_packed_log().read(3, 'err') == b'err 3\n'
+  assert job_manager.get_jobs((direct,))[0].get_packed_log().read(None, 'out') == b'out undefined\n'
+  job_manager.unlock()
+
+  # deleted array jobs are marked as deleted, and re-submitted jobs add their new logs
+  job_manager.delete([wrapped], array_ids=[2, 3])
+  job_manager.resubmit([direct], also_success=True, keep_logs=True)
+  job_manager.lock(write=False)
+  log = job_manager.get_jobs((wrapped,))[0].get_packed_log()
+  assert [log.read(array_id, 'out') for array_id in range(1, 6)] == [b'out 1\n', None, None, b'out 4\n', b'out 5\n']
+  job_manager.unlock()
+
+  # deleting the job removes the whole packed log
+  job_manager.delete([wrapped])
+  assert sorted(os.listdir(log_dir)) == ['direct.l%d' % direct, 'direct.l%d.index' % direct]
+
+
+def test_resource_usage(capfd, job_manager):
+  # each task allocates 100 MB of memory (more than the wrapper, whose memory is counted, too), and uses some CPU time
+  command = [sys.executable, '-c', 'x = bytearray(100 * 1024 * 1024); sum(range(1000000))']
+  array = job_manager.submit(command, name='array', array=(1, 3, 1), tasks_per_worker=2)
+  job_manager.run_scheduler(parallel_jobs=2, die_when_finished=True)
+  direct = job_manager.submit(command, name='direct')
+  job_manager.run_scheduler(parallel_jobs=2, die_when_finished=True, direct=True)
+
+  job_manager.lock(write=False)
+  jobs = job_manager.get_jobs((array, direct))
+  usages = [array_job.get_usage() for array_job in jobs[0].get_array_jobs()] + [jobs[1].get_usage()]
+  for usage in usages:
+    assert usage['max_rss'] > 100 * 1024 * 1024
+    assert usage['user_time'] + usage['system_time'] > 0
+  # the usage of the array jobs is added up, except for the maximum RSS
+  assert abs(jobs[0].user_time - sum(usage['user_time'] for usage in usages[:3])) < 1e-6
+  assert jobs[0].max_rss == max(usage['max_rss'] for usage in usages[:3])
+  statistics = usage_statistics(usages[:3])
+  assert statistics['max_rss'] == tuple(sorted(usage['max_rss'] for usage in usages[:3]))
+  job_manager.unlock()
+
+  # the summary shows how many (array) jobs its statistics are based on
+  capfd.readouterr()
+  job_manager.submit(command, name='direct')
+  job_manager.list(None, print_resources=True)
+  summary = capfd.readouterr()[0].rsplit("job-name", 1)[1].splitlines()
+  assert summary[2].split()[:2] == ['array', '3/3']
+  assert [line.split()[:2] for line in summary if line.startswith('direct')] == [['direct', '1/2']]
+  assert summary[-1].startswith("Only the (array) jobs with a recorded usage are counted")
+
+  # re-submitted jobs forget their usage
+  job_manager.resubmit([array], also_success=True)
+  job_manager.lock(write=False)
+  job = job_manager.get_jobs((array,))[0]
+  assert job.get_usage() is None and all(array_job.get_usage() is None for array_job in job.get_array_jobs())
+  job_manager.unlock()
+
+
+def test_walltime(tmp_path, job_manager):
+  temp_dir = str(tmp_path)
+  # the background process of the job would create the file after the job was stopped, if it were not stopped, too
+  marker = os.path.join(temp_dir, 'marker')
+  command = ['/bin/sh', '-c', '(sleep 2; touch %s) & sleep 60' % marker]
+  wrapped = job_manager.submit(command, array=(1, 2, 1), walltime=1)
+  finishing = job_manager.submit(['/bin/true'], walltime=60)
+
+  start = time.time()
+  assert job_manager.run_scheduler(parallel_jobs=3, die_when_finished=True, event_driven=True) == [wrapped]
+  direct = job_manager.submit(command, walltime=1)
+  assert job_manager.run_scheduler(parallel_jobs=3, die_when_finished=True, event_driven=True, direct=True) == [direct]
+  assert time.time() - start < 10
+
+  time.sleep(2)
+  assert not os.path.exists(marker)
+  job_manager.lock(write=False)
+  jobs = job_manager.get_jobs((wrapped, finishing, direct))
+  assert [(job.status, job.result) for job in jobs] == [('failure', 84), ('success', 0), ('failure', 84)]
+  assert [array_job.result for array_job in jobs[0].get_array_jobs()] == [84, 84]
+  job_manager.unlock()
+
+
+def test_retry(tmp_path, job_manager):
+  temp_dir = str(tmp_path)
+  # each array job counts its attempts; the second array job fails twice before it succeeds
+  counter = os.path.join(temp_dir, 'counter')
+  flaky = ['/bin/sh', '-c', 'echo >> %s.$SGE_TASK_ID; test $SGE_TASK_ID = 1 -o $(wc -l < %s.$SGE_TASK_ID) -ge 3' % (counter, counter)]
+  retried = job_manager.submit(flaky, array=(1, 2, 1), max_attempts=3, retry_delay=0.2)
+  # failures with other results are not retried
+  not_retried = job_manager.submit(['/bin/sh', '-c', 'exit 3'], max_attempts=3, retry_results=[4])
+  exhausted = job_manager.submit(['/bin/false'], max_attempts=2)
+
+  start = time.time()
+  assert job_manager.run_scheduler(parallel_jobs=2, die_when_finished=True, event_driven=True) == [not_retried, exhausted]
+  # the backoff of the second array job is 0.2 + 0.4 seconds
+  assert time.time() - start >= 0.6
+
+  job_manager.lock(write=False)
+  jobs = job_manager.get_jobs((retried, not_retried, exhausted))
+  assert [(job.status, job.result) for job in jobs] == [('success', 0), ('failure', 3), ('failure', 1)]
+  assert [(attempt.array_id, attempt.number, attempt.result) for attempt in sorted(jobs[0].attempts, key = lambda a: (a.array_id, a.number))] == [(1, 1, 0), (2, 1, 1), (2, 2, 1), (2, 3, 0)]
+  assert [attempt.result for attempt in jobs[1].attempts] == [3]
+  assert [attempt.result for attempt in jobs[2].attempts] == [1, 1]
+  job_manager.unlock()
+  assert [len(open(counter + '.%d' % i).readlines()) for i in (1, 2)] == [1, 3]
+
+  # the wrapper retries the failed (array) jobs itself when it is given the retry delay, e.g., in the grid
+  os.remove(counter + '.2')
+  job_manager.resubmit((retried,))
+  job_manager.run_job(retried, array_ids=[1, 2], retry_delay=0.1)
+  job_manager.lock(write=False)
+  job = job_manager.get_jobs((retried,))[0]
+  assert (job.status, job.result) == ('success', 0)
+  assert [attempt.result for attempt in job.attempts if attempt.array_id == 2] == [1, 1, 0]
+  job_manager.unlock()
+
+
+def _crashing_scheduler(database):
+  JobManagerLocal(database=database).run_scheduler(parallel_jobs=2, sleep_time=0.1)
+
+
+def test_adopt(tmp_path, job_manager, database):
+  temp_dir = str(tmp_path)
+  counters = [os.path.join(temp_dir, name) for name in ('adopted', 'gone')]
+  adopted = job_manager.submit(['/bin/sh', '-c', 'echo >> %s; sleep 2' % counters[0]])
+  # the job runs quickly when it is run again
+  gone = job_manager.submit(['/bin/sh', '-c', 'echo >> %s; test $(wc -l < %s) -ge 2 || sleep 60' % (counters[1], counters[1])])
+
+  # the scheduler crashes when both jobs are running
+  scheduler = multiprocessing.Process(target=_crashing_scheduler, args=(database,))
+  scheduler.start()
+  start = time.time()
+  while not all(os.path.exists(counter) for counter in counters) and time.time() - start < 30:
+    time.sleep(0.1)
+  os.kill(scheduler.pid, signal.SIGKILL)
+  scheduler.join()
+
+  # the process of the second job is gone, too
+  job_manager.lock(write=False)
+  jobs = job_manager.get_jobs((adopted, gone))
+  assert [job.status for job in jobs] == ['executing', 'executing']
+  assert all(job.pid is not None for job in jobs)
+  pid = jobs[1].pid
+  job_manager.unlock()
+  os.killpg(pid, signal.SIGKILL)
+
+  # the first job is adopted and finishes, the second job is run again
+  assert job_manager.run_scheduler(parallel_jobs=2, die_when_finished=True, event_driven=True, adopt=True) == []
+  assert [len(open(counter).readlines()) for counter in counters] == [1, 2]
+  job_manager.lock(write=False)
+  assert [(job.status, job.result) for job in job_manager.get_jobs((adopted, gone))] == [('success', 0), ('success', 0)]
+  job_manager.unlock()
+
+
+def _crashing_direct_scheduler(database):
+  JobManagerLocal(database=database).run_scheduler(parallel_jobs=3, sleep_time=0.1, direct=True)
+
+
+def test_adopt_direct(tmp_path, job_manager, database):
+  temp_dir = str(tmp_path)
+  counters = [os.path.join(temp_dir, name) for name in ('exited', 'failed', 'adopted')]
+  exited = job_manager.submit(['/bin/sh', '-c', 'echo >> %s; sleep 1' % counters[0]])
+  failed = job_manager.submit(['/bin/sh', '-c', 'echo >> %s; sleep 1; exit 3' % counters[1]])
+  adopted = job_manager.submit(['/bin/sh', '-c', 'echo >> %s; sleep 4' % counters[2]])
+
+  # the scheduler crashes when all jobs are running, and the first two jobs finish before the next scheduler starts
+  scheduler = multiprocessing.Process(target=_crashing_direct_scheduler, args=(database,))
+  scheduler.start()
+  start = time.time()
+  while not all(os.path.exists(counter) for counter in counters) and time.time() - start < 30:
+    time.sleep(0.1)
+  os.kill(scheduler.pid, signal.SIGKILL)
+  scheduler.join()
+  time.sleep(2)
+
+  # the jobs are finished with the exit status that their processes have recorded, and none of them is run again
+  job_manager.run_scheduler(parallel_jobs=3, die_when_finished=True, direct=True, event_driven=True, adopt=True)
+  assert [len(open(counter).readlines()) for counter in counters] == [1, 1, 1]
+  assert os.listdir(database + '.exit') == []
+  job_manager.lock(write=False)
+  assert [(job.status, job.result) for job in job_manager.get_jobs((exited, failed, adopted))] == [('success', 0), ('failure', 3), ('success', 0)]
+  job_manager.unlock()
+
+
+def test_array_dependency(job_manager):
+  # the third array job is slow, the second one fails
+  first = job_manager.submit(['/bin/sh', '-c', 'test $SGE_TASK_ID != 3 || sleep 2; test $SGE_TASK_ID != 2'], array=(1, 3, 1))
+  second = job_manager.submit(['/bin/true'], array=(1, 3, 1), dependencies=[first], array_dependency=True, stop_on_failure=True)
+
+  assert job_manager.run_scheduler(parallel_jobs=3, die_when_finished=True, event_driven=True) == [first, second]
+
+  job_manager.lock(write=False)
+  jobs = job_manager.get_jobs((first, second))
+  firsts, seconds = [dict((array_job.id, array_job) for array_job in job.get_array_jobs()) for job in jobs]
+  # the first array job of the second job did not wait for the slow array job
+  assert seconds[1].start_time < firsts[3].finish_time
+  assert [(seconds[i].status, seconds[i].result) for i in (1, 2, 3)] == [('success', 0), ('failure', None), ('success', 0)]
+  assert seconds[2].start_time is None
+  job_manager.unlock()
+
+
+def test_critical_path(job_manager):
+  # the independent job is submitted before the chain of jobs
+  independent = job_manager.submit(['/bin/true'])
+  chain = [job_manager.submit(['/bin/true'])]
+  for _ in range(2):
+    chain.append(job_manager.submit(['/bin/true'], dependencies=chain[-1:]))
+
+  assert job_manager.run_scheduler(parallel_jobs=1, die_when_finished=True, event_driven=True, direct=True, critical_path=True) == []
+  job_manager.lock(write=False)
+  jobs = job_manager.get_jobs([independent] + chain)
+  # the chain is started first, and the independent job is started when it is as long as the rest of the chain
+  order = [job.unique for job in sorted(jobs, key = lambda job: job.start_time)]
+  assert order[0] == chain[0]
+  assert order.index(chain[1]) < order.index(independent)
+  job_manager.unlock()
+
+
+def test_runtime_history(capsys, tmp_path):
+  from datetime import datetime, timedelta
+  temp_dir = str(tmp_path)
+  history = os.path.join(temp_dir, 'history.sql3')
+  job_manager = JobManagerLocal(database=os.path.join(temp_dir, 'first.sql3'), history=history)
+  job_manager.submit(['/bin/sleep', '0.2'], name='sleep', log_dir=temp_dir)
+  job_manager.submit(['/bin/sleep', '0.3'], name='sleep', array=(1,2,1), log_dir=temp_dir)
+  job_manager.submit(['/bin/false'], name='sleep', log_dir=temp_dir)
+  job_manager.run_scheduler(parallel_jobs=2, die_when_finished=True, event_driven=True, direct=True)
+
+  # the runs are known to the job managers of other databases, too; failed jobs are not recorded
+  job_manager = JobManagerLocal(database=os.path.join(temp_dir, 'second.sql3'), history=history)
+  assert len(job_manager._history.runtimes('sleep', ['/bin/sleep', '1'])) == 3
+  # the tasks of a worker record their own runtimes, not the time since the worker started
+  batch = job_manager.submit(['/bin/sleep', '0.2'], name='batch', array=(1,3,1), tasks_per_worker=3, log_dir=temp_dir)
+  job_manager.run_job(batch, array_ids=[1, 2, 3])
+  runtimes = job_manager._history.runtimes('batch', ['/bin/sleep', '1'])
+  assert len(runtimes) == 3 and max(runtimes) < 0.55
+  # and their own start and finish times
+  job_manager.lock()
+  array_jobs = job_manager.get_jobs((batch,))[0].get_array_jobs()
+  assert all(timedelta(seconds=0.2) <= array_job.finish_time - array_job.start_time < timedelta(seconds=0.55) for array_job in array_jobs)
+  assert array_jobs[0].finish_time <= array_jobs[1].start_time and array_jobs[1].finish_time <= array_jobs[2].start_time
+  job_manager.unlock()
+  job_manager._history.record([('long', ['/bin/sleep', '3600'], 3600.)])
+  job_id = job_manager.submit(['/bin/sleep', '3000'], name='long')
+  job_manager.lock()
+  job = job_manager.get_jobs((job_id,))[0]
+  assert job_manager.predict_runtime(job) == 3600.
+  job.execute()
+  job_manager.session.commit()
+  job_manager.unlock()
+
+  job_manager.list(None, print_eta=True)
+  assert "~60 min remaining for job %d" % job_id in capsys.readouterr()[0]
+  job_manager.lock()
+  job_manager.get_jobs((job_id,))[0].start_time = datetime.now() - timedelta(hours=2)
+  job_manager.session.commit()
+  job_manager.unlock()
+  job_manager.list(None, print_eta=True)
+  assert "Job %d runs longer than its predicted runtime of 60 min" % job_id in capsys.readouterr()[0]
+  job_manager.delete([job_id])
@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+'''Tests for the database schema and its migrations'''
+
+import os
+import pickle
+import sqlite3
+
+from ..models import Job, ArrayStates, IdSet, SCHEMA_VERSION, job_rows, change_counter, critical_path_lengths
+from ..local import JobManagerLocal
+
+
+# The tables as they were created by gridtk before the schema was versioned
+LEGACY_SCHEMA = (
+  'CREATE TABLE "Job" ("unique" INTEGER NOT NULL, command_line VARCHAR(255), name VARCHAR(20), queue_name VARCHAR(20), machine_name VARCHAR(10), grid_arguments VARCHAR(255), id INTEGER, exec_dir VARCHAR(255), log_dir VARCHAR(255), array_string VARCHAR(255), stop_on_failure BOOLEAN, submit_time DATETIME, start_time DATETIME, finish_time DATETIME, status VARCHAR(9), result INTEGER, PRIMARY KEY ("unique"))',
+  'CREATE TABLE "ArrayJob" ("unique" INTEGER NOT NULL, id INTEGER, job_id INTEGER, status VARCHAR(9), result INTEGER, machine_name VARCHAR(10), submit_time DATETIME, start_time DATETIME, finish_time DATETIME, PRIMARY KEY ("unique"), FOREIGN KEY(job_id) REFERENCES "Job" ("unique"))',
+  'CREATE TABLE "JobDependence" (id INTEGER NOT NULL, waiting_job_id INTEGER, waited_for_job_id INTEGER, PRIMARY KEY (id), FOREIGN KEY(waiting_job_id) REFERENCES "Job" ("unique"), FOREIGN KEY(waited_for_job_id) REFERENCES "Job" ("unique"))',
+)
+
+
+def _indexes(database, table):
+  connection = sqlite3.connect(database)
+  try:
+    return set(row[1] for row in connection.execute("PRAGMA index_list('%s')" % table))
+  finally:
+    connection.close()
+
+def _schema_version(database):
+  connection = sqlite3.connect(database)
+  try:
+    return connection.execute("SELECT version FROM SchemaVersion").fetchall()
+  finally:
+    connection.close()
+
+
+def test_new_database(job_manager, database):
+  job_manager.submit(['/bin/echo', 'hello'])
+
+  assert _schema_version(database) == [(SCHEMA_VERSION,)]
+  assert 'ix_Job_id' in _indexes(database, 'Job')
+  assert 'ix_ArrayJob_job_id_id' in _indexes(database, 'ArrayJob')
+
+  # the change counter is incremented when jobs are added or change their status, but not for other changes
+  job_manager.lock()
+  counter = change_counter(job_manager.session)
+  job = job_manager.get_jobs()[0]
+  job.machine_name = 'machine'
+  job_manager.session.flush()
+  assert change_counter(job_manager.session) == counter
+  job.queue()
+  job_manager.session.flush()
+  assert change_counter(job_manager.session) == counter + 1
+  # the job is stamped with the new value of the change counter
+  job_manager.session.refresh(job)
+  assert job.changed == counter + 1
+  job_manager.session.commit()
+  job_manager.unlock()
+  del job_manager
+
+
+def test_upgrade_legacy_database(database):
+  connection = sqlite3.connect(database)
+  for statement in LEGACY_SCHEMA:
+    connection.execute(statement)
+  connection.execute("INSERT INTO Job (\"unique\", id, name, queue_name, status, command_line, grid_arguments, array_string) VALUES (1, 1, 'legacy', 'q1d', 'success', ?, ?, ?)",
+      (pickle.dumps(['/bin/echo', 'hello']), pickle.dumps({'kwargs' : {'memfree' : '8G', 'pe_opt' : 'pe_mth 2', 'env' : ['A=B'], 'io_big' : False, 'sge_extra_args' : ''}}), pickle.dumps((1, 10, 2))))
+  connection.executemany("INSERT INTO ArrayJob (id, job_id, status, result) VALUES (?, 1, ?, ?)", [(1, 'success', 0), (3, 'failure', 2), (5, 'failure', 7), (7, 'executing', None), (9, 'queued', None)])
+  connection.commit()
+  connection.close()
+  assert not _indexes(database, 'Job')
+
+  job_manager = JobManagerLocal(database=database)
+  job_manager.lock()
+  jobs = job_manager.get_jobs()
+  assert [job.name for job in jobs] == ['legacy']
+  # the pickled values have been converted
+  assert jobs[0].get_command_line() == ['/bin/echo', 'hello']
+  assert jobs[0].get_array() == (1, 10, 2)
+  assert jobs[0].get_arguments() == {'memfree' : '8G', 'pe_opt' : 'pe_mth 2', 'env' : ['A=B'], 'sge_extra_args' : '', 'queue' : 'q1d'}
+  assert job_manager.session.query(Job).filter(Job.memfree == '8G').count() == 1
+  # the counters of array jobs have been computed
+  assert jobs[0].progress() == (3, 5)
+  assert (jobs[0].array_executing, jobs[0].array_result) == (1, 2)
+  assert change_counter(job_manager.session) == 0
+  job_manager.unlock()
+
+  assert _schema_version(database) == [(SCHEMA_VERSION,)]
+  assert set(('ix_Job_id', 'ix_Job_status')) <= _indexes(database, 'Job')
+  assert 'ix_ArrayJob_job_id_id' in _indexes(database, 'ArrayJob')
+  assert set(('ix_JobDependence_waiting_job_id', 'ix_JobDependence_waited_for_job_id')) <= _indexes(database, 'JobDependence')
+
+  # a second job manager does not need to migrate again
+  job_manager = JobManagerLocal(database=database)
+  job_manager.lock()
+  assert len(job_manager.get_jobs()) == 1
+  job_manager.unlock()
+  assert _schema_version(database) == [(SCHEMA_VERSION,)]
+
+
+def test_array_counters(job_manager, database):
+  job_id = job_manager.submit(['/bin/echo', 'hello'], array=(1, 5, 1))
+
+  job_manager.lock()
+  job = job_manager.get_jobs((job_id,))[0]
+  assert (job.array_submitted, job.progress()) == (5, (0, 5))
+  job.queue()
+  for array_id in (1, 2, 3, 4, 5):
+    job.execute(array_id)
+  # executing an array job twice does not change the counters
+  job.execute(1, 'machine')
+  assert (job.array_queued, job.array_executing) == (0, 5)
+  # the lowest array ids are read from the database
+  job_manager.session.expire(job, ['array'])
+  assert job.get_array_ids(('executing',), limit=2) == [1, 2]
+  assert job.get_array_ids(('executing',), array_ids=(4, 2, 9)) == [2, 4]
+  assert 'array' not in job.__dict__
+  job.finish(0, 1)
+  job.finish(0, 2)
+  job.finish(6, 3)
+  job.finish(0, 4)
+  job.refresh()
+  assert (job.status, job.progress()) == ('executing', (4, 5))
+  job.finish(0, 5)
+  assert (job.status, job.result, job.array_success, job.array_failure) == ('failure', 6, 4, 1)
+  job_manager.session.commit()
+  job_manager.unlock()
+
+
+def test_claim(job_manager, database):
+  job_ids = [job_manager.submit(['/bin/echo', 'hello']), job_manager.submit(['/bin/echo', 'hello'], array=(1, 3, 1)), job_manager.submit(['/bin/echo', 'hello'], array=(1, 3, 1), compact_array=True)]
+  other = JobManagerLocal(database=database)
+
+  job_manager.lock()
+  jobs = job_manager.get_jobs(job_ids)
+  # only queued jobs can be claimed
+  assert not jobs[0].claim(None, 'host:1')
+  for job in jobs:
+    job.queue()
+  assert jobs[0].claim(None, 'host:1')
+  assert jobs[1].claim(2, 'host:1')
+  assert jobs[2].claim(2, 'host:1')
+  assert [(job.status, job.array_queued) for job in jobs] == [('executing', None), ('executing', 2), ('executing', 2)]
+  job_manager.session.commit()
+  job_manager.unlock()
+
+  # the (array) jobs cannot be claimed a second time
+  other.lock()
+  jobs = other.get_jobs(job_ids)
+  assert not jobs[0].claim(None, 'host:2')
+  assert not jobs[1].claim(2, 'host:2')
+  assert not jobs[2].claim(2, 'host:2')
+  assert jobs[2].claim(3, 'host:2')
+  assert jobs[0].claimed_by == 'host:1'
+  assert [array_job.claimed_by for array_job in jobs[1].get_array_jobs(('executing',))] == ['host:1']
+  assert [(array_job.id, array_job.claimed_by) for array_job in jobs[2].get_array_jobs(('executing',))] == [(2, 'host:1'), (3, 'host:2')]
+  assert jobs[2].array_status == 'q1x2'
+  other.session.commit()
+  other.unlock()
+
+
+def test_submit_many(job_manager):
+  first = job_manager.submit(['/bin/echo', 'first'])
+  job_ids = job_manager.submit_many([
+    {'command_line' : ['/bin/echo', 'a'], 'name' : 'a', 'dependencies' : [first, 1000]},
+    {'command_line' : ['/bin/echo', 'b'], 'name' : 'b', 'array' : (1, 10, 3), 'batch_dependencies' : [0]},
+    {'command_line' : ['/bin/echo', 'c'], 'name' : 'c', 'dependencies' : [first], 'batch_dependencies' : [0, 1, 2]},
+  ])
+  assert job_ids == [first + 1, first + 2, first + 3]
+
+  job_manager.lock()
+  jobs = job_manager.get_jobs(job_ids)
+  assert [job.name for job in jobs] == ['a', 'b', 'c']
+  assert [job.id for job in jobs] == job_ids
+  assert [job.unique for job in jobs[0].get_jobs_we_wait_for()] == [first]
+  assert [job.unique for job in jobs[1].get_jobs_we_wait_for()] == [job_ids[0]]
+  assert [job.unique for job in jobs[2].get_jobs_we_wait_for()] == [first, job_ids[0], job_ids[1]]
+  assert [array_job.id for array_job in jobs[1].array] == [1, 4, 7, 10]
+  assert all(array_job.status == 'submitted' for array_job in jobs[1].array)
+  job_manager.unlock()
+
+
+def test_critical_path_lengths(job_manager):
+  # a chain of three jobs, where the second job also waits for an independent job, and a finished job
+  finished = job_manager.submit(['/bin/true'])
+  job_ids = job_manager.submit_many([
+    {'command_line' : ['/bin/sleep', '5'], 'dependencies' : [finished]},
+    {'command_line' : ['/bin/sleep', '1']},
+    {'command_line' : ['/bin/sleep', '2'], 'batch_dependencies' : [0, 1]},
+    {'command_line' : ['/bin/sleep', '3'], 'batch_dependencies' : [2]},
+  ])
+  job_manager.lock()
+  job_manager.get_jobs((finished,))[0].finish(0)
+  job_manager.session.commit()
+  assert critical_path_lengths(job_manager.session) == dict(zip(job_ids, (3, 3, 2, 1)))
+  lengths = critical_path_lengths(job_manager.session, lambda job: float(job.get_command_line()[1]))
+  assert lengths == dict(zip(job_ids, (10, 6, 5, 3)))
+  job_manager.unlock()
+
+
+def test_array_states():
+  states = ArrayStates.create(10, 'submitted')
+  assert states.encode() == 's10'
+  states.set(3, 'executing')
+  states.set(4, 'executing')
+  states.set(9, 'success')
+  assert states.encode() == 's3x2s4S1'
+  assert ArrayStates(states.encode()).encode() == states.encode()
+  assert len(states) == 10
+  assert states.get(4) == 'executing'
+  assert states.indexes('executing') == [3, 4]
+  assert states.indexes('submitted', limit=4) == [0, 1, 2, 5]
+  states.replace(('submitted', 'executing'), 'queued')
+  assert states.encode() == 'q9S1'
+  assert states.count('queued') == 9
+
+
+def test_id_set():
+  ids = IdSet([(10, 12), (1, 4), (5, 5), (20, 1000000), (8, 7)])
+  assert ids.intervals == [(1, 5), (10, 12), (20, 1000000)]
+  assert len(ids) == 999989
+  assert 5 in ids and 11 in ids and 500000 in ids
+  assert 0 not in ids and 6 not in ids and 13 not in ids and 1000001 not in ids
+  assert list(IdSet.from_ids([3, 1, 2, 7])) == [1, 2, 3, 7]
+  assert not IdSet()
+
+
+def test_compact_array_job(job_manager):
+  job_id = job_manager.submit(['/bin/echo', 'hello'], array=(1, 10000, 1), compact_array=True)
+
+  job_manager.lock()
+  job = job_manager.get_jobs((job_id,))[0]
+  assert job.is_compact()
+  assert not job.array
+  job.queue()
+  # the changed states are encoded only when the session is flushed
+  assert job.get_array_ids(('queued',))[-1] == 10000
+  job_manager.session.flush()
+  assert job.array_status == 'q10000'
+  job.execute(5, 'machine')
+  job.execute(6, 'machine')
+  job.finish(0, 5)
+  job.finish(3, 6)
+  job_manager.session.commit()
+  job_manager.unlock()
+
+  job_manager.lock()
+  job = job_manager.get_jobs((job_id,))[0]
+  # only the failed array job is stored in the database
+  assert job.array_status == 'q4S1F1q9994'
+  assert [(array_job.id, array_job.result) for array_job in job.array] == [(6, 3)]
+  assert job.get_array_job(5).status == 'success'
+  assert job.get_array_job(6).machine_name == 'machine'
+  assert job.get_array_job(7).status == 'queued'
+  assert len(job.get_array_ids(('queued',))) == 9998
+  assert job.get_array_ids(('queued', 'failure'), limit=6) == [1, 2, 3, 4, 6, 7]
+  # only the states of the requested array jobs are looked up
+  assert job.get_array_ids(('queued', 'failure'), array_ids=(7, 5, 6, 7, 20000)) == [6, 7]
+  assert [array_job.id for array_job in job.get_array_jobs(('success', 'failure'))] == [5, 6]
+  assert job.progress() == (2, 10000)
+  assert (job.array_queued, job.array_result) == (9998, 3)
+
+  # finishing all other array jobs finishes the job with the result of the failed array job
+  job.change_array_status(('queued',), 'success')
+  job.finish(0, -1)
+  assert (job.status, job.result) == ('failure', 3)
+  job_manager.session.commit()
+  job_manager.unlock()
+
+
+def test_job_rows(job_manager):
+  job_ids = job_manager.submit_many([
+    {'command_line' : ['/bin/echo', 'a'], 'name' : 'a'},
+    {'command_line' : ['/bin/echo', 'b'], 'name' : 'b', 'array' : (1, 3, 1), 'batch_dependencies' : [0]},
+    {'command_line' : ['/bin/echo', 'c'], 'name' : 'c', 'array' : (1, 5, 1), 'compact_array' : True, 'batch_dependencies' : [0, 1]},
+  ])
+
+  job_manager.lock()
+  jobs = job_manager.get_jobs(job_ids)
+  jobs[0].status = 'failure'
+  jobs[1].queue()
+  for array_id in (1, 2, 3):
+    jobs[1].execute(array_id)
+    jobs[1].finish(0, array_id)
+  jobs[1].status = 'executing'
+  job_manager.session.commit()
+  for job in jobs:
+    job.refresh()
+  expected = [job.format("{} {} {} {} {} {} {} {}", 20) for job in jobs]
+
+  # the rows are streamed in batches, and the executing array job that has finished is refreshed
+  rows = list(job_rows(job_manager.session, dependencies=True, batch_size=2))
+  assert [row.format("{} {} {} {} {} {} {} {}", 20) for row in rows] == expected
+  assert [row.unique for row in job_rows(job_manager.session, status=('success', 'failure'))] == job_ids[:2]
+  assert [row.unique for row in job_rows(job_manager.session, job_ids=job_ids[1:], names=('a', 'c'))] == job_ids[2:]
+  assert [row.unique for row in job_rows(job_manager.session, job_ids=IdSet([(job_ids[1], 1000000)]))] == job_ids[1:]
+  assert [array_job.id for array_job in job_manager.get_jobs(IdSet([(job_ids[0], 1000000)]))[1].get_array_jobs(array_ids=IdSet([(2, 100000)]))] == [2, 3]
+
+  rows = list(job_rows(job_manager.session, job_ids=job_ids[1:], array_jobs=True, batch_size=1))
+  assert [array_job.format("{} {} {} {}") for array_job in rows[0].get_array_jobs()] == [array_job.format("{} {} {} {}") for array_job in jobs[1].get_array_jobs()]
+  assert [(array_job.id, array_job.status) for array_job in rows[1].get_array_jobs()] == [(array_id, 'submitted') for array_id in range(1, 6)]
+  job_manager.unlock()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# vim: set fileencoding=utf-8 :
+
+'''Tests for the state server'''
+
+import os
+import socket
+import threading
+import time
+
+import nose.tools
+
+from ..local import JobManagerLocal
+from ..server import StateServer, StateClient, read_token, token_file
+
+
+def test_state_server(tmp_path, job_manager, database):
+  address = os.path.join(str(tmp_path), 'server.sock')
+  job_ids = [job_manager.submit(['/bin/echo', 'hello']), job_manager.submit(['/bin/echo', 'hello'], array=(1, 3, 1))]
+
+  server = StateServer(JobManagerLocal(database=database), address)
+  thread = threading.Thread(target=server.serve_forever)
+  thread.start()
+  try:
+    for _ in range(100):
+      if os.path.exists(address): break
+      time.sleep(0.1)
+    # clients need the token of the server
+    nose.tools.assert_raises(RuntimeError, StateClient(address).request, 'list')
+    client = StateClient(address, token=read_token(token_file(job_manager.database)))
+    assert [job['unique'] for job in client.request('list')] == job_ids
+
+    assert client.request('execute', job_id=job_ids[0], machine_name='machine') == [['/bin/echo', 'hello'], None]
+    assert client.request('finish', job_id=job_ids[0], result=0) == []
+    for array_id in (1, 2, 3):
+      client.request('execute', job_id=job_ids[1], array_id=array_id)
+      client.request('finish', job_id=job_ids[1], array_id=array_id, result=array_id-1)
+
+    # the summaries of the server are up to date
+    assert [(job['unique'], job['status']) for job in client.request('list', status=['failure'])] == [(job_ids[1], 'failure')]
+    assert client.request('list', job_ids=[[job_ids[1], job_ids[1]]])[0]['fields'][4] == '3/3'
+    nose.tools.assert_raises(RuntimeError, client.request, 'unknown')
+  finally:
+    server.shutdown()
+    thread.join()
+
+  # the server has written the events to the database
+  job_manager.lock()
+  jobs = job_manager.get_jobs()
+  assert [(job.status, job.result) for job in jobs] == [('success', 0), ('failure', 2)]
+  job_manager.unlock()
+
+  # clients cannot connect any more
+  assert not os.path.exists(address)
+  assert not os.path.exists(token_file(job_manager.database))
+  nose.tools.assert_raises(socket.error, StateClient(address).request, 'list')
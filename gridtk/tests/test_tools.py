@@ -1,4 +1,4 @@
-from ..tools import get_array_job_slice
+from ..tools import get_array_job_slice, memory_in_bytes, walltime_in_seconds
 import os
 
 
@@ -60,3 +60,25 @@ def test_get_array_job_slice():
         wrapper.set("SGE_TASK_ID", 5)
         s = get_array_job_slice(10)
         assert s == slice(8, 10)
+
+
+def test_memory_in_bytes():
+    assert memory_in_bytes("8G") == 8 * 1024 ** 3
+    assert memory_in_bytes("512m") == 512 * 1024 ** 2
+    assert memory_in_bytes("1.5GB") == 3 * 1024 ** 3 // 2
+    assert memory_in_bytes("2") == 2 * 1024 ** 3
+
+
+def test_walltime_in_seconds():
+    assert walltime_in_seconds(3600) == 3600
+    assert walltime_in_seconds('90m') == 5400
+    assert walltime_in_seconds('1.5h') == 5400
+    assert walltime_in_seconds('2:30:00') == 9000
+    assert walltime_in_seconds('1:30') == 90
+    for invalid in ('1:x', '1:2:3:4', '5 minutes'):
+        try:
+            walltime_in_seconds(invalid)
+            assert False, "'%s' was accepted" % invalid
+        except ValueError:
+            pass
+
@@ -7,12 +7,15 @@
 probing.
 """
 
+import errno
 import os
 import re
 import hashlib
 import random
 import math
 import shlex
+import signal
+import time
 
 # sqlalchemy migration; copied from Bob
 try:
@@ -72,6 +75,122 @@ if sys.version_info < (2,7):
 # Constant regular expressions
 QSTAT_FIELD_SEPARATOR = re.compile(':\s+')
 
+def memory_in_bytes(memory):
+  """Returns the number of bytes of the given memory specification, e.g., ``'8G'`` or ``'512M'``; numbers without unit are in GB."""
+  match = re.match(r'^\s*(\d+(?:\.\d*)?)\s*([KMGT]?)B?\s*$', str(memory), re.IGNORECASE)
+  if match is None:
+    raise ValueError("Could not interpret the memory specification '%s'" % memory)
+  number, unit = match.groups()
+  return int(float(number) * 1024 ** ('KMGT'.index(unit.upper() or 'G') + 1))
+
+
+def walltime_in_seconds(walltime):
+  """Returns the number of seconds of the given walltime specification, e.g., ``'2:30:00'`` (hours, minutes and seconds), ``'90m'`` or ``'3600'``; numbers without unit are in seconds."""
+  if ':' in str(walltime):
+    parts = str(walltime).strip().split(':')
+    if len(parts) > 3 or not all(part.isdigit() for part in parts):
+      raise ValueError("Could not interpret the walltime specification '%s'" % walltime)
+    return sum(int(part) * 60 ** index for index, part in enumerate(reversed(parts)))
+  match = re.match(r'^\s*(\d+(?:\.\d*)?)\s*([smhd]?)\s*$', str(walltime), re.IGNORECASE)
+  if match is None:
+    raise ValueError("Could not interpret the walltime specification '%s'" % walltime)
+  number, unit = match.groups()
+  return int(float(number) * {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}[unit.lower()])
+
+
+def format_memory(memory):
+  """Returns a short string for the given number of bytes, e.g., ``'1.5G'``, in the units of :py:func:`memory_in_bytes`."""
+  for exponent, unit in reversed(list(enumerate('KMGT', 1))):
+    if memory >= 1024 ** exponent:
+      return "%.1f%s" % (float(memory) / 1024 ** exponent, unit)
+  return "%dB" % memory
+
+
+# The fields of the resource usage of a process, see :py:func:`wait_process`
+USAGE_FIELDS = ('user_time', 'system_time', 'max_rss', 'block_input', 'block_output', 'context_switches')
+
+def wait_process(process, block = True):
+  """Waits for the given :py:class:`subprocess.Popen` process to finish (or only checks whether it has finished, when not blocking), using :py:func:`os.wait4`, so that the resource usage of the process is obtained from the kernel.
+  Returns the return code of the process and a dictionary with the :py:data:`USAGE_FIELDS` (CPU times in seconds, the maximum resident set size in bytes, the number of block I/O operations and of context switches), or None if the process is still running.
+  The usage is None if the process has been waited for already."""
+  if process.returncode is not None:
+    return process.returncode, None
+  try:
+    pid, status, rusage = os.wait4(process.pid, 0 if block else os.WNOHANG)
+  except OSError:
+    # the process has been waited for somewhere else
+    return (process.wait() if block else process.poll()), None
+  if pid == 0:
+    return None
+  process.returncode = -os.WTERMSIG(status) if os.WIFSIGNALED(status) else os.WEXITSTATUS(status)
+  usage = {
+    'user_time' : rusage.ru_utime,
+    'system_time' : rusage.ru_stime,
+    # the maximum resident set size is given in kilobytes, except on macOS
+    'max_rss' : rusage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024),
+    'block_input' : rusage.ru_inblock,
+    'block_output' : rusage.ru_oublock,
+    'context_switches' : rusage.ru_nvcsw + rusage.ru_nivcsw,
+  }
+  return process.returncode, usage
+
+
+# The result of jobs that have been stopped since they exceeded their walltime
+WALLTIME_EXCEEDED = 84 # ASCII 'T'
+
+# The number of seconds that processes have to exit after SIGTERM, before they are killed with SIGKILL
+TERMINATE_TIMEOUT = 10
+
+def signal_process_group(process, signum):
+  """Sends the given signal to the process group of the given :py:class:`subprocess.Popen` process, which needs to be started in its own session (``start_new_session = True``), so that the children of the process receive the signal, too."""
+  try:
+    os.killpg(process.pid, signum)
+  except OSError:
+    # all processes of the group have exited already
+    pass
+
+def terminate_process_group(process, timeout = TERMINATE_TIMEOUT):
+  """Terminates the process group of the given process (see :py:func:`signal_process_group`) with SIGTERM, and kills it with SIGKILL when the process has not exited after the given timeout.
+  The process needs to be waited for elsewhere, e.g., in another thread."""
+  signal_process_group(process, signal.SIGTERM)
+  deadline = time.time() + timeout
+  while process.returncode is None and time.time() < deadline:
+    time.sleep(0.1)
+  # the remaining processes of the group are killed, too
+  signal_process_group(process, signal.SIGKILL)
+
+
+def _process_stat(pid):
+  """Returns the state and the start time of the process with the given id from the /proc file system, or None if they cannot be read."""
+  try:
+    with open('/proc/%d/stat' % pid) as stat:
+      # the name of the process (in parentheses) might contain spaces
+      fields = stat.read().rpartition(')')[2].split()
+    return fields[0], int(fields[19])
+  except (IOError, OSError, IndexError, ValueError):
+    return None
+
+def process_start_time(pid):
+  """Returns the start time of the process with the given id (in clock ticks after the boot of the machine), which identifies the process together with its id, or None if it is not known (e.g. on systems without /proc file system)."""
+  stat = _process_stat(pid)
+  return stat[1] if stat is not None else None
+
+def process_alive(pid, start_time = None):
+  """Returns True if the process with the given id is running.
+  When the start time of the process is given (see :py:func:`process_start_time`), a different process that has got the same id is not taken for it.
+  Zombie processes, which have exited but have not been waited for, are not alive."""
+  try:
+    os.kill(pid, 0)
+  except OSError as e:
+    # the process might belong to another user
+    if e.errno != errno.EPERM:
+      return False
+  stat = _process_stat(pid)
+  if stat is None:
+    return True
+  return stat[0] not in ('Z', 'X') and (start_time is None or stat[1] == start_time)
+
+
 def makedirs_safe(fulldir):
   """Creates a directory if it does not exists. Takes into consideration
   concurrent access support. Works like the shell's 'mkdir -p'.
@@ -98,7 +217,8 @@ def str_(name):
 def qsub(command, queue=None, cwd=True, name=None, deps=[], stdout='',
     stderr='', env=[], array=None, context='grid', hostname=None,
     memfree=None, hvmem=None, gpumem=None, pe_opt=None, io_big=False,
-    sge_extra_args=""):
+    sge_extra_args="", priority=None, walltime=None, array_dependency=False,
+    start_after=None):
   """Submits a shell job to a given grid queue
 
   Keyword parameters:
@@ -188,6 +308,23 @@ def qsub(command, queue=None, cwd=True, name=None, deps=[], stdout='',
     used in `qsub` command. For example, `jman submit -e "-P project_name -l pytorch=true" -- ...` will
     be translated to `qsub -P project_name -l pytorch=true -- ...`
 
+  priority
+    If set, the priority of the job relative to the other jobs of the user
+    (cf. qsub -p <...>)
+
+  walltime
+    If set, the maximum number of seconds that the job may run
+    (cf. qsub -l h_rt=<...>)
+
+  array_dependency
+    If set to true, each task of this array job only waits for the tasks with
+    the same index of the array jobs in deps
+    (cf. qsub -hold_jid_ad <...>)
+
+  start_after
+    If set, the datetime before which the job must not be started
+    (cf. qsub -a <...>)
+
 
   Returns the job id assigned to this job (integer)
   """
@@ -214,11 +351,17 @@ def qsub(command, queue=None, cwd=True, name=None, deps=[], stdout='',
 
   if pe_opt: scmd += ['-pe'] + pe_opt.split()
 
+  if priority: scmd += ['-p', '%d' % priority]
+
+  if walltime: scmd += ['-l', 'h_rt=%d' % walltime]
+
+  if start_after: scmd += ['-a', start_after.strftime('%Y%m%d%H%M.%S')]
+
   if cwd: scmd += ['-cwd']
 
   if name: scmd += ['-N', name]
 
-  if deps: scmd += ['-hold_jid', ','.join(['%d' % k for k in deps])]
+  if deps: scmd += ['-hold_jid_ad' if array_dependency else '-hold_jid', ','.join(['%d' % k for k in deps])]
 
   if stdout:
 